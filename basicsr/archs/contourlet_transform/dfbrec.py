@@ -78,18 +78,18 @@ def dfbrec(y, fname):
 
         # Recombine subband outputs to the next level
 
-        for l in xrange(n, 2, -1):
+        for l in range(n, 2, -1):
             y_old = y[:]
             y = [[None]] * 2**(l - 1)
 
             # The first half channels use R1 and R2
-            for k in xrange(0, 2**(l - 2)):
+            for k in range(0, 2**(l - 2)):
                 i = mod(k, 2)
                 y[k] = fbrec(y_old[2 * k], y_old[2 * k + 1],
                              f0[i], f1[i], 'pq', i, 'per')
             # The second half channels use R3 and R4
-            for k in xrange(2**(l - 2), 2**(l - 1)):
-                i = mod(k - 1, 2) + 2
+            for k in range(2**(l - 2), 2**(l - 1)):
+                i = mod(k, 2) + 2
                 y[k] = fbrec(y_old[2 * k], y_old[2 * k + 1],
                              f0[i], f1[i], 'pq', i, 'per')
 
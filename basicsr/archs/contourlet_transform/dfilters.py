@@ -28,7 +28,7 @@ from .reverse2 import *
 from .dmaxflat import *
 
 
-def dfilters(fname, type):
+def dfilters(fname, type, legacy=False):
     """ DFILTERS Generate directional 2D filters
     Input:
     fname:	Filter name.  Available 'fname' are:
@@ -46,6 +46,8 @@ def dfilters(fname, type):
     'dmaxflat': diamond maxflat filters obtained from a three stage ladder
 
      type:	'd' or 'r' for decomposition or reconstruction filters
+     legacy:	[optional] modulate the filters as the former MODULATE2 port
+            (a sign flip only, see MODULATE2), default is False
 
      Output:
         h0, h1:	diamond filter pair (lowpass and highpass)
@@ -147,7 +149,7 @@ def dfilters(fname, type):
                                hstack((h[len(h) - 2::-1, :],
                                        h[len(h) - 2::-1, len(h) - 2::-1]))))
 
-        h1 = modulate2(h0, 'b', None)
+        h1 = modulate2(h0, 'b', None, legacy)
         return h0, h1
     elif fname == "sk":  # by Shah and Kalker
         h = array([[0.621729, 0.161889, -0.0126949, -0.00542504, 0.00124838],
@@ -160,7 +162,7 @@ def dfilters(fname, type):
                                        h[len(h):0:-1, :])),
                                hstack((h[:, len(h):0:-1], h))))
 
-        h1 = modulate2(h0, 'b', None)
+        h1 = modulate2(h0, 'b', None, legacy)
         return h0, h1
 
     elif fname == "dvmlp":
@@ -185,10 +187,10 @@ def dfilters(fname, type):
                      b / q, -13 * b / (8 * q), 0, b / (8 * q), 0],
                     [-b1 / q, 0, 4 * b1 * q, 0, -14 * q * b1, 0, 28 * q * b1, 0, -35 * q * b1,
                      0, 28 * q * b1, 0, -14 * q * b1, 0, 4 * b1 * q, 0, -b1 / q]])
-        h1 = modulate2(g0, 'b', None)
+        h1 = modulate2(g0, 'b', None, legacy)
         h0 = h.copy()
         if str.lower(type[0]) == 'r':
-            h1 = modulate2(h, 'b', None)
+            h1 = modulate2(h, 'b', None, legacy)
             h0 = g0.copy()
         return h0, h1
 
@@ -202,9 +204,9 @@ def dfilters(fname, type):
                     -0.045635881557])
 
         if str.lower(type[0]) == 'd':
-            h1 = modulate2(g0, 'c', None)
+            h1 = modulate2(g0, 'c', None, legacy)
         else:
-            h1 = modulate2(h0, 'c', None)
+            h1 = modulate2(h0, 'c', None, legacy)
             h0 = g0.copy()
 
         # Use McClellan to obtain 2D filters
@@ -228,8 +230,8 @@ def dfilters(fname, type):
 
         # Synthesis filters
         if str.lower(type[0]) == 'r':
-            f0 = modulate2(h1, 'b', None)
-            f1 = modulate2(h0, 'b', None)
+            f0 = modulate2(h1, 'b', None, legacy)
+            f1 = modulate2(h0, 'b', None, legacy)
             h0 = f0.copy()
             h1 = f1.copy()
         return h0, h1
@@ -247,8 +249,8 @@ def dfilters(fname, type):
 
         # Synthesis filters
         if str.lower(type[0]) == 'r':
-            f0 = modulate2(h1, 'b', None)
-            f1 = modulate2(h0, 'b', None)
+            f0 = modulate2(h1, 'b', None, legacy)
+            f1 = modulate2(h0, 'b', None, legacy)
             h0 = f0
             h1 = f1
         return h0, h1
@@ -266,8 +268,8 @@ def dfilters(fname, type):
 
         # Synthesis filters
         if srtring.lower(type[0]) == 'r':
-            f0 = modulate2(h1, 'b', None)
-            f1 = modulate2(h0, 'b', None)
+            f0 = modulate2(h1, 'b', None, legacy)
+            f1 = modulate2(h0, 'b', None, legacy)
             h0 = f0
             h1 = f1
         return h0, h1
@@ -285,8 +287,8 @@ def dfilters(fname, type):
 
         # Synthesis filters
         if str.lower(type[0]) == 'r':
-            f0 = modulate2(h1, 'b', None)
-            f1 = modulate2(h0, 'b', None)
+            f0 = modulate2(h1, 'b', None, legacy)
+            f1 = modulate2(h0, 'b', None, legacy)
             h0 = f0
             h1 = f1
         return h0, h1
@@ -296,7 +298,7 @@ def dfilters(fname, type):
         flength = 30
 
         h0 = firwin(flength + 1, 0.5)
-        h1 = modulate2(h0, 'c', None)
+        h1 = modulate2(h0, 'c', None, legacy)
 
         # Use McClellan to obtain 2D filters
         t = array([[0, 1, 0], [1, 0, 1], [0, 1, 0]]) / 4.0  # diamond kernel
@@ -312,7 +314,7 @@ def dfilters(fname, type):
                                    [sqrt(15), 5, 0],
                                    [0, -3, -sqrt(15)]]).conj().T
 
-        h1 = -reverse2(modulate2(h0, 'b', None))
+        h1 = -reverse2(modulate2(h0, 'b', None, legacy))
 
         if str.lower(type[0]) == 'r':
             # Reverse filters for reconstruction
@@ -345,7 +347,7 @@ def dfilters(fname, type):
         c = sum(h)
         h = sqrt(2) * h / c
         h0 = h * w
-        h1 = modulate2(h0, 'b', None)
+        h1 = modulate2(h0, 'b', None, legacy)
         return h0, h1
         #h0 = modulate2(h,'r');
         #h1 = modulate2(h,'b');
@@ -367,7 +369,7 @@ def dfilters(fname, type):
                    [.001353, 0.005635, -0.001231, -0.009052,
                     -0.002668, 0.000596]])
         h0 = h / sum(h)
-        h1 = modulate2(h0, 'b', None)
+        h1 = modulate2(h0, 'b', None, legacy)
         return h0, h1
 
         #h0 = modulate2(h,'r');
@@ -389,10 +391,10 @@ def dfilters(fname, type):
         h0 = sqrt(2) * h0 / sum(h0)
         g0 = sqrt(2) * g0 / sum(g0)
 
-        h1 = modulate2(g0, 'b', None)
+        h1 = modulate2(g0, 'b', None, legacy)
 
         if str.lower(type[0]) == 'r':
-            h1 = modulate2(h0, 'b', None)
+            h1 = modulate2(h0, 'b', None, legacy)
             h0 = g0.copy()
         return h0, h1
 
@@ -413,9 +415,9 @@ def dfilters(fname, type):
         h0 = sqrt(2) * h0 / sum(h0)
         g0 = sqrt(2) * g0 / sum(g0)
 
-        h1 = modulate2(g0, 'b', None)
+        h1 = modulate2(g0, 'b', None, legacy)
         if str.lower(type[0]) == 'r':
-            h1 = modulate2(h0, 'b', None)
+            h1 = modulate2(h0, 'b', None, legacy)
             h0 = g0.copy()
         return h0, h1
 
@@ -436,9 +438,9 @@ def dfilters(fname, type):
         h0 = sqrt(2) * h0 / sum(h0)
         g0 = sqrt(2) * g0 / sum(g0)
 
-        h1 = modulate2(g0, 'b', None)
+        h1 = modulate2(g0, 'b', None, legacy)
         if str.lower(type[0]) == 'r':
-            h1 = modulate2(h0, 'b', None)
+            h1 = modulate2(h0, 'b', None, legacy)
             h0 = g0.copy()
         return h0, h1
     elif fname == "dmaxflat7":
@@ -458,8 +460,8 @@ def dfilters(fname, type):
         h0 = sqrt(2) * h0 / sum(h0)
         g0 = sqrt(2) * g0 / sum(g0)
 
-        h1 = modulate2(g0, 'b', None)
+        h1 = modulate2(g0, 'b', None, legacy)
         if str.lower(type[0]) == 'r':
-            h1 = modulate2(h0, 'b', None)
+            h1 = modulate2(h0, 'b', None, legacy)
             h0 = g0.copy()
         return h0, h1
@@ -1,6 +1,6 @@
 from numpy import *
-from dup import *
-from sefilter2 import *
+from .dup import *
+from .sefilter2 import *
 
 def lprec(c, d, h, g):
     """ LPDEC   Laplacian Pyramid Reconstruction
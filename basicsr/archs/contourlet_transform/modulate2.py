@@ -22,14 +22,17 @@ from numpy import *
 from scipy import signal
 
 
-def modulate2(x, type_, center):
+def modulate2(x, type_, center, legacy=False):
     """ MODULATE2 2D modulation
-    y = modulate2(x, type, [center])
+    y = modulate2(x, type, [center], [legacy])
 
     With TYPE = {'r', 'c' or 'b'} for modulate along the row, or column or
     both directions.
     CENTER especify the origin of modulation as
-    floor(size(x)/2)+center(default is [0, 0])"""
+    floor(size(x)/2)+center(default is [0, 0])
+    LEGACY reproduces the former port, which only computed the modulation
+    sign of the last sample of each dimension and multiplied the whole
+    filter by it. The filters of the trained models were built with it."""
 
     if center is None:
         center = array([[0, 0]])
@@ -43,16 +46,22 @@ def modulate2(x, type_, center):
 
     #o = floor(s / 2) + 1 + center
     o = floor(s / 2.0) + center
-    n1 = array([s[0][0]]) - o[0][0]
-    n2 = array([s[0][1]]) - o[0][1]
+    if legacy:
+        n1 = array([s[0][0]]) - o[0][0]
+        n2 = array([s[0][1]]) - o[0][1]
+    else:
+        n1 = arange(s[0][0]) - o[0][0]
+        n2 = arange(s[0][1]) - o[0][1]
+        # Column vector of the row signs, row vector of the column signs
+        n1, n2 = n1[newaxis, :], n2[newaxis, :]
 
     if str.lower(type_[0]) == 'r':
         m1 = (-1)**n1
-        y = x * tile(m1.conj().T, s[0][1])
+        y = x * m1.conj().T
 
     elif str.lower(type_[0]) == 'c':
         m2 = (-1)**n2
-        y = x * tile(m2, s[0])
+        y = x * m2
 
     elif str.lower(type_[0]) == 'b':
         m1 = (-1)**n1
@@ -19,9 +19,13 @@
 #    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
 from numpy import *
+from .pfilters import pfilters
+from .dfbrec import dfbrec
+from .lprec import lprec
+from .wfb2rec import wfb2rec
 
 
-def pdfbrec(y, pfilt, dfilt)
+def pdfbrec(y, pfilt, dfilt):
     """% PDFBREC   Pyramid Directional Filterbank Reconstruction
     %
     %	x = pdfbrec(y, pfilt, dfilt)
@@ -35,30 +39,33 @@ def pdfbrec(y, pfilt, dfilt)
     % Output:
     %   x:      reconstructed image
     %
-    % See also: PFILTERS, DFILTERS, PDFBDEC"""
+    % See also: PFILTERS, DFILTERS, PDFBDEC
+    %
+    % For batches of images on the GPU, see batch_multi_channel_pdfbrec in
+    % pycontourlet."""
 
     n = len(y) - 1
     if n <= 0:
         x = y[0]
     else:
-        'Recursive call to reconstruct the low band
+        # Recursive call to reconstruct the low band
         xlo = pdfbrec(y[0:-1], pfilt, dfilt)
-        'Get the pyramidal filters from the filter name
+        # Get the pyramidal filters from the filter name
         h, g = pfilters(pfilt)
-        'Process the detail subbands
+        # Process the detail subbands
         if len(y[-1]) != 3:
-            ' Reconstruct the bandpass image from DFB
-            ' Decide the method based on the filter name
+            # Reconstruct the bandpass image from DFB
+            # Decide the method based on the filter name
 
             if dfilt == 'pkva6' or dfilt == 'pkva8' or dfilt == 'pkva12' or dfilt == 'pkva':
-                ' Use the ladder structure(much more efficient)
+                # Use the ladder structure (much more efficient)
                 xhi = dfbrec_l(y[-1], dfilt)
             else:
-                ' General case
+                # General case
                 xhi = dfbrec(y[-1], dfilt)
             x = lprec(xlo, xhi, h, g)
         else:
-            ' Special case: length(y{end}) == 3
-            ' Perform one - level 2 - D critically sampled wavelet filter bank
+            # Special case: length(y{end}) == 3
+            # Perform one-level 2-D critically sampled wavelet filter bank
             x = wfb2rec(xlo, y[-1][0], y[-1][1], y[-1][2], h, g)
     return x
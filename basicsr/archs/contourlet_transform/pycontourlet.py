@@ -1,18 +1,30 @@
-from numpy import *
-from scipy import signal
-from .dfilters import dfilters
-from .modulate2 import modulate2
-import pyximport
+import functools
 import numpy as np
-pyximport.install(setup_args={'include_dirs': np.get_include()})
-from .resamp4c import resamp4c
+from collections import OrderedDict
 import torch
+import torch.fft
+from torch import nn as nn
 from torch.nn import functional as F
 
-def batch_multi_channel_pdfbdec(x, pfilt="maxflat", dfilt="dmaxflat7", nlevs=[0, 3, 3, 3], device=torch.device("cpu")):
+from .dfilters import dfilters
+from .ldfilter import ldfilter
+from .modulate2 import modulate2
+from .resampc import resampc
+
+# Frame size (h * w) from which `batch_multi_channel_pdfbdec` filters in the
+# frequency domain with backend='auto'
+FFT_MIN_PIXELS = 64 * 64
+
+
+def batch_multi_channel_pdfbdec(x, pfilt="maxflat", dfilt="dmaxflat7", nlevs=[0, 3, 3, 3], device=None,
+                                filter_bank=None, batched_dfb=True, backend='auto'):
     """Multi-channel pyramidal directional filter bank decomposition
      for a batch of images.
 
+        All the filtering, extension and resampling steps are torch ops, so
+        the decomposition runs on the device of the input (or `device`) and
+        is differentiable with respect to `x`.
+
         Parameters
         ----------
         x : 4D Tensor
@@ -38,52 +50,84 @@ def batch_multi_channel_pdfbdec(x, pfilt="maxflat", dfilt="dmaxflat7", nlevs=[0,
                  n_levs = [0, 3, 3, 3]
                  num_subbands = [(1+3)*3, (2^3)*3, (2^3)*3, (2^3)*3]
                               = [12, 24, 24, 24]
-        device : torch.device, default=torch.device("cpu")
-            The device to store and compute Torch tensor.
-            Either "cpu" or "cuda".
+        device : torch.device | None, default=None
+            The device to compute the decomposition on. If None, the device
+            of `x` is used.
+        filter_bank : ContourletFilterBank | None, default=None
+            Precomputed filters for `pfilt`, `dfilt` and `nlevs`. If None, a
+            process-wide cached filter bank for the dtype and device of `x`
+            is used.
+        batched_dfb : bool, default=True
+            Run the directional filter bank with `dfbdec_batched` (one grouped
+            convolution per tree level) instead of the subband by subband
+            `dfbdec`. Both give the same subbands. Ignored when exporting
+            to ONNX, whose graphs use `dfbdec`.
+        backend : str, default='auto'
+            'conv' filters with spatial convolutions, 'fft' with products of
+            the filter spectra of the frame size (`pdfb_level_fft`), which
+            cost the same for any filter size. 'auto' selects 'fft' for the
+            pyramidal levels of at least `FFT_MIN_PIXELS` pixels, except for
+            ONNX export. Both give the same subbands (and gradients) up to
+            float rounding. Levels of odd sizes and the ladder DFB (pkva
+            filters) always use convolutions.
 
         Returns
         -------
-        coefs : dictionary of 4D numpy array
-            Dictionary containing the coefficients obtained from the
-            decomposition, with each level as the key. The index key
-            starts is the numpy array shape.
-            The dictionary is in the following format:
-                ```coefs[level]```
+        coefs : list of 4D Tensor
+            The coarse approximation followed by one list of directional
+            subbands per pyramidal level, from coarse to fine-scale.
             Here's an example with a batch of 2 images with 3 channels,
             and the following settings:
                 >>> x.shape
                 torch.Size([2, 3, 224, 224])
                 >>> y = batch_multi_channel_pdfbdec(x, n_levs=[0, 3, 3, 3])
             This will yield:
-                >>> y[(2, 3, 14, 14)].shape
-                (2, 3, 14, 14)
-                >>> y[(2, 3, 14, 28)].shape
-                (2, 3, 14, 28)
-                >>> y[(2, 3, 28, 14)].shape
-                (2, 3, 28, 14)
-                >>> y[(2, 3, 56, 28)].shape
-                (2, 3, 56, 28)
-                >>> y[(2, 3, 56, 112)].shape
-                (2, 3, 56, 112)
-                >>> y[(2, 3, 112, 56)].shape
-                (2, 3, 112, 56)
+                >>> y[0].shape
+                torch.Size([2, 3, 14, 14])
+                >>> y[1][0].shape
+                torch.Size([2, 3, 14, 14])
+                >>> y[2][0].shape, y[2][4].shape
+                (torch.Size([2, 3, 14, 28]), torch.Size([2, 3, 28, 14]))
+                >>> y[4][0].shape, y[4][4].shape
+                (torch.Size([2, 3, 56, 112]), torch.Size([2, 3, 112, 56]))
     """
+    if device is not None:
+        x = x.to(device)
+    if not x.is_floating_point():
+        x = x.float()
+
+    if filter_bank is None:
+        filter_bank = get_filter_bank(pfilt, dfilt, nlevs, x.dtype, x.device)
+
     if len(nlevs) == 0:
         y = [x]
     else:
-        # Get the pyramidal filters from the filter name
-        h, g = pfilters(pfilt)
-        if nlevs[-1] != 0:
+        # Get the pyramidal filters from the filter bank
+        h, g = filter_bank.h, filter_bank.g
+        if backend == 'auto':
+            use_fft = x.shape[2] * x.shape[3] >= FFT_MIN_PIXELS and not torch.onnx.is_in_onnx_export()
+        else:
+            use_fft = backend == 'fft'
+        # (the spectrum folding of the downsampling needs even sizes)
+        use_fft = use_fft and x.shape[2] % 2 == 0 and x.shape[3] % 2 == 0
+        ladder = dfilt == 'pkva6' or dfilt == 'pkva8' or dfilt == 'pkva12' or dfilt == 'pkva'
+        if use_fft and not ladder:
+            # Laplacian and directional (or wavelet) stages in the frequency domain
+            xlo, xhi_dir = pdfb_level_fft(x, nlevs[-1], filter_bank)
+        elif nlevs[-1] != 0:
             # Laplacian decomposition
-            xlo, xhi = lpdec(x, h, g, device=device)
+            xlo, xhi = lpdec(x, h, g)
             # DFB on the bandpass image
-            if dfilt == 'pkva6' or dfilt == 'pkva8' or dfilt == 'pkva12' or dfilt == 'pkva':
+            if ladder:
                 # Use the ladder structure (whihc is much more efficient)
-                xhi_dir = dfbdec_l(xhi, dfilt, nlevs[-1])
+                xhi_dir = dfbdec_l(xhi, dfilt, nlevs[-1], filter_bank=filter_bank)
+            elif batched_dfb and not torch.onnx.is_in_onnx_export():
+                # General case, all the subbands of a tree level at once
+                # (with index maps of a fixed shape, so not for ONNX graphs with dynamic sizes)
+                xhi_dir = dfbdec_batched(xhi, dfilt, nlevs[-1], filter_bank=filter_bank)
             else:
                 # General case
-                xhi_dir = dfbdec(xhi, dfilt, nlevs[-1])
+                xhi_dir = dfbdec(xhi, dfilt, nlevs[-1], filter_bank=filter_bank)
 
         else:
             # Special case: nlevs(end) == 0
@@ -94,23 +138,106 @@ def batch_multi_channel_pdfbdec(x, pfilt="maxflat", dfilt="dmaxflat7", nlevs=[0,
             xhi_dir.append(xHH)
 
         # Recursive call on the low band
-        ylo = batch_multi_channel_pdfbdec(xlo, pfilt, dfilt, nlevs[0:-1])
+        ylo = batch_multi_channel_pdfbdec(xlo, pfilt, dfilt, nlevs[0:-1], filter_bank=filter_bank,
+                                          batched_dfb=batched_dfb, backend=backend)
 
         # Add bandpass directional subbands to the final output
         y = ylo[:]
         y.append(xhi_dir)
-        
+
     return y
 
-def dfbdec(x, fname, n, device=torch.device("cpu")):
+
+def batch_multi_channel_pdfbrec(y, pfilt="maxflat", dfilt="dmaxflat7", filter_bank=None, batched_dfb=True):
+    """Multi-channel pyramidal directional filter bank reconstruction
+     for a batch of images.
+
+        The inverse of `batch_multi_channel_pdfbdec`: with the same filters,
+        the subbands of a decomposition give back its input, up to float
+        rounding. Everything runs with torch ops on the device of the
+        subbands, so they can be processed and reconstructed without leaving
+        the GPU.
+
+        Parameters
+        ----------
+        y : list
+            Subbands in the layout of `batch_multi_channel_pdfbdec`: the
+            coarse approximation followed by one list of directional subbands
+            per pyramidal level, from coarse to fine-scale.
+        pfilt: str, default="maxflat"
+            Filter name for the pyramidal reconstruction step
+        dfilt: str, default="dmaxflat7"
+            Filter name for the directional reconstruction step
+        filter_bank : ContourletFilterBank | None, default=None
+            The filter bank of the decomposition, whose `nlevs` are the
+            levels of the subbands. Directional subbands of the McClellan
+            filters can only be reconstructed with `legacy_filters=False`
+            (the ladder filters have no legacy variant). If None, the default
+            filter bank of `batch_multi_channel_pdfbdec` is used, which has
+            the legacy filters: pass a ContourletFilterBank(...,
+            legacy_filters=False) to both functions to reconstruct
+            directional subbands.
+        batched_dfb : bool, default=True
+            Run the directional filter bank with `dfbrec_batched` (one grouped
+            convolution per tree level) instead of the subband by subband
+            `dfbrec`. Both give the same images. The ladder DFB (pkva
+            filters) always runs `dfbrec_l`.
+
+        Returns
+        -------
+        x : 4D Tensor
+            Reconstructed images, (batch_size, channel_size, height, width).
+
+        Raises
+        ------
+        ValueError
+            If `filter_bank` (or the default one) has the legacy filters
+            and there are directional subbands, or its levels are not the
+            ones of the subbands.
+    """
+    if len(y) <= 1:
+        return y[0]
+
+    # 3 subbands for a wavelet level, 2^n for a DFB with n levels
+    nlevs = [0 if len(level) == 3 else int(np.log2(len(level))) for level in y[1:]]
+    if filter_bank is None:
+        # Same filter bank as the default one of the decomposition
+        filter_bank = get_filter_bank(pfilt, dfilt, nlevs, y[0].dtype, y[0].device)
+    _check_invertible(filter_bank, nlevs)
+    dfilt = filter_bank.dfilt
+
+    # Get the pyramidal filters from the filter bank
+    h, g = filter_bank.h, filter_bank.g
+    # From coarse to fine scale
+    x = y[0]
+    for level in y[1:]:
+        if len(level) != 3:
+            # Reconstruct the bandpass image from DFB
+            if dfilt == 'pkva6' or dfilt == 'pkva8' or dfilt == 'pkva12' or dfilt == 'pkva':
+                # Ladder structure, its tree levels are grouped as in the decomposition
+                xhi = dfbrec_l(level, dfilt, filter_bank=filter_bank)
+            elif batched_dfb:
+                xhi = dfbrec_batched(level, dfilt, filter_bank=filter_bank)
+            else:
+                xhi = dfbrec(level, dfilt, filter_bank=filter_bank)
+            x = lprec(x, xhi, h, g)
+        else:
+            # Special case: one-level 2-D critically sampled wavelet filter bank
+            x = wfb2rec(x, level[0], level[1], level[2], h, g)
+    return x
+
+
+def dfbdec(x, fname, n, filter_bank=None):
     """ DFBDEC   Directional Filterbank Decomposition
 
-    y = dfbdec(x, fname, n)
+    y = dfbdec(x, fname, n, [filter_bank])
 
     Input:
     x:      input image
     fname:  filter name to be called by DFILTERS
     n:      number of decomposition tree levels
+    filter_bank: [optional] ContourletFilterBank holding the filters of
+            `fname` (default is the cached one for the dtype/device of x)
 
     Output:
     y:      subband images in a cell vector of length 2^n
@@ -125,17 +252,16 @@ def dfbdec(x, fname, n, device=torch.device("cpu")):
     if n == 0:
         # No decomposition, simply copy input to output
         y = [None]
-        y[0] = x.copy()
+        y[0] = x.clone()
         return y
 
-    # Get the diamond-shaped filters
-    h0, h1 = dfilters(fname, 'd')
+    if filter_bank is None:
+        filter_bank = get_filter_bank(None, fname, [n], x.dtype, x.device)
 
     # Fan filters for the first two levels
     # k0: filters the first dimension (row)
     # k1: filters the second dimension (column)
-    k0 = modulate2(h0, 'c', None)
-    k1 = modulate2(h1, 'c', None)
+    k0, k1 = filter_bank.k0, filter_bank.k1
     # Tree-structured filter banks
     if n == 1:
         # Simplest case, one level
@@ -150,7 +276,7 @@ def dfbdec(x, fname, n, device=torch.device("cpu")):
         y[0], y[1] = fbdec(x0, k0, k1, 'q', '2c', 'qper_col')
         y[2], y[3] = fbdec(x1, k0, k1, 'q', '2c', 'qper_col')
         # Fan filters from diamond filters
-        f0, f1 = ffilters(h0, h1)
+        f0, f1 = filter_bank.f0, filter_bank.f1
         # Now expand the rest of the tree
         for l in range(3, n + 1):
             # Allocate space for the new subband outputs
@@ -158,12 +284,12 @@ def dfbdec(x, fname, n, device=torch.device("cpu")):
             y = [[None]] * 2**l
             # The first half channels use R1 and R2
             for k in range(0, 2**(l - 2)):
-                i = mod(k, 2)
+                i = k % 2
                 y[2 * k], y[2 * k + 1] = fbdec(y_old[k],
                                                f0[i], f1[i], 'pq', i, 'per')
             # The second half channels use R3 and R4
             for k in range(2**(l - 2), 2**(l - 1)):
-                i = mod(k, 2) + 2
+                i = k % 2 + 2
                 y[2 * k], y[2 * k + 1] = fbdec(y_old[k],
                                                f0[i], f1[i], 'pq', i, 'per')
     # Back sampling (so that the overal sampling is separable)
@@ -174,7 +300,290 @@ def dfbdec(x, fname, n, device=torch.device("cpu")):
 
     return y
 
-def pfilters(fname, device=torch.device("cpu")):
+
+def dfbdec_batched(x, fname, n, filter_bank=None):
+    """DFBDEC with the tree levels run as a batched graph.
+
+    y = dfbdec_batched(x, fname, n, [filter_bank])
+
+    Gives the same subbands as DFBDEC, but all the subbands of a tree level
+    are stacked along the channel axis and filtered by one depthwise conv2d.
+    The extension, resampling and quincunx downsampling steps around that
+    convolution are pure index shuffles, so they are folded into a single
+    gather per level with index maps from `ContourletFilterBank.dfb_plan`.
+
+    See also: DFBDEC"""
+    if n == 0:
+        return [x.clone()]
+
+    if filter_bank is None:
+        filter_bank = get_filter_bank(None, fname, [n], x.dtype, x.device)
+
+    # int sizes, the plan is a constant of the shape (also when tracing)
+    b, c, h, w = x.shape
+    plan = filter_bank.dfb_plan(n, int(c), int(h), int(w), x.dtype, x.device)
+    buffers = [x.reshape(b, -1)]
+    for level in plan['levels']:
+        outs = []
+        for group in level:
+            xext = buffers[group['source']].index_select(1, group['index']).view(b, *group['shape'])
+            y = F.conv2d(xext, group['weight'], groups=group['shape'][0])
+            outs.append(y.reshape(b, -1))
+        buffers = outs
+
+    y = []
+    for source, index, shapes in plan['outputs']:
+        out = buffers[source].index_select(1, index)
+        sizes = [int(np.prod(shape)) for shape in shapes]
+        y.extend(t.view(b, *shape) for t, shape in zip(out.split(sizes, dim=1), shapes))
+    return y
+
+
+def dfbdec_l(x, fname, n, filter_bank=None):
+    """ DFBDEC_L   Directional Filterbank Decomposition using Ladder Structure
+
+    y = dfbdec_l(x, fname, n, [filter_bank])
+
+    Input:
+    x:      input image
+    fname:  ladder filter name to be called by LDFILTER ('pkva6', 'pkva8',
+            'pkva12' or 'pkva')
+    n:      number of decomposition tree levels
+    filter_bank: [optional] ContourletFilterBank holding the ladder filter
+            of `fname` (default is the cached one for the dtype/device of x)
+
+    Output:
+    y:      subband images in a cell vector of length 2^n
+
+    Note:
+    The two-channel filter banks of a tree level that share the sampling
+    type and input shape run as one FBDEC_L on their channels stacked.
+
+    See also: DFBDEC, FBDEC_L, LDFILTER"""
+    if n == 0:
+        return [x.clone()]
+
+    if filter_bank is None:
+        filter_bank = get_filter_bank(None, fname, [n], x.dtype, x.device)
+    f = filter_bank.ld
+
+    if n == 1:
+        # Simplest case, one level
+        y = list(fbdec_l(x, f, 'q', '1r', 'qper_col'))
+    else:
+        # For the cases that n >= 2
+        # First level
+        x0, x1 = fbdec_l(x, f, 'q', '1r', 'qper_col')
+        # Second level
+        y = [None] * 4
+        (y[1], y[0]), (y[3], y[2]) = _fbdec_l_level([x0, x1], f, [('q', '2c', 'per')] * 2)
+        # Now expand the rest of the tree
+        for l in range(3, n + 1):
+            # The first half channels use R1 and R2, the second half R3 and R4
+            args = [('p', k % 2 if k < 2**(l - 2) else k % 2 + 2, 'per') for k in range(2**(l - 1))]
+            y = [t for y0, y1 in _fbdec_l_level(y, f, args) for t in (y1, y0)]
+
+    # Backsampling
+    y = backsamp(y)
+    # Flip the order of the second half channels
+    y[2**(n - 1)::] = y[::-1][:2**(n - 1)]
+    return y
+
+
+def _fbdec_l_level(xs, f, args):
+    """FBDEC_L of every image of `xs` with its (type1, type2, extmod) of
+    `args`. Images of the same arguments and shape are stacked along the
+    channels and go through one FBDEC_L."""
+    groups = {}
+    for k, x in enumerate(xs):
+        groups.setdefault((args[k], tuple(x.shape)), []).append(k)
+    y = [None] * len(xs)
+    for (arg, shape), ks in groups.items():
+        y0, y1 = fbdec_l(torch.cat([xs[k] for k in ks], dim=1), f, *arg)
+        for k, t0, t1 in zip(ks, y0.split(shape[1], dim=1), y1.split(shape[1], dim=1)):
+            y[k] = (t0, t1)
+    return y
+
+
+def dfbrec(y, fname, filter_bank=None):
+    """ DFBREC   Directional Filterbank Reconstruction
+
+    x = dfbrec(y, fname, [filter_bank])
+
+    Input:
+    y:      subband images in a cell vector of length 2^n
+    fname:  filter name to be called by DFILTERS
+    filter_bank: [optional] ContourletFilterBank holding the filters of
+            `fname`, with legacy_filters=False (default is the cached one
+            of DFBDEC for the dtype/device of y, whose legacy filters
+            cannot be inverted)
+
+    Output:
+    x:      reconstructed image
+
+    See also: DFBDEC, FBREC, DFILTERS"""
+    n = int(np.log2(len(y)))
+    if n == 0:
+        # Simply copy input to output
+        return y[0].clone()
+
+    if filter_bank is None:
+        filter_bank = get_filter_bank(None, fname, [n], y[0].dtype, y[0].device)
+    _check_invertible(filter_bank)
+
+    # Fan filters for the first two levels
+    k0, k1 = filter_bank.rk0, filter_bank.rk1
+
+    # Flip back the order of the second half channels
+    y = list(y)
+    y[2**(n - 1)::] = y[::-1][:2**(n - 1)]
+    # Undo backsampling
+    y = rebacksamp(y)
+
+    if n == 1:
+        # Simplest case, one level
+        return fbrec(y[0], y[1], k0, k1, 'q', '1r', 'per')
+
+    # Fan filters from diamond filters
+    f0, f1 = filter_bank.rf0, filter_bank.rf1
+    # Recombine subband outputs to the next level
+    for l in range(n, 2, -1):
+        y_old = y
+        y = [None] * 2**(l - 1)
+        # The first half channels use R1 and R2, the second half R3 and R4
+        for k in range(0, 2**(l - 1)):
+            i = k % 2 if k < 2**(l - 2) else k % 2 + 2
+            y[k] = fbrec(y_old[2 * k], y_old[2 * k + 1], f0[i], f1[i], 'pq', i, 'per')
+    # Second level
+    x0 = fbrec(y[0], y[1], k0, k1, 'q', '2c', 'qper_col')
+    x1 = fbrec(y[2], y[3], k0, k1, 'q', '2c', 'qper_col')
+    # First level
+    return fbrec(x0, x1, k0, k1, 'q', '1r', 'per')
+
+
+def dfbrec_batched(y, fname, filter_bank=None):
+    """DFBREC with the tree levels run as a batched graph.
+
+    x = dfbrec_batched(y, fname, [filter_bank])
+
+    Gives the same image as DFBREC. As in DFBDEC_BATCHED, the pairs of
+    subbands of a tree level are filtered by one depthwise conv2d, and the
+    upsampling, extension and resampling steps are folded into one gather
+    per level. The outputs of a level are concatenated in one buffer, after a
+    zero that the upsampled holes point to.
+
+    See also: DFBREC, DFBDEC_BATCHED"""
+    n = int(np.log2(len(y)))
+    if n == 0:
+        return y[0].clone()
+
+    if filter_bank is None:
+        filter_bank = get_filter_bank(None, fname, [n], y[0].dtype, y[0].device)
+    _check_invertible(filter_bank)
+
+    # Image size, from the shapes of the first subbands of both halves
+    b, c = y[0].shape[:2]
+    h, w = _dfb_image_size(n, y[0].shape, y[-1].shape)
+    plan = filter_bank.dfb_rec_plan(n, int(c), h, w, y[0].dtype, y[0].device)
+    buffer = torch.cat([y[0].new_zeros(b, 1)] + [t.reshape(b, -1) for t in y], dim=1)
+    for level in plan['levels']:
+        outs = [buffer.new_zeros(b, 1)]
+        for group in level:
+            xext = buffer.index_select(1, group['index']).view(b, *group['shape'])
+            # Sum of the two channels of every pair
+            x = F.conv2d(xext, group['weight'], groups=group['shape'][0])
+            outs.append(x.view(b, group['shape'][0] // 2, 2, -1).sum(dim=2).reshape(b, -1))
+        buffer = torch.cat(outs, dim=1)
+    return buffer.index_select(1, plan['output']).view(b, c, h, w)
+
+
+def dfbrec_l(y, fname, filter_bank=None):
+    """ DFBREC_L   Directional Filterbank Reconstruction using Ladder Structure
+
+    x = dfbrec_l(y, fname, [filter_bank])
+
+    Input:
+    y:      subband images in a cell vector of length 2^n
+    fname:  ladder filter name to be called by LDFILTER ('pkva6', 'pkva8',
+            'pkva12' or 'pkva')
+    filter_bank: [optional] ContourletFilterBank holding the ladder filter
+            of `fname` (default is the cached one for the dtype/device of y)
+
+    Output:
+    x:      reconstructed image
+
+    Note:
+    The ladder structure is inverted exactly with the same filter. As in
+    DFBDEC_L, the two-channel filter banks of a tree level that share the
+    sampling type and input shape run as one FBREC_L.
+
+    See also: DFBDEC_L, FBREC_L, LDFILTER"""
+    n = int(np.log2(len(y)))
+    if n == 0:
+        # Simply copy input to output
+        return y[0].clone()
+
+    if filter_bank is None:
+        filter_bank = get_filter_bank(None, fname, [n], y[0].dtype, y[0].device)
+    f = filter_bank.ld
+
+    # Flip back the order of the second half channels
+    y = list(y)
+    y[2**(n - 1)::] = y[::-1][:2**(n - 1)]
+    # Undo backsampling
+    y = rebacksamp(y)
+
+    if n == 1:
+        # Simplest case, one level
+        return fbrec_l(y[0], y[1], f, 'q', '1r', 'qper_col')
+
+    # Recombine subband outputs to the next level
+    for l in range(n, 2, -1):
+        # The first half channels use R1 and R2, the second half R3 and R4
+        args = [('p', k % 2 if k < 2**(l - 2) else k % 2 + 2, 'per') for k in range(2**(l - 1))]
+        y = _fbrec_l_level([(y[2 * k + 1], y[2 * k]) for k in range(2**(l - 1))], f, args)
+    # Second level
+    x0, x1 = _fbrec_l_level([(y[1], y[0]), (y[3], y[2])], f, [('q', '2c', 'per')] * 2)
+    # First level
+    return fbrec_l(x0, x1, f, 'q', '1r', 'qper_col')
+
+
+def _fbrec_l_level(ys, f, args):
+    """FBREC_L of every pair of subbands of `ys` with its (type1, type2,
+    extmod) of `args`, grouped as in _FBDEC_L_LEVEL."""
+    groups = {}
+    for k, (y0, _) in enumerate(ys):
+        groups.setdefault((args[k], tuple(y0.shape)), []).append(k)
+    x = [None] * len(ys)
+    for (arg, shape), ks in groups.items():
+        xs = fbrec_l(torch.cat([ys[k][0] for k in ks], dim=1), torch.cat([ys[k][1] for k in ks], dim=1), f, *arg)
+        for k, t in zip(ks, xs.split(shape[1], dim=1)):
+            x[k] = t
+    return x
+
+
+def _check_invertible(filter_bank, nlevs=None):
+    """Raise a ValueError if the reconstruction with `filter_bank` cannot
+    invert the decomposition of `nlevs` levels (its directional subbands if
+    None) with the same filter bank."""
+    if nlevs is not None and list(filter_bank.nlevs) != list(nlevs):
+        raise ValueError(f'The subbands have the levels {list(nlevs)}, but the filter bank is {filter_bank}.')
+    # (the ladder filters have no legacy variant)
+    ladder = filter_bank.dfilt is not None and filter_bank.dfilt.startswith('pkva')
+    if filter_bank.legacy_filters and not ladder and (nlevs is None or any(n > 0 for n in nlevs)):
+        raise ValueError('The DFB with legacy filters cannot be inverted, decompose and reconstruct '
+                         'with a ContourletFilterBank(..., legacy_filters=False).')
+
+
+def _dfb_image_size(n, first, last):
+    """Size (h, w) of the image whose DFBDEC with n levels has the subbands
+    of shapes `first` (first subband) and `last` (last subband)."""
+    if n == 1:
+        return int(first[2]) * 2, int(first[3])
+    return int(last[2]) * 2, int(first[3]) * 2
+
+
+def pfilters(fname):
     """ PFILTERS Generate filters for the laplacian pyramid
 
     Input:
@@ -185,40 +594,40 @@ def pfilters(fname, device=torch.device("cpu")):
     for separable pyramid"""
 
     if fname == "9/7" or fname == "9-7":
-        h = array([.037828455506995, -.023849465019380, -.11062440441842,
-                   .37740285561265])
-        h = hstack((h, .85269867900940, h[::-1]))
+        h = np.array([.037828455506995, -.023849465019380, -.11062440441842,
+                      .37740285561265])
+        h = np.hstack((h, .85269867900940, h[::-1]))
 
-        g = array([-.064538882628938, -.040689417609558, .41809227322221])
-        g = hstack((g, .78848561640566, g[::-1]))
+        g = np.array([-.064538882628938, -.040689417609558, .41809227322221])
+        g = np.hstack((g, .78848561640566, g[::-1]))
 
         return h, g
     elif fname == "maxflat":
-        M1 = 1 / sqrt(2)
+        M1 = 1 / np.sqrt(2)
         M2 = M1
-        k1 = 1 - sqrt(2)
+        k1 = 1 - np.sqrt(2)
         k2 = M1
         k3 = k1
-        h = array([.25 * k2 * k3, .5 * k2, 1 + .5 * k2 * k3]) * M1
-        h = hstack((h, h[len(h) - 2::-1]))
+        h = np.array([.25 * k2 * k3, .5 * k2, 1 + .5 * k2 * k3]) * M1
+        h = np.hstack((h, h[len(h) - 2::-1]))
 
-        g = array([-.125 * k1 * k2 * k3, 0.25 * k1 * k2, -0.5 * k1 - 0.5 * k3 - 0.375 * k1 * k2 * k3,
-                   1 + .5 * k1 * k2]) * M2
-        g = hstack((g, g[len(g) - 2::-1]))
+        g = np.array([-.125 * k1 * k2 * k3, 0.25 * k1 * k2, -0.5 * k1 - 0.5 * k3 - 0.375 * k1 * k2 * k3,
+                      1 + .5 * k1 * k2]) * M2
+        g = np.hstack((g, g[len(g) - 2::-1]))
         # Normalize
-        h = h * sqrt(2)
-        g = g * sqrt(2)
+        h = h * np.sqrt(2)
+        g = g * np.sqrt(2)
         return h, g
     elif fname == "5/3" or fname == "5-3":
-        h = [-1, 2, 6, 2, -1] / (4 * sqrt(2))
-        g = [1, 2, 1] / (2 * sqrt(2))
+        h = np.array([-1, 2, 6, 2, -1]) / (4 * np.sqrt(2))
+        g = np.array([1, 2, 1]) / (2 * np.sqrt(2))
         return h, g
     elif fname == "burt" or fname == "Burt":
-        h = array([0.6, 0.25, -0.05])
-        h = sqrt(2) * hstack((h[len(h):0:-1], h))
+        h = np.array([0.6, 0.25, -0.05])
+        h = np.sqrt(2) * np.hstack((h[len(h):0:-1], h))
 
-        g = array([17.0 / 28, 73.0 / 280, -3.0 / 56, -3.0 / 280])
-        g = sqrt(2) * hstack((g[len(g):0:-1], g))
+        g = np.array([17.0 / 28, 73.0 / 280, -3.0 / 56, -3.0 / 280])
+        g = np.sqrt(2) * np.hstack((g[len(g):0:-1], g))
         return h, g
     elif fname == "pkva":
         # filters from the ladder structure
@@ -228,11 +637,11 @@ def pfilters(fname, device=torch.device("cpu")):
         lf = len(beta)
         n = float(lf) / 2
 
-        if n != floor(n):
+        if n != np.floor(n):
             print("The input allpass filter must be even length")
 
         # beta(z^2)
-        beta2 = zeros(2 * lf - 1)
+        beta2 = np.zeros(2 * lf - 1)
         beta2[::2] = beta
 
         # H(z)
@@ -241,16 +650,17 @@ def pfilters(fname, device=torch.device("cpu")):
         h = h / 2
 
         # G(z)
-        g = -convolve(beta2, h)
+        g = -np.convolve(beta2, h)
         g[4 * n - 2] = g[4 * n - 2] + 1
         g[1:-1:2] = -g[1:-1:2]
 
         # Normalize
-        h = h * sqrt(2)
-        g = g * sqrt(2)
+        h = h * np.sqrt(2)
+        g = g * np.sqrt(2)
         return h, g
 
-def lpdec(x, h, g, device=torch.device("cpu")):
+
+def lpdec(x, h, g):
     """ LPDEC   Laplacian Pyramid Decomposition
 
     [c, d] = lpdec(x, h, g)
@@ -266,21 +676,55 @@ def lpdec(x, h, g, device=torch.device("cpu")):
     See also:   LPREC, PDFBDEC"""
 
     # Lowpass filter and downsample
-    xlo = sefilter2(x, h, h, 'per', None, device=device)
-    c = xlo[:, :, ::2, ::2].cpu()
-    
+    xlo = sefilter2(x, h, h, 'per', None)
+    c = xlo[:, :, ::2, ::2]
+
     # Compute the residual (bandpass) image by upsample, filter, and subtract
     # Even size filter needs to be adjusted to obtain perfect reconstruction
-    adjust = mod(len(g) + 1, 2)
+    adjust = (len(g) + 1) % 2
 
-    xlo = zeros(x.shape)
+    xlo = torch.zeros_like(xlo)
     xlo[:, :, ::2, ::2] = c
-    tmp = sefilter2(xlo, g, g, 'per', adjust * array([1, 1]), device=device)
-    d = x.to(device) - tmp.to(device)
+    d = x - sefilter2(xlo, g, g, 'per', adjust * np.array([1, 1]))
 
     return c, d
 
-def sefilter2(x, f1, f2, extmod, shift, device=torch.device("cpu")):
+
+def lprec(c, d, h, g):
+    """ LPREC   Laplacian Pyramid Reconstruction
+
+    x = lprec(c, d, h, g)
+
+    Input:
+    c:      coarse image at half size
+    d:      detail image at full size
+    h, g:   two lowpass filters for the Laplacian pyramid
+
+    Output:
+    x:      reconstructed image
+
+    Note:     This uses a new reconstruction method by Do and Vetterli,
+    Framming pyramids, IEEE Trans. on Sig Proc., Sep. 2003.
+
+    See also:   LPDEC, PDFBREC"""
+
+    # First, filter and downsample the detail image
+    xhi = sefilter2(d, h, h, 'per', None)[:, :, ::2, ::2]
+
+    # Subtract from the coarse image, and then upsample and filter
+    xlo = torch.zeros_like(d)
+    xlo[:, :, ::2, ::2] = c - xhi
+
+    # Even size filter needs to be adjusted to obtain
+    # perfect reconstruction with zero shift
+    adjust = (len(g) + 1) % 2
+    xlo = sefilter2(xlo, g, g, 'per', adjust * np.array([1, 1]))
+
+    # Final combination
+    return xlo + d
+
+
+def sefilter2(x, f1, f2, extmod, shift):
     """SEFILTER2   2D separable filtering with extension handling
     y = sefilter2(x, f1, f2, [extmod], [shift])
 
@@ -306,32 +750,23 @@ def sefilter2(x, f1, f2, extmod, shift, device=torch.device("cpu")):
         extmod = 'per'
 
     if shift is None:
-        shift = array([[0], [0]])
+        shift = np.array([0, 0])
 
     # Make sure filter in a row vector
-    f1 = f1[:, np.newaxis].reshape(len(f1),)
-    f2 = f2[:, np.newaxis].reshape(len(f2),)
-    
+    f1 = f1.reshape(-1)
+    f2 = f2.reshape(-1)
+
     # Periodized extension
     lf1 = (len(f1) - 1) / 2.0
-    lf2 = (len(f1) - 1) / 2.0
-    y = extend2(x, floor(lf1) + shift[0], ceil(lf1) - shift[0],
-                floor(lf2) + shift[1], ceil(lf2) - shift[1], extmod)
+    lf2 = (len(f2) - 1) / 2.0
+    y = extend2(x, int(np.floor(lf1) + shift[0]), int(np.ceil(lf1) - shift[0]),
+                int(np.floor(lf2) + shift[1]), int(np.ceil(lf2) - shift[1]), extmod)
 
     # Seperable filter
-    if not torch.is_tensor(y):
-        inputs = torch.from_numpy(y.astype(np.float32)).to(device)
-    else:
-        inputs = y.type(torch.FloatTensor).to(device)
-    filters = torch.from_numpy((f1[:, np.newaxis] * f2).astype(np.float32)).to(device)
-    filters = filters[None, None, :, :]
-    filters = torch.repeat_interleave(filters, y.shape[1], axis=0)
-    
-    y = F.conv2d(inputs, filters, groups=inputs.size(1))
+    return F.conv2d(y, _depthwise_kernel(f1[:, None] * f2[None, :], y), groups=int(y.shape[1]))
 
-    return y
 
-def extend2(x, ru, rd, cl, cr, extmod, device=torch.device("cpu")):
+def extend2(x, ru, rd, cl, cr, extmod):
     """ EXTEND2   2D extension
     y = extend2(x, ru, rd, cl, cr, extmod)
 
@@ -357,46 +792,46 @@ def extend2(x, ru, rd, cl, cr, extmod, device=torch.device("cpu")):
 
     See also:   FBDEC"""
 
-    _, _, rx, cx = array(x.shape)
+    rx, cx = x.shape[2], x.shape[3]
 
     if extmod == 'per':
-
-        I = getPerIndices(rx, ru, rd)
-        y = x[:, :, I, :]
-
-        I = getPerIndices(cx, cl, cr)
-        y = y[:, :, :, I]
-
+        y = x.index_select(2, getPerIndices(rx, ru, rd, x.device))
+        y = y.index_select(3, getPerIndices(cx, cl, cr, x.device))
         return y
     elif extmod == 'qper_row':
-        rx2 = round(rx / 2.0)
-        y = np.c_[np.r_[x[:, :, rx2:rx, cx - cl:cx], x[:, :, 0:rx2, cx - cl:cx]],
-               x, np.r_[x[:, :, rx2:rx, 0:cr], x[:, :, 0:rx2, 0:cr]]]
-        I = getPerIndices(rx, ru, rd)
-        y = y[:, :, I, :]
+        # Each period to the left/right is circularly shifted by rx/2 rows
+        y = _qper_extend(x.transpose(2, 3), cl, cr).transpose(2, 3)
+        y = y.index_select(2, getPerIndices(rx, ru, rd, x.device))
         return y
     elif extmod == 'qper_col':
-        cx2 = int(round(cx / 2.0))
-        y = np.concatenate([
-            np.c_[x[:, :, rx - ru:rx, cx2:cx], x[:, :, rx - ru:rx, 0:cx2]],
-            x,
-            np.c_[x[:, :, 0:rd, cx2:cx], x[:, :, 0:rd, 0:cx2]]
-        ], axis=2)
-
-        I = getPerIndices(cx, cl, cr)
-        y = y[:, :, :, I]
+        # Each period above/below is circularly shifted by cx/2 columns
+        y = _qper_extend(x, ru, rd)
+        y = y.index_select(3, getPerIndices(cx, cl, cr, x.device))
         return y
     else:
         print("Invalid input for EXTMOD")
 
-def getPerIndices(lx, lb, le, device=torch.device("cpu")):
-    I = hstack((arange(lx - lb, lx), arange(0, lx), arange(0, le)))
-    if (lx < lb) or (lx < le):
-        I = mod(I, lx)
-        I[I == 0] = lx
-    return I.astype(int)
 
-def fbdec(x, h0, h1, type1, type2, extmod, device=torch.device("cpu")):
+def _qper_extend(x, lb, le):
+    """Extend `x` by `lb` rows above and `le` rows below, where every
+    period is circularly shifted by half of the width."""
+    rx, cx = x.shape[2], x.shape[3]
+    # (round half to even for both)
+    cx2 = torch.round(cx / 2.0).long() if torch.is_tensor(cx) else int(round(cx / 2.0))
+    rows = torch.arange(-lb, rx + le, device=x.device)
+    period = torch.div(rows, rx, rounding_mode='floor')
+    cols = (torch.arange(cx, device=x.device)[None, :] + (period.abs() * cx2)[:, None]) % cx
+    y = x.index_select(2, rows % rx)
+    return torch.gather(y, 3, cols.expand_as(y))
+
+
+def getPerIndices(lx, lb, le, device=None):
+    """Indices of a periodized extension of `lb` and `le` samples before and
+    after a signal of length `lx`."""
+    return torch.arange(-lb, lx + le, device=device) % lx
+
+
+def fbdec(x, h0, h1, type1, type2, extmod):
     """ FBDEC   Two-channel 2D Filterbank Decomposition
 
     [y0, y1] = fbdec(x, h0, h1, type1, type2, [extmod])
@@ -426,34 +861,43 @@ def fbdec(x, h0, h1, type1, type2, extmod, device=torch.device("cpu")):
     # For parallegoram filterbank using quincunx downsampling, resampling is
     # applied before filtering
     if type1 == 'pq':
-        x = resamp(x, type2, None, None, device=device)
+        x = resamp(x, type2, None, None)
+
+    # Extend, filter and keep the original size
+    y0 = efilter2(x, h0, extmod, None)
+    y1 = efilter2(x, h1, extmod, _fbdec_shift(h1, type1, type2))
+    return _fbdec_down(y0, y1, type1, type2)
 
+
+def _fbdec_shift(h1, type1, type2):
+    """EFILTER2 window of the second filter of FBDEC."""
     # Stagger sampling if filter is odd-size (in both dimensions)
-    if all(mod(h1.shape, 2)):
-        shift = array([[-1], [0]])
+    if all(np.mod(h1.shape, 2)):
+        shift = np.array([[-1], [0]])
 
         # Account for the resampling matrix in the parallegoram case
         if type1 == 'p':
             R = [[None]] * 4
-            R[0] = array([[1, 1], [0, 1]])
-            R[1] = array([[1, -1], [0, 1]])
-            R[2] = array([[1, 0], [1, 1]])
-            R[3] = array([[1, 0], [-1, 1]])
+            R[0] = np.array([[1, 1], [0, 1]])
+            R[1] = np.array([[1, -1], [0, 1]])
+            R[2] = np.array([[1, 0], [1, 1]])
+            R[3] = np.array([[1, 0], [-1, 1]])
             shift = R[type2] * shift
     else:
-        shift = array([[0], [0]])
-    # Extend, filter and keep the original size
-    y0 = efilter2(x, h0, extmod, None)
-    y1 = efilter2(x, h1, extmod, shift)
-    # Downsampling
+        shift = np.array([[0], [0]])
+    return shift
+
+
+def _fbdec_down(y0, y1, type1, type2):
+    """Downsampling of the two filtered images of FBDEC."""
     if type1 == 'q':
         # Quincunx downsampling
-        y0 = qdown(y0, type2, None, None, device=device)
-        y1 = qdown(y1, type2, None, None, device=device)
+        y0 = qdown(y0, type2, None, None)
+        y1 = qdown(y1, type2, None, None)
     elif type1 == 'p':
         # Parallelogram downsampling
-        y0 = pdown(y0, type2, None, None)
-        y1 = pdown(y1, type2, None, None)
+        y0 = pdown(y0, type2, None)
+        y1 = pdown(y1, type2, None)
     elif type1 == 'pq':
         # Quincux downsampling using the equipvalent type
         pqtype = ['1r', '2r', '2c', '1c']
@@ -464,7 +908,167 @@ def fbdec(x, h0, h1, type1, type2, extmod, device=torch.device("cpu")):
 
     return y0, y1
 
-def efilter2(x, f, extmod, shift, device=torch.device("cpu")):
+
+def fbrec(y0, y1, h0, h1, type1, type2, extmod):
+    """ FBREC   Two-channel 2D Filterbank Reconstruction
+
+    x = fbrec(y0, y1, h0, h1, type1, type2, [extmod])
+
+    Input:
+    y0, y1: two input subband images
+    h0, h1: two reconstruction 2D filters
+    type1:  'q' or 'pq' for selecting quincunx or parallelogram
+    upsampling matrix (as in FBDEC)
+    type2:  second parameter for selecting the filterbank type
+    If type1 == 'q' then type2 is one of {'1r', '1c', '2r', '2c'}
+    If type1 == 'pq' then type2 is one of {0, 1, 2, 3}, and the
+    parallelogram matrix is replaced by a combination of a quincunx
+    and a resampling matrices
+    extmod: [optional] extension mode (default is 'per')
+
+    Output:
+    x:  reconstructed image
+
+    Note:   This is the general case of 2D two-channel filterbank
+
+    See also:   FBDEC"""
+
+    if extmod is None:
+        extmod = 'per'
+
+    # Upsampling
+    if type1 == 'q':
+        # Quincunx upsampling
+        y0 = qup(y0, type2, None)
+        y1 = qup(y1, type2, None)
+    elif type1 == 'pq':
+        # Quincux upsampling using the equivalent type
+        pqtype = ['1r', '2r', '2c', '1c']
+        y0 = qup(y0, pqtype[type2], None)
+        y1 = qup(y1, pqtype[type2], None)
+    else:
+        raise ValueError(f'Invalid input type1: {type1}.')
+
+    # Extend, filter and keep the original size
+    shift0, shift1 = _fbrec_shifts(h0, h1)
+    x = efilter2(y0, h0, extmod, shift0) + efilter2(y1, h1, extmod, shift1)
+
+    # For parallegoram filterbank using quincunx upsampling,
+    # a resampling is required at the end
+    if type1 == 'pq':
+        # Inverse of resamp(x, type)
+        inv_type = [1, 0, 3, 2]
+        x = resamp(x, inv_type[type2], None, None)
+
+    return x
+
+
+def _fbrec_shifts(h0, h1):
+    """EFILTER2 windows of the two synthesis filters of FBREC."""
+    # Stagger sampling if filter is odd-size
+    shift = np.array([[1], [0]]) if all(np.mod(h1.shape, 2)) else np.array([[0], [0]])
+    # Dimension that has even size filter needs to be adjusted to obtain
+    # perfect reconstruction with zero shift
+    adjust0 = np.mod(np.array(h0.shape) + 1, 2)[:, None]
+    adjust1 = np.mod(np.array(h1.shape) + 1, 2)[:, None]
+    return adjust0, adjust1 + shift
+
+
+def fbdec_l(x, f, type1, type2, extmod):
+    """ FBDEC_L   Two-channel 2D Filterbank Decomposition using Ladder Structure
+
+    [y0, y1] = fbdec_l(x, f, type1, type2, [extmod])
+
+    Input:
+    x:  input image
+    f:  1-D filter in the ladder network structure
+    type1:  'q' or 'p' for selecting quincunx or parallelogram
+    downsampling matrix
+    type2:  second parameter for selecting the filterbank type
+    If type1 == 'q' then type2 is one of {'1r', '1c', '2r', '2c'}
+    If type1 == 'p' then type2 is one of {0, 1, 2, 3}
+    Those are specified in QDOWN and PDOWN
+    extmod: [optional] extension mode (default is 'per')
+    This refers to polyphase components.
+
+    Output:
+    y0, y1: two result subband images
+
+    Note:   This is also called the lifting scheme
+
+    See also:   FBDEC, DFBDEC_L"""
+
+    if extmod is None:
+        extmod = 'per'
+
+    # Polyphase decomposition of the input image (QPDEC/PPDEC): the zero-
+    # and one-polyphase components of the quincunx/parallelogram downsampling
+    if type1 == 'q':
+        p0, p1 = qdown(x, type2, None, 0), qdown(x, type2, None, 1)
+    elif type1 == 'p':
+        p0, p1 = pdown(x, type2, 0), pdown(x, type2, 1)
+    else:
+        raise ValueError(f'Invalid argument type1: {type1}.')
+
+    # Ladder network structure, the 2D filters are separable
+    y0 = (1 / np.sqrt(2)) * (p0 - _separable_filter2(p1, f, extmod, [1, 1]))
+    y1 = (-np.sqrt(2) * p1) - _separable_filter2(y0, f, extmod, [0, 0])
+
+    return y0, y1
+
+
+def fbrec_l(y0, y1, f, type1, type2, extmod):
+    """ FBREC_L   Two-channel 2D Filterbank Reconstruction using Ladder Structure
+
+    x = fbrec_l(y0, y1, f, type1, type2, [extmod])
+
+    Input:
+    y0, y1: two input subband images
+    f:  1-D filter in the ladder network structure
+    type1:  'q' or 'p' for selecting quincunx or parallelogram
+    upsampling matrix
+    type2:  second parameter for selecting the filterbank type
+    If type1 == 'q' then type2 is one of {'1r', '1c', '2r', '2c'}
+    If type1 == 'p' then type2 is one of {0, 1, 2, 3}
+    Those are specified in QUP and PUP
+    extmod: [optional] extension mode (default is 'per')
+    This refers to polyphase components.
+
+    Output:
+    x:  reconstructed image
+
+    Note:   This is also called the lifting scheme
+
+    See also:   FBDEC_L"""
+
+    if extmod is None:
+        extmod = 'per'
+
+    # Ladder network structure, the steps of FBDEC_L undone in reverse order
+    p1 = (-1 / np.sqrt(2)) * (y1 + _separable_filter2(y0, f, extmod, [0, 0]))
+    p0 = np.sqrt(2) * y0 + _separable_filter2(p1, f, extmod, [1, 1])
+
+    # Polyphase reconstruction (QPREC/PPREC): the polyphase components
+    # upsampled back to their positions
+    if type1 == 'q':
+        return qup(p0, type2, 0) + qup(p1, type2, 1)
+    elif type1 == 'p':
+        return pup(p0, type2, 0) + pup(p1, type2, 1)
+    else:
+        raise ValueError(f'Invalid argument type1: {type1}.')
+
+
+def _separable_filter2(x, f, extmod, shift):
+    """SEFILTER2 of `x` with the 1-D filter `f` in both dimensions, as one
+    convolution per dimension (2 * len(f) instead of len(f)^2 taps)."""
+    lf = (len(f) - 1) / 2.0
+    y = extend2(x, int(np.floor(lf) + shift[0]), int(np.ceil(lf) - shift[0]),
+                int(np.floor(lf) + shift[1]), int(np.ceil(lf) - shift[1]), extmod)
+    y = F.conv2d(y, _depthwise_kernel(f[None, :], y), groups=int(y.shape[1]))
+    return F.conv2d(y, _depthwise_kernel(f[:, None], y), groups=int(y.shape[1]))
+
+
+def efilter2(x, f, extmod, shift):
     """EFILTER2   2D Filtering with edge handling (via extension)
 
     y = efilter2(x, f, [extmod], [shift])
@@ -490,68 +1094,174 @@ def efilter2(x, f, extmod, shift, device=torch.device("cpu")):
     if extmod is None:
         extmod = 'per'
     if shift is None:
-        shift = array([[0], [0]])
+        shift = np.array([[0], [0]])
 
-    # Periodized extension
+    # A 1-D filter is applied along the rows
     if f.ndim < 2:
-        sf = (r_[1, array(f.shape)] - 1) / 2.0
-    else:
-        sf = (array(f.shape) - 1) / 2.0
+        f = f[None, :]
 
-    ru = int(floor(sf[0]) + shift[0][0])
-    rd = int(ceil(sf[0]) - shift[0][0])
-    cl = int(floor(sf[1]) + shift[1][0])
-    cr = int(ceil(sf[1]) - shift[1][0])
+    # Periodized extension
+    ru, rd, cl, cr = _efilter2_pads(f.shape, shift)
     xext = extend2(x, ru, rd, cl, cr, extmod)
 
     # Convolution and keep the central part that has the size as the input
-    if f.ndim < 2:
-        inputs = xext.t.to(device)
-        filters = torch.from_numpy((f1[:, np.newaxis]).astype(np.float32)).to(device)
-        filters = filters[None, None, :, :]
-        filters = torch.repeat_interleave(filters, y.shape[1], axis=0)
+    return F.conv2d(xext, _depthwise_kernel(f, xext), groups=int(xext.shape[1]))
+
+
+def _efilter2_pads(fshape, shift):
+    """Extension (ru, rd, cl, cr) that EFILTER2 uses for a filter of shape
+    `fshape` and a window `shift`."""
+    sf = (np.array(fshape) - 1) / 2.0
+    return (int(np.floor(sf[0]) + shift[0][0]), int(np.ceil(sf[0]) - shift[0][0]),
+            int(np.floor(sf[1]) + shift[1][0]), int(np.ceil(sf[1]) - shift[1][0]))
+
+
+def pdfb_level_fft(x, n, filter_bank, plan=None):
+    """One pyramidal level of the decomposition in the frequency domain.
+
+    xlo, xhi_dir = pdfb_level_fft(x, n, filter_bank)
+
+    Gives the coarse image and the directional subbands (n > 0, LPDEC and
+    DFBDEC) or the three wavelet subbands (n == 0, WFB2DEC) of x, up to float
+    rounding. The periodic extensions of the filtering steps make them
+    circular convolutions, so every filter is a product with its spectrum:
+    the Laplacian pyramid entirely (the down and upsampling are sums and
+    tilings of the spectrum), the DFB from the spectrum of the bandpass
+    image, with the resampling steps in between in the spatial domain. The
+    quincunx periodized extension of the second level is the periodic one
+    of the image stacked over its copy shifted by half of the width.
+    The filter spectra of the frame size are kept in
+    `ContourletFilterBank.fft_plan`.
+
+    See also: LPDEC, DFBDEC, WFB2DEC"""
+    b, c, h, w = x.shape
+    if plan is None:
+        plan = filter_bank.fft_plan(n, int(c), int(h), int(w), x.dtype, x.device)
+
+    if n == 0:
+        # WFB2DEC: separable filtering of the rows and the columns, then downsampling
+        X = torch.fft.rfft2(x)
+        bands = [torch.fft.irfft2(X * plan[band], s=(h, w))[:, :, ::2, ::2] for band in ('LL', 'LH', 'HL', 'HH')]
+        return bands[0], bands[1:]
+
+    # Laplacian pyramid: lowpass filter, downsample (fold the spectrum),
+    # upsample (tile it), filter and subtract
+    X = torch.fft.fft2(x)
+    C = X * plan['h']
+    C = C.view(b, c, 2, h // 2, 2, w // 2).sum(dim=(2, 4)) / 4
+    xlo = torch.fft.ifft2(C).real
+    D = X - plan['g'] * C.repeat(1, 1, 2, 2)
+
+    # DFB of the bandpass image, whose one-sided spectrum is the left half of D
+    xhi_dir = _dfbdec_fft(torch.fft.ifft2(D).real, D[..., :w // 2 + 1], n, filter_bank, plan)
+    return xlo, xhi_dir
+
+
+def _dfbdec_fft(x, X, n, filter_bank, plan):
+    """DFBDEC of x (one-sided spectrum X, or None) with FBDEC_FFT."""
+    if n == 0:
+        return [x.clone()]
 
-        y = F.conv2d(inputs, filters, groups=inputs.size(1)).t
+    def fb(x, X, i, type1, type2, extmod):
+        names = ('k0', 'k1') if i is None else (f'f0_{i}', f'f1_{i}')
+        return _fbdec_fft(x, X, names, type1, type2, extmod, filter_bank, plan)
 
+    # Same tree as DFBDEC
+    if n == 1:
+        y = list(fb(x, X, None, 'q', '1r', 'per'))
     else:
-        if not torch.is_tensor(xext):
-            inputs = torch.from_numpy(xext.astype(np.float32)).to(device)
-        else:
-            inputs = xext.to(device)
-        filters = torch.from_numpy(f.astype(np.float32))
-        filters = filters[None, None, :, :]
-        filters = torch.repeat_interleave(filters, x.shape[1], axis=0)
+        x0, x1 = fb(x, X, None, 'q', '1r', 'per')
+        y = [None] * 4
+        y[0], y[1] = fb(x0, None, None, 'q', '2c', 'qper_col')
+        y[2], y[3] = fb(x1, None, None, 'q', '2c', 'qper_col')
+        for l in range(3, n + 1):
+            y_old = y[:]
+            y = [None] * 2**l
+            for k in range(0, 2**(l - 1)):
+                # The first half channels use R1 and R2, the second half R3 and R4
+                i = k % 2 if k < 2**(l - 2) else k % 2 + 2
+                y[2 * k], y[2 * k + 1] = fb(y_old[k], None, i, 'pq', i, 'per')
+    y = backsamp(y)
+    y[2**(n - 1)::] = y[::-1][:2**(n - 1)]
+    return y
 
-        y = F.conv2d(inputs, filters, groups=inputs.size(1))
 
+def _fbdec_fft(x, X, names, type1, type2, extmod, filter_bank, plan):
+    """FBDEC with the filters `names` of `filter_bank` as products with their
+    spectra. X is the one-sided spectrum of x, if it is known."""
+    if type1 == 'pq':
+        x, X = resamp(x, type2, None, None), None
+    h0, h1 = getattr(filter_bank, names[0]), getattr(filter_bank, names[1])
+    y0, y1 = _fft_efilter2(x, X, [(names[0], h0, np.array([[0], [0]])),
+                                   (names[1], h1, _fbdec_shift(h1, type1, type2))], extmod, plan)
+    return _fbdec_down(y0, y1, type1, type2)
+
+
+def _fft_efilter2(x, X, filters, extmod, plan):
+    """EFILTER2 of x with every (name, f, shift) of `filters`, as circular
+    convolutions ('per' and 'qper_col' extensions)."""
+    h, w = x.shape[2], x.shape[3]
+    if extmod == 'qper_col' and w % 2 == 0:
+        # Periodic over (2h, w): the periods below are shifted by w/2 columns
+        x, X = torch.cat([x, x.roll(-(w // 2), 3)], dim=2), None
+    elif extmod != 'per':
+        return [efilter2(x, f, extmod, shift) for _, f, shift in filters]
+    size = (int(x.shape[2]), int(x.shape[3]))
+    if X is None:
+        X = torch.fft.rfft2(x)
+    y = []
+    for name, f, shift in filters:
+        ru, _, cl, _ = _efilter2_pads(f.shape, shift)
+        key = (name, size, ru, cl)
+        if key not in plan:
+            plan[key] = _filter_spectrum(f, size, ru, cl, x.dtype, x.device)
+        y.append(torch.fft.irfft2(X * plan[key], s=size)[:, :, :h])
     return y
 
-# def efilter2(x, f, extmod='per', shift=[0, 0], device=torch.device("cpu")):
-#     # 假设x已经是一个PyTorch张量
-#     if not torch.is_tensor(x):
-#         inputs = torch.from_numpy(x.astype(np.float32)).to(device)
-#     else:
-#         inputs = x.to(device)
-#
-#     if f.ndim == 2:
-#         f = np.expand_dims(f, axis=0)  # 为滤波器增加一个“通道”维度
-#     filters = torch.from_numpy(f.astype(np.float32)).to(device)
-#     filters = filters.unsqueeze(0)  # 在滤波器前增加一个批次维度
-#
-#     # 如果是多通道图像，重复滤波器以匹配输入通道数
-#     if inputs.shape[1] > 1:
-#         filters = filters.repeat(inputs.shape[1], 1, 1, 1)
-#         groups = inputs.shape[1]  # 每个通道独立卷积
-#     else:
-#         groups = 1
-#
-#     # 应用卷积
-#     y = F.conv2d(inputs, filters, groups=groups, padding=(shift[0], shift[1]))
-#
-#     return y
-
-
-def qdown(x, type, extmod, phase, device=torch.device("cpu")):
+
+def _filter_spectrum(f, size, ru, cl, dtype, device, onesided=True):
+    """Spectrum S of the filter f on a (h, w) periodic grid, such that the
+    periodized extension of x by ru rows and cl columns followed by the
+    valid convolution with f (conv2d, a correlation) is IFFT(FFT(x) * S).
+    f has 1 or 2 dimensions (a 1-D filter is a row)."""
+    f = torch.as_tensor(np.ascontiguousarray(f) if not torch.is_tensor(f) else f, dtype=dtype, device=device)
+    if f.dim() == 1:
+        f = f[None, :]
+    rows = (torch.arange(f.shape[0], device=device) - ru) % size[0]
+    cols = (torch.arange(f.shape[1], device=device) - cl) % size[1]
+    # Taps beyond the period wrap around, as with the periodized extension
+    kernel = f.new_zeros(size).index_put_((rows[:, None].expand_as(f), cols[None, :].expand_as(f)), f,
+                                          accumulate=True)
+    spectrum = torch.fft.rfft2(kernel) if onesided else torch.fft.fft2(kernel)
+    return spectrum.conj()
+
+
+def _build_fft_plan(filter_bank, n, c, h, w, dtype, device):
+    """Filter spectra of PDFB_LEVEL_FFT for (*, c, h, w) images.
+
+    The spectra of the Laplacian pyramid (or the wavelet filter bank when
+    n == 0) are computed here, the ones of the DFB on their first use, as
+    the shapes of its subbands follow from the tree."""
+    plan = {}
+    h_, g_ = filter_bank.h, filter_bank.g
+    if n == 0:
+        h0, ext_h0, h1, ext_h1 = _wfb2dec_filters(h_, g_)
+        for band, fc, ru, fr, cl in (('LL', h0, ext_h0, h0, ext_h0), ('LH', h1, ext_h1, h0, ext_h0),
+                                     ('HL', h0, ext_h0, h1, ext_h1), ('HH', h1, ext_h1, h1, ext_h1)):
+            # Columns then rows, as the separable 2D filter
+            plan[band] = _filter_spectrum(fc[:, None] * fr[None, :], (h, w), ru, cl, dtype, device)
+    else:
+        # SEFILTER2 windows of LPDEC
+        lh, lg = (len(h_) - 1) / 2.0, (len(g_) - 1) / 2.0
+        adjust = (len(g_) + 1) % 2
+        plan['h'] = _filter_spectrum(h_[:, None] * h_[None, :], (h, w), int(np.floor(lh)), int(np.floor(lh)),
+                                     dtype, device, onesided=False)
+        plan['g'] = _filter_spectrum(g_[:, None] * g_[None, :], (h, w), int(np.floor(lg)) + adjust,
+                                     int(np.floor(lg)) + adjust, dtype, device, onesided=False)
+    return plan
+
+
+def qdown(x, type, extmod, phase):
     """% QDOWN   Quincunx Downsampling
     %
     %   y = qdown(x, [type], [extmod], [phase])
@@ -577,37 +1287,178 @@ def qdown(x, type, extmod, phase, device=torch.device("cpu")):
         phase = 0
 
     if type == '1r':
-        z = resamp(x, 1, None, None, device=device)
+        z = resamp(x, 1, None, None)
         if phase == 0:
-            y = resamp(z[:, :, ::2, :], 2, None, None, device=device)
+            y = resamp(z[:, :, ::2, :], 2, None, None)
         else:
-            y = resamp(hstack((z[:, :, 1::2, 1:], z[:, :, 1::2, 0:1])), 2, None, None, device=device)
+            y = resamp(torch.cat((z[:, :, 1::2, 1:], z[:, :, 1::2, 0:1]), dim=3), 2, None, None)
 
     elif type == '1c':
-        z = resamp(x, 2, None, None, device=device)
+        z = resamp(x, 2, None, None)
         if phase == 0:
-            y = resamp(z[:, :, :, ::2], 1, None, None, device=device)
+            y = resamp(z[:, :, :, ::2], 1, None, None)
         else:
-            y = resamp(z[:, :, :, 1::2], 1, None, None, device=device)
+            y = resamp(z[:, :, :, 1::2], 1, None, None)
     elif type == '2r':
-        z = resamp(x, 0, None, None, device=device)
+        z = resamp(x, 0, None, None)
         if phase == 0:
-            y = resamp(z[:, :, ::2, :], 3, None, None, device=device)
+            y = resamp(z[:, :, ::2, :], 3, None, None)
         else:
-            y = resamp(z[:, :, 1::2, :], 3, None, None, device=device)
+            y = resamp(z[:, :, 1::2, :], 3, None, None)
     elif type == '2c':
-        z = resamp(x, 3, None, None, device=device)
+        z = resamp(x, 3, None, None)
         if phase == 0:
-            y = resamp(z[:, :, :, ::2], 0, None, None, device=device)
+            y = resamp(z[:, :, :, ::2], 0, None, None)
         else:
-            y = resamp(hstack((z[:, :, 1:, 1::2].conj().transpose(0, 1, 3, 2),
-                               z[:, :, 0:1, 1::2].conj().transpose(0, 1, 3, 2))).conj().transpose(0, 1, 3, 2), 
-                       0, None, None, device=device)
+            y = resamp(torch.cat((z[:, :, 1:, 1::2], z[:, :, 0:1, 1::2]), dim=2), 0, None, None)
     else:
         print("Invalid argument type")
     return y
 
-def resamp(x, type_, shift, extmod, device=torch.device("cpu")):
+
+def qup(x, type, phase):
+    """ QUP   Quincunx Upsampling
+
+    y = qup(x, [type], [phase])
+
+    Input:
+    x:  input image
+    type:   [optional] one of {'1r', '1c', '2r', '2c'} (default is '1r')
+        '1' or '2' for selecting the quincunx matrices:
+            Q1 = [1, -1; 1, 1] or Q2 = [1, 1; -1, 1]
+        'r' or 'c' for extending row or column
+    phase:  [optional] 0 or 1 to specify the phase of the input image as
+        zero- or one-polyphase component, (default is 0)
+
+    Output:
+    y:  qunincunx upsampled image
+
+    See also:   QDOWN"""
+
+    if type is None:
+        type = '1r'
+
+    if phase is None:
+        phase = 0
+
+    b, c, m, n = x.shape
+    if type == '1r':
+        z = x.new_zeros(b, c, 2 * m, n)
+        t = resamp(x, 3, None, None)
+        if phase == 0:
+            z[:, :, ::2, :] = t
+        else:
+            z[:, :, 1::2, :] = torch.cat((t[:, :, :, -1:], t[:, :, :, :-1]), dim=3)
+        y = resamp(z, 0, None, None)
+    elif type == '1c':
+        z = x.new_zeros(b, c, m, 2 * n)
+        z[:, :, :, phase::2] = resamp(x, 0, None, None)
+        y = resamp(z, 3, None, None)
+    elif type == '2r':
+        z = x.new_zeros(b, c, 2 * m, n)
+        z[:, :, phase::2, :] = resamp(x, 2, None, None)
+        y = resamp(z, 1, None, None)
+    elif type == '2c':
+        z = x.new_zeros(b, c, m, 2 * n)
+        t = resamp(x, 1, None, None)
+        if phase == 0:
+            z[:, :, :, ::2] = t
+        else:
+            z[:, :, :, 1::2] = torch.cat((t[:, :, -1:, :], t[:, :, :-1, :]), dim=2)
+        y = resamp(z, 2, None, None)
+    else:
+        raise ValueError(f'Invalid argument type: {type}.')
+    return y
+
+
+def pdown(x, type, phase):
+    """ PDOWN   Parallelogram Downsampling
+        y = pdown(x, type, [phase])
+     Input:
+        x:	input image
+        type:	one of {0, 1, 2, 3} for selecting sampling matrices:
+                        P1 = [2, 0; 1, 1]
+                        P2 = [2, 0; -1, 1]
+                        P3 = [1, 1; 0, 2]
+                        P4 = [1, -1; 0, 2]
+        phase:	[optional] 0 or 1 for keeping the zero- or one-polyphase
+                component, (default is 0)
+     Output:
+        y:	parallelogram downsampled image
+
+     See also:	PPDEC"""
+    if phase is None:
+        phase = 0
+
+    if type == 0:  # P1 = R1 * Q1 = D1 * R3
+        if phase == 0:
+            y = resamp(x[:, :, ::2, :], 2, None, None)
+        else:
+            y = resamp(torch.cat((x[:, :, 1::2, 1:], x[:, :, 1::2, 0:1]), dim=3), 2, None, None)
+    elif type == 1:  # P2 = R2 * Q2 = D1 * R4
+        if phase == 0:
+            y = resamp(x[:, :, ::2, :], 3, None, None)
+        else:
+            y = resamp(x[:, :, 1::2, :], 3, None, None)
+    elif type == 2:  # P3 = R3 * Q2 = D2 * R1
+        if phase == 0:
+            y = resamp(x[:, :, :, ::2], 0, None, None)
+        else:
+            y = resamp(torch.cat((x[:, :, 1:, 1::2], x[:, :, 0:1, 1::2]), dim=2), 0, None, None)
+    elif type == 3:  # P4 = R4 * Q1 = D2 * R2
+        if phase == 0:
+            y = resamp(x[:, :, :, ::2], 1, None, None)
+        else:
+            y = resamp(x[:, :, :, 1::2], 1, None, None)
+    else:
+        raise ValueError(f'Invalid argument type: {type}.')
+
+    return y
+
+
+def pup(x, type, phase):
+    """ PUP   Parallelogram Upsampling
+        y = pup(x, type, [phase])
+     Input:
+        x:	input image
+        type:	one of {0, 1, 2, 3} for selecting sampling matrices:
+                        P1 = [2, 0; 1, 1]
+                        P2 = [2, 0; -1, 1]
+                        P3 = [1, 1; 0, 2]
+                        P4 = [1, -1; 0, 2]
+        phase:	[optional] 0 or 1 to specify the phase of the input image as
+                zero- or one-polyphase component, (default is 0)
+     Output:
+        y:	parallelogram upsampled image
+
+     See also:	PDOWN"""
+    if phase is None:
+        phase = 0
+
+    if type not in (0, 1, 2, 3):
+        raise ValueError(f'Invalid argument type: {type}.')
+
+    b, c, m, n = x.shape
+    # Undo the resampling of PDOWN, then put the rows (P1, P2) or the
+    # columns (P3, P4) back at their phase
+    t = resamp(x, [3, 2, 1, 0][type], None, None)
+    if type == 0 or type == 1:
+        y = x.new_zeros(b, c, 2 * m, n)
+        if type == 0 and phase == 1:
+            y[:, :, 1::2, :] = torch.cat((t[:, :, :, -1:], t[:, :, :, :-1]), dim=3)
+        else:
+            y[:, :, phase::2, :] = t
+    else:
+        y = x.new_zeros(b, c, m, 2 * n)
+        if type == 2 and phase == 1:
+            y[:, :, :, 1::2] = torch.cat((t[:, :, -1:, :], t[:, :, :-1, :]), dim=2)
+        else:
+            y[:, :, :, phase::2] = t
+
+    return y
+
+
+def resamp(x, type_, shift, extmod):
     """ RESAMP   Resampling in 2D filterbank
 
         y = resamp(x, type, [shift, extmod])
@@ -641,12 +1492,6 @@ def resamp(x, type_, shift, extmod, device=torch.device("cpu")):
         Input shift can be negative so that resamp(x, 1, -1) is the same
         with resamp(x, 2, 1)"""
 
-    # Convert to np.float32
-    if torch.is_tensor(x):
-        x = x.numpy()
-    else:
-        x = x.astype(np.float32)
-    
     if shift is None:
         shift = 1
 
@@ -654,24 +1499,25 @@ def resamp(x, type_, shift, extmod, device=torch.device("cpu")):
         extmod = 'per'
 
     if type_ == 0 or type_ == 1:
-        y = torch.from_numpy(resamp4c(x, type_, shift, extmod)).to(device)
+        y = resampc(x, type_, shift, extmod)
     elif type_ == 2 or type_ == 3:
-        y = torch.from_numpy(resamp4c(x.transpose(0, 1, 3, 2), type_ - 2, shift, extmod).transpose(0, 1, 3, 2)).to(device)
+        y = resampc(x.transpose(2, 3), type_ - 2, shift, extmod).transpose(2, 3)
     else:
         print("The second input (type_) must be one of {0, 1, 2, 3}")
 
     return y
 
-def ffilters(h0, h1, device=torch.device("cpu")):
+
+def ffilters(h0, h1, legacy=False):
     f0 = [[None]] * 4
     f1 = [[None]] * 4
 
     # For the first half channels
-    f0[0] = modulate2(h0, 'r', None)
-    f1[0] = modulate2(h1, 'r', None)
+    f0[0] = modulate2(h0, 'r', None, legacy)
+    f1[0] = modulate2(h1, 'r', None, legacy)
 
-    f0[1] = modulate2(h0, 'c', None)
-    f1[1] = modulate2(h1, 'c', None)
+    f0[1] = modulate2(h0, 'c', None, legacy)
+    f1[1] = modulate2(h1, 'c', None, legacy)
 
     # For the second half channels,
     # use the transposed filters of the first half channels
@@ -683,7 +1529,8 @@ def ffilters(h0, h1, device=torch.device("cpu")):
 
     return f0, f1
 
-def backsamp(y, device=torch.device("cpu")):
+
+def backsamp(y):
     """ BACKSAMP
     Backsampling the subband images of the directional filter bank
 
@@ -697,7 +1544,7 @@ def backsamp(y, device=torch.device("cpu")):
      See also: DFBDEC"""
 
     # Number of decomposition tree levels
-    n = int(log2(len(y)))
+    n = int(np.log2(len(y)))
 
     if (n != round(n)) or (n < 1):
         print("Input must be a cell vector of dyadic length")
@@ -705,24 +1552,61 @@ def backsamp(y, device=torch.device("cpu")):
         # One level, the decomposition filterbank shoud be Q1r
         # Undo the last resampling (Q1r = R2 * D1 * R3)
         for k in range(0, 2):
-            y[k] = resamp(y[k], 3, None, None, device=device)
-            y[k][:, 0::2] = resamp(y[k][:, 0::2], 0, None, None, device=device)
-            y[k][:, 1::2] = resamp(y[k][:, 1::2], 0, None, None, device=device)
+            y[k] = resamp(y[k], 3, None, None)
+            y[k] = torch.stack((resamp(y[k][:, :, :, 0::2], 0, None, None),
+                                resamp(y[k][:, :, :, 1::2], 0, None, None)), dim=4).flatten(3)
 
     elif n > 2:
         N = 2**(n - 1)
         for k in range(0, 2**(n - 2)):
             shift = 2 * (k + 1) - (2**(n - 2) + 1)
             # The first half channels
-            y[2 * k] = resamp(y[2 * k], 2, shift, None, device=device)
-            y[2 * k + 1] = resamp(y[2 * k + 1], 2, shift, None, device=device)
+            y[2 * k] = resamp(y[2 * k], 2, shift, None)
+            y[2 * k + 1] = resamp(y[2 * k + 1], 2, shift, None)
             # The second half channels
-            y[2 * k + N] = resamp(y[2 * k + N], 0, shift, None, device=device)
-            y[2 * k + 1 + N] = resamp(y[2 * k + 1 + N], 0, shift, None, device=device)
+            y[2 * k + N] = resamp(y[2 * k + N], 0, shift, None)
+            y[2 * k + 1 + N] = resamp(y[2 * k + 1 + N], 0, shift, None)
+
+    return y
+
+
+def rebacksamp(y):
+    """ REBACKSAMP   Re-backsampling the subband images of the DFB
+
+    y = rebacksamp(y)
+
+    Input and output are cell vector of dyadic length
+
+    This function is called at the beginning of the DFBREC to undo the
+    operation of BACKSAMP before the filter bank reconstruction. In other
+    words, it is the inverse operation of BACKSAMP
 
+    See also: BACKSAMP, DFBREC"""
+
+    # Number of decomposition tree levels
+    n = int(np.log2(len(y)))
+    y = list(y)
+    if n == 1:
+        # One level, the reconstruction filterbank shoud be Q1r
+        # Redo the first resampling (Q1r = R2 * D1 * R3)
+        for k in range(0, 2):
+            y[k] = torch.stack((resamp(y[k][:, :, :, 0::2], 1, None, None),
+                                resamp(y[k][:, :, :, 1::2], 1, None, None)), dim=4).flatten(3)
+            y[k] = resamp(y[k], 2, None, None)
+    elif n > 2:
+        N = 2**(n - 1)
+        for k in range(0, 2**(n - 2)):
+            shift = 2 * (k + 1) - (2**(n - 2) + 1)
+            # The first half channels
+            y[2 * k] = resamp(y[2 * k], 2, -shift, None)
+            y[2 * k + 1] = resamp(y[2 * k + 1], 2, -shift, None)
+            # The second half channels
+            y[2 * k + N] = resamp(y[2 * k + N], 0, -shift, None)
+            y[2 * k + 1 + N] = resamp(y[2 * k + 1 + N], 0, -shift, None)
     return y
 
-def wfb2dec(x, h, g, device=torch.device("cpu")):
+
+def wfb2dec(x, h, g):
     """% WFB2DEC   2-D Wavelet Filter Bank Decomposition
     %
     %       y = wfb2dec(x, h, g)
@@ -734,22 +1618,7 @@ def wfb2dec(x, h, g, device=torch.device("cpu")):
     % Output:
     %   x_LL, x_LH, x_HL, x_HH:   Four 2-D wavelet subbands"""
 
-    # Make sure filter in a row vector
-    h = h[:, newaxis].reshape(len(h),)
-    g = g[:, newaxis].reshape(len(g),)
-
-    h0 = h
-    len_h0 = len(h0)
-    ext_h0 = floor(len_h0 / 2.0)
-    # Highpass analysis filter: H1(z) = -z^(-1) G0(-z)
-    len_h1 = len(g)
-    c = floor((len_h1 + 1.0) / 2.0)
-    # Shift the center of the filter by 1 if its length is even.
-    if mod(len_h1, 2) == 0:
-        c = c + 1
-    # print(c)
-    h1 = - g * (-1)**(arange(1, len_h1 + 1) - c)
-    ext_h1 = len_h1 - c + 1
+    h0, ext_h0, h1, ext_h1 = _wfb2dec_filters(h, g)
 
     # Row-wise filtering
     x_L = rowfiltering(x, h0, ext_h0)
@@ -759,35 +1628,451 @@ def wfb2dec(x, h, g, device=torch.device("cpu")):
     x_H = x_H[:, :, :, ::2]  # x_H(:, 1:2:end);
 
     # Column-wise filtering
-    x_LL = rowfiltering(x_L.conj().permute(0, 1, 3, 2), h0, ext_h0)
-    x_LL = x_LL.conj().permute(0, 1, 3, 2)
+    x_LL = rowfiltering(x_L.transpose(2, 3), h0, ext_h0)
+    x_LL = x_LL.transpose(2, 3)
     x_LL = x_LL[:, :, ::2, :]
 
-    x_LH = rowfiltering(x_L.conj().permute(0, 1, 3, 2), h1, ext_h1)
-    x_LH = x_LH.conj().permute(0, 1, 3, 2)
+    x_LH = rowfiltering(x_L.transpose(2, 3), h1, ext_h1)
+    x_LH = x_LH.transpose(2, 3)
     x_LH = x_LH[:, :, ::2, :]
 
-    x_HL = rowfiltering(x_H.conj().permute(0, 1, 3, 2), h0, ext_h0)
-    x_HL = x_HL.conj().permute(0, 1, 3, 2)
+    x_HL = rowfiltering(x_H.transpose(2, 3), h0, ext_h0)
+    x_HL = x_HL.transpose(2, 3)
     x_HL = x_HL[:, :, ::2, :]
 
-    x_HH = rowfiltering(x_H.conj().permute(0, 1, 3, 2), h1, ext_h1)
-    x_HH = x_HH.conj().permute(0, 1, 3, 2)
+    x_HH = rowfiltering(x_H.transpose(2, 3), h1, ext_h1)
+    x_HH = x_HH.transpose(2, 3)
     x_HH = x_HH[:, :, ::2, :]
 
     return x_LL, x_LH, x_HL, x_HH
 
-def rowfiltering(x, f, ext1, device=torch.device("cpu")):
+
+def _wfb2dec_filters(h, g):
+    """Lowpass and highpass analysis filters of WFB2DEC, with their
+    extensions (samples before the origin)."""
+    # Make sure filter in a row vector
+    h = h.reshape(-1)
+    g = g.reshape(-1)
+
+    h0 = h
+    len_h0 = len(h0)
+    ext_h0 = np.floor(len_h0 / 2.0)
+    # Highpass analysis filter: H1(z) = -z^(-1) G0(-z)
+    len_h1 = len(g)
+    c = np.floor((len_h1 + 1.0) / 2.0)
+    # Shift the center of the filter by 1 if its length is even.
+    if len_h1 % 2 == 0:
+        c = c + 1
+    sign = (-1.0)**(np.arange(1, len_h1 + 1) - c)
+    if torch.is_tensor(g):
+        sign = torch.as_tensor(sign, dtype=g.dtype, device=g.device)
+    h1 = - g * sign
+    ext_h1 = len_h1 - c + 1
+    return h0, int(ext_h0), h1, int(ext_h1)
+
+
+def wfb2rec(x_LL, x_LH, x_HL, x_HH, h, g):
+    """% WFB2REC   2-D Wavelet Filter Bank Reconstruction
+    %
+    %       x = wfb2rec(x_LL, x_LH, x_HL, x_HH, h, g)
+    %
+    % Input:
+    %   x_LL, x_LH, x_HL, x_HH:   Four 2-D wavelet subbands
+    %   h, g:   lowpass analysis and synthesis wavelet filters
+    %
+    % Output:
+    %   x:      reconstructed image"""
+
+    # Make sure filter in a row vector
+    h = h.reshape(-1)
+    g = g.reshape(-1)
+
+    g0 = g
+    len_g0 = len(g0)
+    ext_g0 = np.floor((len_g0 - 1) / 2.0)
+    # Highpass synthesis filter: G1(z) = -z H0(-z)
+    len_g1 = len(h)
+    c = np.floor((len_g1 + 1) / 2.0)
+    sign = (-1.0)**(np.arange(1, len_g1 + 1) - c)
+    if torch.is_tensor(h):
+        sign = torch.as_tensor(sign, dtype=h.dtype, device=h.device)
+    g1 = - h * sign
+    ext_g1 = len_g1 - (c + 1)
+
+    def up(x, dim):
+        # Upsample by 2 along `dim` (2 rows, 3 columns)
+        shape = list(x.shape)
+        shape[dim] *= 2
+        y = x.new_zeros(shape)
+        if dim == 2:
+            y[:, :, ::2, :] = x
+        else:
+            y[:, :, :, ::2] = x
+        return y
+
+    def colfiltering(x, f, ext):
+        return rowfiltering(up(x, 2).transpose(2, 3), f, ext).transpose(2, 3)
+
+    # Column-wise filtering
+    x_L = colfiltering(x_LL, g0, ext_g0) + colfiltering(x_LH, g1, ext_g1)
+    x_H = colfiltering(x_HL, g0, ext_g0) + colfiltering(x_HH, g1, ext_g1)
+
+    # Row-wise filtering
+    return rowfiltering(up(x_L, 3), g0, ext_g0) + rowfiltering(up(x_H, 3), g1, ext_g1)
+
+
+def rowfiltering(x, f, ext1):
     """Internal function: Row-wise filtering with border handling"""
-    
+
     ext1 = int(ext1)
     ext2 = int(len(f) - ext1 - 1)
-    x = np.concatenate([x[:, :, :, -ext1::], x, x[:, :, :, 0:ext2]], axis=3)
-    
-    inputs = torch.from_numpy(x.astype(np.float32)).conj().permute(0, 1, 3, 2)
-    filters = torch.from_numpy(f[:, np.newaxis].astype(np.float32))
-    filters = filters[None, None, :, :]
-    filters = torch.repeat_interleave(filters, x.shape[1], axis=0)
-    y = F.conv2d(input=inputs, weight=filters, groups=inputs.size(1)).conj().permute(0, 1, 3, 2)
-
-    return y
\ No newline at end of file
+    x = x.index_select(3, getPerIndices(x.shape[3], ext1, ext2, x.device))
+
+    return F.conv2d(x, _depthwise_kernel(f[None, :], x), groups=int(x.shape[1]))
+
+
+def _depthwise_kernel(f, x):
+    """Convert a 2D filter (numpy array or tensor) into a depthwise conv2d
+    weight for `x`."""
+    if not torch.is_tensor(f):
+        f = np.ascontiguousarray(f)
+    f = torch.as_tensor(f, dtype=x.dtype, device=x.device)
+    # int channels, the kernel shape is a constant (also in traced and ONNX graphs)
+    return f[None, None].expand(int(x.shape[1]), 1, *f.shape)
+
+
+@functools.lru_cache(maxsize=None)
+def _synthesize_filters(pfilt, dfilt, nlevs, legacy=True):
+    """Numpy filters of a pyramidal directional filter bank.
+
+    Returns a dict mapping buffer names of ContourletFilterBank to arrays.
+    """
+    filters = {}
+    if pfilt is not None:
+        filters['h'], filters['g'] = pfilters(pfilt)
+    if dfilt is not None and dfilt.startswith('pkva'):
+        # 1-D filter of the ladder structure
+        filters['ld'] = ldfilter(dfilt)
+    elif dfilt is not None and any(n > 0 for n in nlevs):
+        # Diamond-shaped filters
+        h0, h1 = dfilters(dfilt, 'd', legacy)
+        # Fan filters for the first two levels
+        filters['k0'] = modulate2(h0, 'c', None, legacy)
+        filters['k1'] = modulate2(h1, 'c', None, legacy)
+        # Fan filters for the rest of the tree
+        f0, f1 = ffilters(h0, h1, legacy)
+        for i in range(4):
+            filters[f'f0_{i}'] = f0[i]
+            filters[f'f1_{i}'] = f1[i]
+        if not legacy:
+            # Same for the reconstruction (synthesis) filters, prefixed with 'r'
+            g0, g1 = dfilters(dfilt, 'r')
+            filters['rk0'] = modulate2(g0, 'c', None)
+            filters['rk1'] = modulate2(g1, 'c', None)
+            f0, f1 = ffilters(g0, g1)
+            for i in range(4):
+                filters[f'rf0_{i}'] = f0[i]
+                filters[f'rf1_{i}'] = f1[i]
+    return filters
+
+
+def _build_dfb_plan(filter_bank, n, c, h, w, dtype, device):
+    """Index maps and grouped conv weights of DFBDEC_BATCHED.
+
+    The tree of DFBDEC is traced once on int64 planes holding the flat
+    position of every sample, so the extension/resampling/downsampling
+    functions yield the gather indices of the batched graph directly.
+    Samples are addressed in the per-image flattened buffer of the previous
+    level, subbands of the same shape (and source buffer) form one group.
+    """
+    k0, k1 = filter_bank.k0, filter_bank.k1
+    f0, f1 = filter_bank.f0, filter_bank.f1
+    pqtype = ['1r', '2r', '2c', '1c']
+
+    # (source buffer, positions) of each subband, starting with the input
+    subbands = [(0, torch.arange(c * h * w, device=device).view(1, c, h, w))]
+    levels = []
+    for l in range(1, n + 1):
+        # FBDEC arguments of every subband, following DFBDEC
+        args = []
+        for k in range(len(subbands)):
+            if l == 1:
+                args.append((k0, k1, 'q', '1r', 'per'))
+            elif l == 2:
+                args.append((k0, k1, 'q', '2c', 'qper_col'))
+            else:
+                i = k % 2 if k < 2**(l - 2) else k % 2 + 2
+                args.append((f0[i], f1[i], 'pq', i, 'per'))
+
+        groups = {}
+        for k, (source, pos) in enumerate(subbands):
+            groups.setdefault((source, tuple(pos.shape[2:])), []).append(k)
+
+        level = []
+        new_subbands = [None] * (2 * len(subbands))
+        for g, ((source, (hk, wk)), ks) in enumerate(groups.items()):
+            # Extension wide enough for every filter of the group
+            pads = {}
+            for k in ks:
+                h0, h1 = args[k][0], args[k][1]
+                shift = np.array([[-1], [0]]) if all(np.mod(h1.shape, 2)) else np.array([[0], [0]])
+                pads[k] = [_efilter2_pads(h0.shape, np.array([[0], [0]])), _efilter2_pads(h1.shape, shift)]
+            ru, rd, cl, cr = (max(p[j] for k in ks for p in pads[k]) for j in range(4))
+
+            index, weight = [], []
+            for k in ks:
+                h0, h1, type1, type2, extmod = args[k]
+                pos = subbands[k][1]
+                if type1 == 'pq':
+                    pos = resamp(pos, type2, None, None)
+                # One copy per filter keeps the convolution depthwise, which is
+                # much faster than a channel multiplier of 2 on most backends
+                ext = extend2(pos, ru, rd, cl, cr, extmod)
+                index.append(torch.stack((ext, ext), dim=2).reshape(-1))
+                # Embed both filters in the common window
+                kernel = torch.zeros(2, ru + rd + 1, cl + cr + 1, dtype=dtype, device=device)
+                for o, (f, (fu, _, fl, _)) in enumerate(zip((h0, h1), pads[k])):
+                    kernel[o, ru - fu:ru - fu + f.shape[0], cl - fl:cl - fl + f.shape[1]] = f.to(kernel)
+                weight.append(kernel[None].expand(c, -1, -1, -1))
+            weight = torch.stack(weight).reshape(2 * len(ks) * c, 1, ru + rd + 1, cl + cr + 1)
+            level.append({
+                'source': source,
+                'index': torch.cat(index),
+                'shape': (2 * len(ks) * c, hk + ru + rd, wk + cl + cr),
+                'weight': weight
+            })
+
+            # Downsample the conv output, laid out as (subband, channel, filter)
+            plane = torch.arange(hk * wk, device=device).view(1, 1, hk, wk)
+            for j, k in enumerate(ks):
+                type1, type2 = args[k][2], args[k][3]
+                qtype = type2 if type1 == 'q' else pqtype[type2]
+                for o in range(2):
+                    base = ((j * c + torch.arange(c, device=device)) * 2 + o) * hk * wk
+                    new_subbands[2 * k + o] = (g, qdown(base.view(1, c, 1, 1) + plane, qtype, None, None))
+        levels.append(level)
+        subbands = new_subbands
+
+    # Back sampling and flipping, as in DFBDEC
+    sources = [source for source, _ in subbands]
+    y = backsamp([pos for _, pos in subbands])
+    y[2**(n - 1)::] = y[::-1][:2**(n - 1)]
+    sources[2**(n - 1)::] = sources[::-1][:2**(n - 1)]
+
+    # One gather per run of subbands read from the same buffer
+    outputs = []
+    for source, pos in zip(sources, y):
+        if not outputs or outputs[-1][0] != source:
+            outputs.append((source, [], []))
+        outputs[-1][1].append(pos.reshape(-1))
+        outputs[-1][2].append(tuple(pos.shape[1:]))
+    outputs = [(source, torch.cat(index), shapes) for source, index, shapes in outputs]
+    return {'levels': levels, 'outputs': outputs}
+
+
+def _build_dfb_rec_plan(filter_bank, n, c, h, w, dtype, device):
+    """Index maps and grouped conv weights of DFBREC_BATCHED.
+
+    Same tracing as `_build_dfb_plan`, on the tree of DFBREC. The input
+    buffer holds all the subbands and the buffer of a level all its outputs,
+    flattened and concatenated after a zero. Positions are offset by one, so
+    the zeros inserted by the upsampling address that zero.
+    """
+    k0, k1 = filter_bank.rk0, filter_bank.rk1
+    f0, f1 = filter_bank.rf0, filter_bank.rf1
+    pqtype = ['1r', '2r', '2c', '1c']
+    inv_type = [1, 0, 3, 2]
+
+    # Subband shapes of the decomposition of a (c, h, w) image
+    dec = filter_bank.dfb_plan(n, c, h, w, dtype, device)
+    shapes = [shape for _, _, group in dec['outputs'] for shape in group]
+    sizes = [int(np.prod(shape)) for shape in shapes]
+    offsets = np.cumsum([1] + sizes)
+    subbands = [torch.arange(offset, offset + size, device=device).view(1, *shape)
+                for offset, size, shape in zip(offsets, sizes, shapes)]
+
+    # Flip back the order of the second half channels and undo backsampling
+    subbands[2**(n - 1)::] = subbands[::-1][:2**(n - 1)]
+    subbands = rebacksamp(subbands)
+
+    levels = []
+    for l in range(n, 0, -1):
+        # FBREC arguments of every pair of subbands, following DFBREC
+        args = []
+        for k in range(len(subbands) // 2):
+            if l == 1:
+                args.append((k0, k1, 'q', '1r', 'per'))
+            elif l == 2:
+                args.append((k0, k1, 'q', '2c', 'qper_col'))
+            else:
+                i = k % 2 if k < 2**(l - 2) else k % 2 + 2
+                args.append((f0[i], f1[i], 'pq', i, 'per'))
+
+        # Upsampled pairs, grouped by shape
+        ups, groups = [], {}
+        for k, (h0, h1, type1, type2, extmod) in enumerate(args):
+            qtype = type2 if type1 == 'q' else pqtype[type2]
+            ups.append([qup(pos, qtype, None) for pos in subbands[2 * k:2 * k + 2]])
+            groups.setdefault(tuple(ups[k][0].shape[2:]), []).append(k)
+
+        level = []
+        new_subbands = [None] * len(args)
+        offset = 1
+        for (hk, wk), ks in groups.items():
+            # Extension wide enough for every filter of the group
+            pads = {k: [_efilter2_pads(f.shape, shift) for f, shift in zip(args[k][:2], _fbrec_shifts(*args[k][:2]))]
+                    for k in ks}
+            ru, rd, cl, cr = (max(p[j] for k in ks for p in pads[k]) for j in range(4))
+
+            index, weight = [], []
+            for k in ks:
+                extmod = args[k][4]
+                index.append(torch.stack([extend2(up, ru, rd, cl, cr, extmod) for up in ups[k]], dim=2).reshape(-1))
+                # Embed both filters in the common window
+                kernel = torch.zeros(2, ru + rd + 1, cl + cr + 1, dtype=dtype, device=device)
+                for o, (f, (fu, _, fl, _)) in enumerate(zip(args[k][:2], pads[k])):
+                    kernel[o, ru - fu:ru - fu + f.shape[0], cl - fl:cl - fl + f.shape[1]] = f.to(kernel)
+                weight.append(kernel[None].expand(c, -1, -1, -1))
+            weight = torch.stack(weight).reshape(2 * len(ks) * c, 1, ru + rd + 1, cl + cr + 1)
+            level.append({
+                'index': torch.cat(index),
+                'shape': (2 * len(ks) * c, hk + ru + rd, wk + cl + cr),
+                'weight': weight
+            })
+
+            # Conv output (summed over the pair), laid out as (pair, channel)
+            plane = torch.arange(hk * wk, device=device).view(1, 1, hk, wk)
+            for j, k in enumerate(ks):
+                type1, type2 = args[k][2], args[k][3]
+                pos = offset + (j * c + torch.arange(c, device=device)).view(1, c, 1, 1) * hk * wk + plane
+                if type1 == 'pq':
+                    pos = resamp(pos, inv_type[type2], None, None)
+                new_subbands[k] = pos
+            offset += len(ks) * c * hk * wk
+        levels.append(level)
+        subbands = new_subbands
+
+    return {'levels': levels, 'output': subbands[0].reshape(-1)}
+
+
+class ContourletFilterBank(nn.Module):
+    """Precomputed filters of a pyramidal directional filter bank.
+
+    Synthesizing the filters (McClellan transforms, modulations and fan
+    filters) is numpy work that only depends on the filter names, so it is
+    done once and the kernels are kept as non-persistent buffers. They follow
+    the owner module across `.to()` calls and do not show up in checkpoints.
+
+    Args:
+        pfilt (str | None): Filter name for the pyramidal decomposition step.
+            None to skip the pyramidal filters. Default: 'maxflat'.
+        dfilt (str | None): Filter name for the directional decomposition
+            step. 'pkva6', 'pkva8', 'pkva12' or 'pkva' select the ladder
+            structure (`dfbdec_l`, `dfbrec_l`), which only holds the 1-D
+            ladder filter. None to skip the directional filters.
+            Default: 'dmaxflat7'.
+        nlevs (list[int]): The numbers of DFB decomposition levels at each
+            pyramidal level. Default: [3].
+        legacy_filters (bool): Build the directional filters with the former
+            MODULATE2 port, which did not modulate them (a sign flip only),
+            as the trained models do. Their DFB cannot be inverted, False
+            gives the filters of the toolbox, with the synthesis filters of
+            `batch_multi_channel_pdfbrec`. Default: True.
+    """
+
+    max_dfb_plans = 16
+
+    def __init__(self, pfilt='maxflat', dfilt='dmaxflat7', nlevs=[3], legacy_filters=True):
+        super(ContourletFilterBank, self).__init__()
+        self.pfilt = pfilt
+        self.dfilt = dfilt
+        self.nlevs = tuple(nlevs)
+        self.legacy_filters = legacy_filters
+        for name, f in _synthesize_filters(pfilt, dfilt, self.nlevs, legacy_filters).items():
+            self.register_buffer(name, torch.tensor(f, dtype=torch.float32), persistent=False)
+        # Batched DFB (decomposition and reconstruction) plans, keyed by
+        # image shape, dtype and device
+        self._dfb_plans = OrderedDict()
+
+    @property
+    def f0(self):
+        return [getattr(self, f'f0_{i}') for i in range(4)]
+
+    @property
+    def f1(self):
+        return [getattr(self, f'f1_{i}') for i in range(4)]
+
+    @property
+    def rf0(self):
+        return [getattr(self, f'rf0_{i}') for i in range(4)]
+
+    @property
+    def rf1(self):
+        return [getattr(self, f'rf1_{i}') for i in range(4)]
+
+    def dfb_plan(self, n, c, h, w, dtype, device):
+        """Plan of `dfbdec_batched` for a (*, c, h, w) input with n levels.
+
+        The plans only depend on the input shape, so the most recently used
+        ones are kept (at most `max_dfb_plans`).
+        """
+        return self._get_plan(_build_dfb_plan, n, c, h, w, dtype, device)
+
+    def fft_plan(self, n, c, h, w, dtype, device):
+        """Filter spectra of `pdfb_level_fft` for (*, c, h, w) images and n
+        DFB levels, kept with the plans of `dfb_plan`."""
+        return self._get_plan(_build_fft_plan, n, c, h, w, dtype, device)
+
+    def dfb_rec_plan(self, n, c, h, w, dtype, device):
+        """Plan of `dfbrec_batched` for n levels of subbands of a (*, c, h, w)
+        image, kept with the plans of `dfb_plan`."""
+        return self._get_plan(_build_dfb_rec_plan, n, c, h, w, dtype, device)
+
+    def _get_plan(self, build, n, c, h, w, dtype, device):
+        key = (build.__name__, n, c, h, w, dtype, device)
+        plan = self._dfb_plans.get(key)
+        if plan is None:
+            plan = build(self, n, c, h, w, dtype, device)
+            self._dfb_plans[key] = plan
+            if len(self._dfb_plans) > self.max_dfb_plans:
+                self._dfb_plans.popitem(last=False)
+        else:
+            self._dfb_plans.move_to_end(key)
+        return plan
+
+    def _apply(self, fn, *args, **kwargs):
+        # Plans hold tensors of the old dtype/device
+        self._dfb_plans.clear()
+        return super(ContourletFilterBank, self)._apply(fn, *args, **kwargs)
+
+    def extra_repr(self):
+        extra = f'pfilt={self.pfilt}, dfilt={self.dfilt}, nlevs={list(self.nlevs)}'
+        return extra if self.legacy_filters else extra + ', legacy_filters=False'
+
+
+@functools.lru_cache(maxsize=None)
+def _cached_filter_bank(pfilt, dfilt, nlevs, dtype, device, legacy_filters):
+    return ContourletFilterBank(pfilt, dfilt, nlevs, legacy_filters).to(device=device, dtype=dtype)
+
+
+def get_filter_bank(pfilt, dfilt, nlevs, dtype=torch.float32, device=None, legacy_filters=True):
+    """Get the process-wide ContourletFilterBank for
+    `(pfilt, dfilt, nlevs, dtype, device, legacy_filters)`, building it on
+    first use."""
+    device = torch.device('cpu') if device is None else torch.device(device)
+    return _cached_filter_bank(pfilt, dfilt, tuple(nlevs), dtype, device, legacy_filters)
+
+
+if __name__ == '__main__':
+    # The frequency-domain backend gives the subbands of the convolutions, faster on large frames
+    import time
+    frame = torch.rand(1, 1, 512, 640)
+    with torch.no_grad():
+        for nlevs in ([3], [0, 2, 3]):
+            y = {}
+            for backend in ('conv', 'fft'):
+                start = time.perf_counter()
+                coefs = batch_multi_channel_pdfbdec(frame, nlevs=nlevs, backend=backend)
+                y[backend] = [coefs[0]] + [t for level in coefs[1:] for t in level]
+                print(f'{backend:>4} {nlevs}: {(time.perf_counter() - start) * 1000:.1f} ms')
+            print('max abs diff:', max((a - b).abs().max().item() for a, b in zip(y['conv'], y['fft'])))
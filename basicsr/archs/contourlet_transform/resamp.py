@@ -18,10 +18,7 @@
 #    with this program; if not, write to the Free Software Foundation, Inc.,
 #    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
-import pyximport
-import numpy as np
-pyximport.install(setup_args={'include_dirs': np.get_include()})
-from .resampc import *
+from .resampc import resampc
 
 
 def resamp(x, type, shift, extmod):
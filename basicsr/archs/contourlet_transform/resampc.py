@@ -0,0 +1,58 @@
+import functools
+import numpy as np
+import torch
+
+
+@functools.lru_cache(maxsize=None)
+def _shear_indices(m, n, shift):
+    """Row index map of a column shear: y[i, j] = x[(i + shift * j) % m, j]."""
+    return (np.arange(m)[:, None] + shift * np.arange(n)[None, :]) % m
+
+
+@functools.lru_cache(maxsize=None)
+def _shear_indices_tensor(m, n, shift, device):
+    return torch.as_tensor(_shear_indices(m, n, shift), device=device)
+
+
+def resampc(x, type_, shift, extmod):
+    """RESAMPC. Resampling along the column
+
+    y = resampc(x, type, shift, extmod)
+
+    Input:
+        x:      image that is extendable along the column direction, a numpy
+                array or a tensor whose last two dimensions are (rows, columns)
+        type:   either 0 or 1 (0 for shuffering down and 1 for up)
+        shift:  amount of shifts (typically 1)
+        extmod: extension mode:
+         - 'per': periodic
+
+    Output:
+        y: resampled image with:
+           R1 = [1, shift; 0, 1] or R2 = [1, -shift; 0, 1]
+
+    Note:
+        Column j is circularly shifted by (+/-)shift * j. The (m, n) index map
+        is built once per shape and shift, and applied to the whole batch
+        with a single gather (`take_along_axis` for numpy arrays), on the
+        device of `x` When exporting to ONNX, it is computed in the graph so
+        that the input size can be dynamic.
+    """
+    if type_ != 0 and type_ != 1:
+        raise ValueError('The second input (type_) must be either 0 or 1')
+    if extmod != 'per':
+        raise ValueError(f'Unsupported extension mode: {extmod}')
+
+    m, n = x.shape[-2], x.shape[-1]
+    s = int(shift) if type_ == 0 else -int(shift)
+
+    if torch.is_tensor(x):
+        if torch.onnx.is_in_onnx_export():
+            # index map in the graph, from the (dynamic) shape of x
+            index = (torch.arange(m, device=x.device)[:, None] + s * torch.arange(n, device=x.device)[None, :]) % m
+        else:
+            # int sizes, the index map is a constant of the shape (also when tracing)
+            index = _shear_indices_tensor(int(m), int(n), s, x.device)
+        return torch.gather(x, -2, index.expand_as(x))
+    index = _shear_indices(m, n, s)
+    return np.take_along_axis(x, np.broadcast_to(index, x.shape), axis=-2)
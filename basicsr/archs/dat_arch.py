@@ -8,8 +8,11 @@ from timm.models.layers import DropPath, trunc_normal_
 from einops.layers.torch import Rearrange
 from einops import rearrange
 
+import contextlib
+import functools
 import math
 import numpy as np
+from collections import OrderedDict
 
 from basicsr.utils.registry import ARCH_REGISTRY
 
@@ -18,11 +21,12 @@ from PIL import Image
 import torch
 import torch.optim
 from torchvision import datasets, transforms
-from basicsr.archs.contourlet_transform.pycontourlet import batch_multi_channel_pdfbdec
-from torchvision.transforms.functional import to_grayscale
+from basicsr.archs.contourlet_transform.pycontourlet import ContourletFilterBank, batch_multi_channel_pdfbdec
 
 def stack_same_dim(x):
-    """Stack a list/dict of 4D tensors of same img dimension together."""
+    """Stack a list/dict of 4D tensors of same img dimension together.
+
+    The shapes (keys) are ints, also when tracing."""
     # Collect tensor with same dimension into a dict of list
     output = {}
     
@@ -31,20 +35,20 @@ def stack_same_dim(x):
         for i in range(len(x)):
             if isinstance(x[i], list):
                 for j in range(len(x[i])):
-                    shape = tuple(x[i][j].shape)
+                    shape = tuple(int(s) for s in x[i][j].shape)
                     if shape in output.keys():
                         output[shape].append(x[i][j])
                     else:
                         output[shape] = [x[i][j]]
             else:
-                shape = tuple(x[i].shape)
+                shape = tuple(int(s) for s in x[i].shape)
                 if shape in output.keys():
                     output[shape].append(x[i])
                 else:
                     output[shape] = [x[i]]
     else:
         for k in x.keys():
-            shape = tuple(x[k].shape[2:4])
+            shape = tuple(int(s) for s in x[k].shape[2:4])
             if shape in output.keys():
                 output[shape].append(x[k])
             else:
@@ -56,6 +60,187 @@ def stack_same_dim(x):
         
     return output
 
+def fp32_autocast():
+    """Context in which autocast is disabled, when it is enabled (AMP).
+
+    Numerically sensitive computations run in it on fp32 inputs.
+    """
+    if torch.is_autocast_enabled():
+        return torch.cuda.amp.autocast(enabled=False)
+    return contextlib.nullcontext()
+
+
+def rgb_to_luma(x, quantize=False):
+    """Luminance of a batch of RGB images in [0, 1], scaled to [0, 255].
+
+    One weighted sum (ITU-R 601-2) on the device of `x`. With `quantize`,
+    it reproduces `to_grayscale(ToPILImage()(img))` bit-exactly: the image
+    is truncated to 8 bits and PIL's fixed-point formula is applied.
+
+    Input: x: (B, C, H, W), with C = 3 or 1
+    Output: (B, 1, H, W)
+    """
+    if quantize:
+        x = x.mul(255).byte().int()
+        if x.shape[1] == 3:
+            x = (x[:, 0:1] * 19595 + x[:, 1:2] * 38470 + x[:, 2:3] * 7471 + 0x8000) >> 16
+        return x.float()
+    if x.shape[1] == 3:
+        x = x[:, 0:1] * 0.299 + x[:, 1:2] * 0.587 + x[:, 2:3] * 0.114
+    return x * 255.
+
+
+def input_pdfbdec(x, filter_bank=None, method="resize", quantize=False):
+    """Pyramidal directional filter bank decomposition of the luminance of a
+    batch of images.
+
+    Returns a dict of 4D tensors and the statistical features. `quantize`
+    is passed to `rgb_to_luma`.
+
+    Here's an example with 64x64 images with 3 channels, and batch_size=2:
+        >>> coefs, sfs = input_pdfbdec(x)
+    This will yield:
+        >>> coefs[0].shape
+        (2, 9, 32, 32)
+        >>> sfs.shape
+        (2, 18)
+    """
+    # Convert to single channel (luminance)
+    x = rgb_to_luma(x.float(), quantize)
+
+    # Obtain coefficients (in fp32, with AMP)
+    dfilt = "dmaxflat7" if filter_bank is None else filter_bank.dfilt
+    with fp32_autocast():
+        coefs = batch_multi_channel_pdfbdec(x=x, pfilt="maxflat", dfilt=dfilt, nlevs=[3],
+                                            filter_bank=filter_bank)
+    # coefs = batch_multi_channel_pdfbdec(x=x, pfilt="maxflat", dfilt="dmaxflat7", nlevs=[0, 2, 2, 2],
+    #                                     device=self.device)
+
+    # Stack channels with same image dimension
+    coefs = stack_same_dim(coefs)
+
+    # Resize or splice
+    if method == "resize":
+        for k in coefs.keys():
+            # Resize if image is not square
+            if k[2] != k[3]:
+                # Get maximum dimension (height or width)
+                max_dim = int(np.max((k[2], k[3])))
+                # Resize the channels
+                trans = transforms.Compose([transforms.Resize((max_dim, max_dim))])
+                coefs[k] = trans(coefs[k])
+    else:
+        for k in coefs.keys():
+            # Resize if image is not square
+            if k[2] != k[3]:
+                # Get minimum dimension (height or width)
+                min_dim = int(np.argmin((k[2], k[3]))) + 2
+                # Splice alternate channels (always even number of channels exist)
+                coefs[k] = torch.cat((coefs[k][:, ::2, :, :], coefs[k][:, 1::2, :, :]), dim=min_dim)
+
+    # Stack channels with same image dimension
+    coefs = stack_same_dim(coefs)
+
+    # Change coefs's key to number (n-1 to 0), instead of dimension
+    for i, k in enumerate(coefs.copy()):
+        idx = len(coefs.keys()) - i - 1
+        coefs[idx] = coefs.pop(k)
+
+    # Get statistical features (mean and std) for each image
+    sfs = []
+    for k in coefs.keys():
+        sfs.append(coefs[k].mean(dim=[2, 3]))
+        sfs.append(coefs[k].std(dim=[2, 3]))
+    sfs = torch.cat(sfs, dim=1)
+
+    return coefs, sfs
+
+
+def input_contourlet_features(x, filter_bank=None, quantize=False):
+    """Contourlet features of a batch of input images for DAT.
+
+    The subbands of `input_pdfbdec` are upsampled to the input size and
+    concatenated, which gives a (B, 9, H, W) tensor. They only depend on
+    the input pixels, so data pipelines may precompute them and pass them
+    to `DAT.forward` (see `basicsr.data.contourlet_cache`).
+    """
+    if torch.onnx.is_in_onnx_export():
+        dfilt = "dmaxflat7" if filter_bank is None else filter_bank.dfilt
+        with fp32_autocast():
+            coefs = batch_multi_channel_pdfbdec(x=rgb_to_luma(x.float(), quantize), pfilt="maxflat",
+                                                dfilt=dfilt, nlevs=[3], filter_bank=filter_bank)
+        return export_contourlet_features(coefs, (x.shape[2], x.shape[3]))
+    coefs, _ = input_pdfbdec(x, filter_bank, method="resize", quantize=quantize)
+    return torch.cat([
+        F.interpolate(coefs[i], size=(x.shape[2], x.shape[3]), mode='bilinear', align_corners=False)
+        for i in range(len(coefs))
+    ], dim=1)
+
+
+# Channel order of the 9 contourlet features (the lowpass subband, then the 8 directional ones of
+# batch_multi_channel_pdfbdec with nlevs=[3]) after the grouping by shape of input_pdfbdec and
+# ResidualGroup.__pdfbdec. The subbands have the shapes (H/2, W/2), 4x (H/4, W/2) and 4x (H/2, W/4),
+# so the grouping only depends on whether H == W, H < W or H > W.
+CONTOURLET_ORDERS = ([0, 1, 2, 3, 4, 5, 6, 7, 8], [5, 6, 7, 8, 0, 1, 2, 3, 4], [1, 2, 3, 4, 0, 5, 6, 7, 8])
+
+
+def export_contourlet_features(coefs, size):
+    """Contourlet features for ONNX graphs with dynamic sizes.
+
+    Gives the features of `input_contourlet_features` (and of the residual
+    groups) from the subbands `coefs` of batch_multi_channel_pdfbdec with
+    nlevs=[3], without the grouping by shape, which would be frozen at the
+    traced size: each subband is resized to a square of its largest side and
+    upsampled to `size` (H, W), then the channels are permuted to the order
+    of the grouping (see CONTOURLET_ORDERS), selected in the graph.
+    """
+    H, W = size
+    features = []
+    for c in [coefs[0]] + list(coefs[1]):
+        side = torch.max(torch.as_tensor(c.shape[2]), torch.as_tensor(c.shape[3]))
+        c = F.interpolate(c, size=(side, side), mode='bilinear', align_corners=False)
+        features.append(F.interpolate(c, size=(H, W), mode='bilinear', align_corners=False))
+    features = torch.cat(features, dim=1)
+
+    orders = [torch.tensor(order, device=features.device) for order in CONTOURLET_ORDERS]
+    H, W = torch.as_tensor(H), torch.as_tensor(W)
+    order = torch.where(H < W, orders[1], torch.where(H > W, orders[2], orders[0]))
+    return features.index_select(1, order)
+
+
+@functools.lru_cache(maxsize=None)
+def _prior_stream(device):
+    """Side CUDA stream of the contourlet priors of `device`."""
+    return torch.cuda.Stream(device)
+
+
+def launch_contourlet_prior(fn, x):
+    """Start `fn(x)` (the contourlet features of a residual group) off the
+    critical path and return a callable that waits for them.
+
+    CUDA tensors are processed on a side stream, which runs concurrently with
+    the kernels queued next on the current stream (the attention blocks).
+    CPU tensors, traced and exported graphs compute the features right away:
+    the CPU ops of the blocks already use all the intra-op threads, a worker
+    thread only competes with them (and costs a round trip per group).
+    """
+    if x.is_cuda and not (torch.jit.is_tracing() or torch.onnx.is_in_onnx_export()):
+        main, side = torch.cuda.current_stream(x.device), _prior_stream(x.device)
+        side.wait_stream(main)
+        with torch.cuda.stream(side):
+            out = fn(x)
+        # x may be freed by the current stream while the side stream reads it
+        x.record_stream(side)
+
+        def wait():
+            main.wait_stream(side)
+            out.record_stream(main)
+            return out
+        return wait
+    out = fn(x)
+    return lambda: out
+
+
 def img2windows(img, H_sp, W_sp):
     """
     Input: Image (B, C, H, W)
@@ -79,6 +264,120 @@ def windows2img(img_splits_hw, H_sp, W_sp, H, W):
     return img
 
 
+@functools.lru_cache(maxsize=64)
+def window_indices(H, W, H_pad, W_pad, H_sp, W_sp, shift_h, shift_w, device):
+    """
+    Token indices of the windows of an (H, W) image, zero padded to
+    (H_pad, W_pad) and rolled by (-shift_h, -shift_w), as in
+    Adaptive_Spatial_Attention. Padded positions point to the extra token H*W.
+    Output: index: (nW*N,), the token of each window position, and
+            inverse: (H*W,), the window position of each token
+    """
+    rows = (torch.arange(H_pad) + shift_h) % H_pad  # source row of each rolled row
+    cols = (torch.arange(W_pad) + shift_w) % W_pad
+    index = rows.view(-1, 1) * W + cols.view(1, -1)
+    index = index.masked_fill((rows >= H).view(-1, 1) | (cols >= W).view(1, -1), H * W)
+    index = index.view(H_pad // H_sp, H_sp, W_pad // W_sp, W_sp).permute(0, 2, 1, 3).flatten()
+
+    # rolled row of each source row (non-negative operands of %, inductor mis-handles negative ones)
+    rows = (torch.arange(H) + H_pad - shift_h) % H_pad
+    cols = (torch.arange(W) + W_pad - shift_w) % W_pad
+    win = (rows // H_sp).view(-1, 1) * (W_pad // W_sp) + (cols // W_sp).view(1, -1)
+    inverse = win * (H_sp * W_sp) + (rows % H_sp).view(-1, 1) * W_sp + (cols % W_sp).view(1, -1)
+    return index.to(device), inverse.flatten().to(device)
+
+
+def qkv2windows(qkv, index, N, head_major=False):
+    """
+    Partition q, k and v to windows with a single gather (one copy).
+    With head_major, the windows are gathered head by head: q, k and v are
+    then transposed views of (head, B, nW, N, C') tensors, which
+    Spatial_Attention.sdpa takes as (head, B*nW, N, C') without copy.
+    Input: qkv: (B, L, 3, head, C'), index: (nW*N,) from window_indices, N: window size
+    Output: q, k, v: (B, head, nW, N, C')
+    """
+    B, _, _, head, C_ = qkv.shape
+    if head_major:
+        windows = qkv.permute(2, 3, 0, 1, 4).index_select(3, index)  # 3, head, B, nW*N, C'
+        windows = windows.view(3, head, B, -1, N, C_).transpose(1, 2)
+    else:
+        windows = qkv.permute(2, 0, 3, 1, 4).index_select(3, index)  # 3, B, head, nW*N, C'
+        windows = windows.view(3, B, head, -1, N, C_)
+    return windows[0], windows[1], windows[2]
+
+
+@functools.lru_cache(maxsize=64)
+def shifted_window_split(B, rows, cols, device):
+    """
+    Windows of B images with a (rows, cols) grid of shifted windows, split
+    into the ones inside the image, whose shift mask is zero, and the ones
+    on its rolled borders (the last row and column of the grid).
+    Output: inner: (B*n_inner,) and border: (B*n_border,), indices of the
+            windows in the (B*nW) windows of the batch, inverse: (B*nW,),
+            position of each window in cat(inner, border), and
+            border_windows: (n_border,), the border windows in the grid
+    """
+    windows = torch.arange(rows * cols).view(rows, cols)
+    is_border = torch.zeros(rows, cols, dtype=torch.bool)
+    is_border[-1, :] = True
+    is_border[:, -1] = True
+    border_windows = windows[is_border]
+    offsets = torch.arange(B).view(-1, 1) * (rows * cols)
+    inner = (offsets + windows[~is_border]).flatten()
+    border = (offsets + border_windows).flatten()
+    inverse = torch.argsort(torch.cat([inner, border]))
+    return inner.to(device), border.to(device), inverse.to(device), border_windows.to(device)
+
+
+def windows2tokens(x, inverse):
+    """
+    Inverse of qkv2windows: merge the windows, undo the roll and crop the
+    padding with a single gather.
+    Input: x: (B, head, nW, N, C'), inverse: (L,) from window_indices
+    Output: x: (B, L, head, C'), a transposed view
+    """
+    B, head, _, _, C_ = x.shape
+    return x.reshape(B, head, -1, C_).index_select(2, inverse).transpose(1, 2)
+
+
+@torch.no_grad()
+def fuse_conv_bn(conv, bn):
+    """Conv2d with the (eval mode) BatchNorm2d that follows it folded in."""
+    fused = nn.Conv2d(conv.in_channels, conv.out_channels, conv.kernel_size, stride=conv.stride, padding=conv.padding,
+                      dilation=conv.dilation, groups=conv.groups, bias=True, padding_mode=conv.padding_mode)
+    fused = fused.to(conv.weight)
+    scale = torch.rsqrt(bn.running_var + bn.eps)
+    shift = -bn.running_mean * scale
+    if bn.affine:
+        scale = scale * bn.weight
+        shift = shift * bn.weight + bn.bias
+    fused.weight.copy_(conv.weight * scale.view(-1, 1, 1, 1))
+    fused.bias.copy_(shift if conv.bias is None else conv.bias * scale + shift)
+    return fused
+
+
+@torch.no_grad()
+def fuse_norm_linear(norm, linear):
+    """Fold the elementwise affine of a LayerNorm into the Linear that follows it.
+    Returns the LayerNorm without affine and the new Linear."""
+    fused = nn.Linear(linear.in_features, linear.out_features, bias=True).to(linear.weight)
+    fused.weight.copy_(linear.weight * norm.weight.view(1, -1))
+    fused.bias.copy_(linear.weight @ norm.bias)
+    if linear.bias is not None:
+        fused.bias.add_(linear.bias)
+    plain_norm = nn.LayerNorm(norm.normalized_shape, eps=norm.eps, elementwise_affine=False)
+    return plain_norm, fused
+
+
+def fuse_sequential_conv_bn(seq):
+    """Fold every Conv2d + BatchNorm2d pair of an nn.Sequential, the BatchNorm2d
+    is replaced by an nn.Identity."""
+    for i in range(len(seq) - 1):
+        if isinstance(seq[i], nn.Conv2d) and isinstance(seq[i + 1], nn.BatchNorm2d):
+            seq[i] = fuse_conv_bn(seq[i], seq[i + 1])
+            seq[i + 1] = nn.Identity()
+
+
 class SpatialGate(nn.Module):
     """ Spatial-Gate.
     Args:
@@ -187,9 +486,18 @@ class Spatial_Attention(nn.Module):
         proj_drop (float): Dropout ratio of output. Default: 0.0
         qk_scale (float | None): Override default qk scale of head_dim ** -0.5 if set
         position_bias (bool): The dynamic relative position bias. Default: True
+        attn_backend (str): 'math' computes the attention matrix explicitly, 'sdpa' uses
+            F.scaled_dot_product_attention (torch>=2.1) with the bias and mask as additive attn_mask, broadcast
+            over the windows (see sdpa). Default: 'math'
     """
-    def __init__(self, dim, idx, split_size=[8,8], dim_out=None, num_heads=6, attn_drop=0., proj_drop=0., qk_scale=None, position_bias=True):
+    def __init__(self, dim, idx, split_size=[8,8], dim_out=None, num_heads=6, attn_drop=0., proj_drop=0., qk_scale=None, position_bias=True,
+                 attn_backend='math'):
         super().__init__()
+        if attn_backend not in ('math', 'sdpa'):
+            raise ValueError(f"attn_backend must be 'math' or 'sdpa', but got {attn_backend}.")
+        if attn_backend == 'sdpa' and not hasattr(F, 'scaled_dot_product_attention'):
+            raise RuntimeError("attn_backend 'sdpa' requires torch>=2.1.")
+        self.attn_backend = attn_backend
         self.dim = dim
         self.dim_out = dim_out or dim
         self.split_size = split_size
@@ -231,61 +539,135 @@ class Spatial_Attention(nn.Module):
             relative_coords[:, :, 0] *= 2 * self.W_sp - 1
             relative_position_index = relative_coords.sum(-1)
             self.register_buffer('relative_position_index', relative_position_index)
+            # bias baked in by freeze_position_bias, not saved in the state dict
+            self.register_buffer('frozen_position_bias', None, persistent=False)
+            # bias of the current weights, in eval mode without autograd
+            self._position_bias_cache = None
 
         self.attn_drop = nn.Dropout(attn_drop)
 
-    def im2win(self, x, H, W):
-        B, N, C = x.shape
-        x = x.transpose(-2,-1).contiguous().view(B, C, H, W)
-        x = img2windows(x, self.H_sp, self.W_sp)
-        x = x.reshape(-1, self.H_sp* self.W_sp, self.num_heads, C // self.num_heads).permute(0, 2, 1, 3).contiguous()
-        return x
-
-    def forward(self, qkv, H, W, mask=None):
+    def relative_position_bias(self):
         """
-        Input: qkv: (B, 3*L, C), H, W, mask: (B, N, N), N is the window size
-        Output: x (B, H, W, C)
+        Dynamic relative position bias of the window: (head, N, N), in fp32.
+        It only depends on the weights, so in eval mode without autograd it
+        is computed once and cached. The cache is dropped by train()/eval(),
+        by moving the module and by loading weights.
         """
-        q,k,v = qkv[0], qkv[1], qkv[2]
+        if self.frozen_position_bias is not None:
+            return self.frozen_position_bias
+        use_cache = not self.training and not torch.is_grad_enabled()
+        if use_cache and self._position_bias_cache is not None:
+            return self._position_bias_cache
 
-        B, L, C = q.shape
-        assert L == H * W, "flatten img_tokens has wrong size"
+        with fp32_autocast():
+            pos = self.pos(self.rpe_biases)
+        # select position bias
+        relative_position_bias = pos[self.relative_position_index.view(-1)].view(
+            self.H_sp * self.W_sp, self.H_sp * self.W_sp, -1)
+        relative_position_bias = relative_position_bias.permute(2, 0, 1).contiguous()
+        if use_cache:
+            self._position_bias_cache = relative_position_bias
+        return relative_position_bias
+
+    @torch.no_grad()
+    def freeze_position_bias(self):
+        """Bake the position bias of the current weights in as a buffer, e.g.
+        before exporting the model. It is no longer trained, and loading
+        weights drops it."""
+        if self.position_bias:
+            self.frozen_position_bias = None
+            self.frozen_position_bias = self.relative_position_bias()
+
+    def train(self, mode=True):
+        if self.position_bias:
+            self._position_bias_cache = None
+        return super().train(mode)
+
+    def _apply(self, fn, *args, **kwargs):
+        if self.position_bias:
+            self._position_bias_cache = None
+        return super()._apply(fn, *args, **kwargs)
+
+    def _load_from_state_dict(self, *args, **kwargs):
+        if self.position_bias:
+            self._position_bias_cache = None
+            self.frozen_position_bias = None
+        super()._load_from_state_dict(*args, **kwargs)
 
-        # partition the q,k,v, image to window
-        q = self.im2win(q, H, W)
-        k = self.im2win(k, H, W)
-        v = self.im2win(v, H, W)
+    def sdpa(self, q, k, v, mask=None, grid=None):
+        """
+        Attention with F.scaled_dot_product_attention, on the windows of all
+        the images per head: (head, B*nW, N, C'), views of head-major q, k
+        and v (see qkv2windows). The position bias is then a broadcast
+        (head, 1, N, N) attn_mask. The shift mask is zero in the windows
+        inside the image, so only the windows on its rolled borders (the
+        last row and column of `grid`) get the sum of the bias and the mask.
+        Without `grid` (ONNX export), the sum is built for all the windows.
+        Input: q, k, v: (B, head, nW, N, C'), mask: (nW, N, N), grid: (rows, cols) of the windows
+        Output: x: (B, head, nW, N, C')
+        """
+        B, head, nW, N, C_ = q.shape
+        bias = self.relative_position_bias().unsqueeze(1) if self.position_bias else None  # head, 1, N, N
+        q, k, v = (t.transpose(0, 1).reshape(head, B * nW, N, C_) for t in (q, k, v))
+        if mask is None:
+            x = self._attention(q, k, v, bias)
+        elif grid is None:
+            x = self._attention(q, k, v, self._window_mask(bias, mask, B))
+        else:
+            inner, border, inverse, border_windows = shifted_window_split(B, grid[0], grid[1], q.device)
+            xs = [self._attention(*(t.index_select(1, border) for t in (q, k, v)),
+                                  self._window_mask(bias, mask.index_select(0, border_windows), B))]
+            if inner.numel() > 0:
+                xs.insert(0, self._attention(*(t.index_select(1, inner) for t in (q, k, v)), bias))
+            x = torch.cat(xs, dim=1).index_select(1, inverse)
+        return x.reshape(head, B, nW, N, C_).transpose(0, 1)
+
+    @staticmethod
+    def _window_mask(bias, mask, B):
+        """Additive attn_mask of the windows of B images, (head, B*nW, N, N),
+        from the bias (head, 1, N, N) and the shift mask (nW, N, N)."""
+        attn_mask = mask.unsqueeze(0) if bias is None else bias + mask.unsqueeze(0)
+        return attn_mask.repeat(1, B, 1, 1) if B > 1 else attn_mask
+
+    def _attention(self, q, k, v, attn_mask):
+        if attn_mask is not None:
+            attn_mask = attn_mask.to(q.dtype)
+        return F.scaled_dot_product_attention(
+            q, k, v, attn_mask=attn_mask, dropout_p=self.attn_drop.p if self.training else 0., scale=self.scale)
+
+    def forward(self, q, k, v, mask=None, grid=None):
+        """
+        Attention within the windows (see qkv2windows).
+        Input: q, k, v: (B, head, nW, N, C'), mask: (nW, N, N), N is the window size,
+               grid: (rows, cols) of the windows, used by the sdpa backend
+        Output: x: (B, head, nW, N, C')
+        """
+        if self.attn_backend == 'sdpa':
+            return self.sdpa(q, k, v, mask, grid)
 
         q = q * self.scale
-        attn = (q @ k.transpose(-2, -1))  # B head N C @ B head C N --> B head N N
+        attn = (q @ k.transpose(-2, -1))  # B head nW N C @ B head nW C N --> B head nW N N
+        # biases, mask and softmax in fp32 (with AMP)
+        attn = attn.float()
 
         # calculate drpe
         if self.position_bias:
-            pos = self.pos(self.rpe_biases)
-            # select position bias
-            relative_position_bias = pos[self.relative_position_index.view(-1)].view(
-                self.H_sp * self.W_sp, self.H_sp * self.W_sp, -1)
-            relative_position_bias = relative_position_bias.permute(2, 0, 1).contiguous()
-            attn = attn + relative_position_bias.unsqueeze(0)
-
-        N = attn.shape[3]
+            attn = attn + self.relative_position_bias().unsqueeze(1)
 
         # use mask for shift window
         if mask is not None:
-            nW = mask.shape[0]
-            attn = attn.view(B, nW, self.num_heads, N, N) + mask.unsqueeze(1).unsqueeze(0)
-            attn = attn.view(-1, self.num_heads, N, N)
+            attn = attn + mask
 
         attn = nn.functional.softmax(attn, dim=-1, dtype=attn.dtype)
         attn = self.attn_drop(attn)
 
-        x = (attn @ v)
-        x = x.transpose(1, 2).reshape(-1, self.H_sp* self.W_sp, C)  # B head N N @ B head N C
+        return attn @ v
 
-        # merge the window, window to image
-        x = windows2img(x, self.H_sp, self.W_sp, H, W)  # B H' W' C
 
-        return x
+# Shift masks of the padded input sizes other than img_size, shared by all
+# the shifted blocks: (H, W, split_size, shift_size, device) -> (mask_0, mask_1)
+_shift_mask_cache = OrderedDict()
+SHIFT_MASK_CACHE_SIZE = 4
 
 
 class Adaptive_Spatial_Attention(nn.Module):
@@ -302,10 +684,11 @@ class Adaptive_Spatial_Attention(nn.Module):
         attn_drop (float): Attention dropout rate. Default: 0.0
         rg_idx (int): The indentix of Residual Group (RG)
         b_idx (int): The indentix of Block in each RG
+        attn_backend (str): Attention backend of the windows, 'math' or 'sdpa'. Default: 'math'
     """
     def __init__(self, dim, num_heads, 
                  reso=64, split_size=[8,8], shift_size=[1,2], qkv_bias=False, qk_scale=None,
-                 drop=0., attn_drop=0., rg_idx=0, b_idx=0):
+                 drop=0., attn_drop=0., rg_idx=0, b_idx=0, attn_backend='math'):
         super().__init__()
         self.dim = dim
         self.num_heads = num_heads
@@ -328,10 +711,13 @@ class Adaptive_Spatial_Attention(nn.Module):
                 Spatial_Attention(
                     dim//2, idx = i,
                     split_size=split_size, num_heads=num_heads//2, dim_out=dim//2,
-                    qk_scale=qk_scale, attn_drop=attn_drop, proj_drop=drop, position_bias=True)
+                    qk_scale=qk_scale, attn_drop=attn_drop, proj_drop=drop, position_bias=True,
+                    attn_backend=attn_backend)
                 for i in range(self.branch_num)])
 
-        if (self.rg_idx % 2 == 0 and self.b_idx  > 0 and (self.b_idx  - 2) % 4 == 0) or (self.rg_idx % 2 != 0 and self.b_idx  % 4 == 0):
+        # shift in block: (0, 4, 8, ...), (2, 6, 10, ...), (0, 4, 8, ...), (2, 6, 10, ...), ...
+        self.shift = (self.rg_idx % 2 == 0 and self.b_idx  > 0 and (self.b_idx  - 2) % 4 == 0) or (self.rg_idx % 2 != 0 and self.b_idx  % 4 == 0)
+        if self.shift:
             attn_mask = self.calculate_mask(self.patches_resolution, self.patches_resolution)
             self.register_buffer("attn_mask_0", attn_mask[0])
             self.register_buffer("attn_mask_1", attn_mask[1])
@@ -359,50 +745,41 @@ class Adaptive_Spatial_Attention(nn.Module):
             nn.Conv2d(dim // 16, 1, kernel_size=1)
         )
 
-    def calculate_mask(self, H, W):
+    def calculate_mask(self, H, W, device=None):
         # The implementation builds on Swin Transformer code https://github.com/microsoft/Swin-Transformer/blob/main/models/swin_transformer.py
         # calculate attention mask for shift window
-        img_mask_0 = torch.zeros((1, H, W, 1))  # 1 H W 1 idx=0
-        img_mask_1 = torch.zeros((1, H, W, 1))  # 1 H W 1 idx=1
-        h_slices_0 = (slice(0, -self.split_size[0]),
-                    slice(-self.split_size[0], -self.shift_size[0]),
-                    slice(-self.shift_size[0], None))
-        w_slices_0 = (slice(0, -self.split_size[1]),
-                    slice(-self.split_size[1], -self.shift_size[1]),
-                    slice(-self.shift_size[1], None))
-
-        h_slices_1 = (slice(0, -self.split_size[1]),
-                    slice(-self.split_size[1], -self.shift_size[1]),
-                    slice(-self.shift_size[1], None))
-        w_slices_1 = (slice(0, -self.split_size[0]),
-                    slice(-self.split_size[0], -self.shift_size[0]),
-                    slice(-self.shift_size[0], None))
-        cnt = 0
-        for h in h_slices_0:
-            for w in w_slices_0:
-                img_mask_0[:, h, w, :] = cnt
-                cnt += 1
-        cnt = 0
-        for h in h_slices_1:
-            for w in w_slices_1:
-                img_mask_1[:, h, w, :] = cnt
-                cnt += 1
-
-        # calculate mask for window-0
-        img_mask_0 = img_mask_0.view(1, H // self.split_size[0], self.split_size[0], W // self.split_size[1], self.split_size[1], 1)
-        img_mask_0 = img_mask_0.permute(0, 1, 3, 2, 4, 5).contiguous().view(-1, self.split_size[0], self.split_size[1], 1) # nW, sw[0], sw[1], 1
-        mask_windows_0 = img_mask_0.view(-1, self.split_size[0] * self.split_size[1])
-        attn_mask_0 = mask_windows_0.unsqueeze(1) - mask_windows_0.unsqueeze(2)
-        attn_mask_0 = attn_mask_0.masked_fill(attn_mask_0 != 0, float(-100.0)).masked_fill(attn_mask_0 == 0, float(0.0))
-
-        # calculate mask for window-1
-        img_mask_1 = img_mask_1.view(1, H // self.split_size[1], self.split_size[1], W // self.split_size[0], self.split_size[0], 1)
-        img_mask_1 = img_mask_1.permute(0, 1, 3, 2, 4, 5).contiguous().view(-1, self.split_size[1], self.split_size[0], 1) # nW, sw[1], sw[0], 1
-        mask_windows_1 = img_mask_1.view(-1, self.split_size[1] * self.split_size[0])
-        attn_mask_1 = mask_windows_1.unsqueeze(1) - mask_windows_1.unsqueeze(2)
-        attn_mask_1 = attn_mask_1.masked_fill(attn_mask_1 != 0, float(-100.0)).masked_fill(attn_mask_1 == 0, float(0.0))
-
-        return attn_mask_0, attn_mask_1
+        # The 3x3 regions of the rolled image are numbered with index arithmetic instead of slice
+        # assignments, so that H and W may also be sizes of a traced (ONNX) graph
+        attn_masks = []
+        for (H_sp, W_sp), (shift_h, shift_w) in ((self.split_size, self.shift_size),
+                                                 (self.split_size[::-1], self.shift_size[::-1])):
+            rows = torch.arange(H, device=device)
+            cols = torch.arange(W, device=device)
+            img_mask = ((rows >= H - H_sp).long() + (rows >= H - shift_h).long()).view(-1, 1) * 3 + \
+                ((cols >= W - W_sp).long() + (cols >= W - shift_w).long()).view(1, -1)  # H W
+
+            # calculate mask for the windows of this branch
+            img_mask = img_mask.view(H // H_sp, H_sp, W // W_sp, W_sp).permute(0, 2, 1, 3)
+            mask_windows = img_mask.reshape(-1, H_sp * W_sp).float()  # nW, sw[0]*sw[1]
+            attn_mask = mask_windows.unsqueeze(1) - mask_windows.unsqueeze(2)
+            attn_mask = attn_mask.masked_fill(attn_mask != 0, float(-100.0)).masked_fill(attn_mask == 0, float(0.0))
+            attn_masks.append(attn_mask)
+
+        return attn_masks[0], attn_masks[1]
+
+    def get_mask(self, H, W, device):
+        """Shift masks of a padded (H, W) input, built on `device` and kept in
+        a small LRU cache shared by all the shifted blocks."""
+        key = (H, W, tuple(self.split_size), tuple(self.shift_size), str(device))
+        mask = _shift_mask_cache.get(key)
+        if mask is None:
+            mask = self.calculate_mask(H, W, device)
+            _shift_mask_cache[key] = mask
+            while len(_shift_mask_cache) > SHIFT_MASK_CACHE_SIZE:
+                _shift_mask_cache.popitem(last=False)
+        else:
+            _shift_mask_cache.move_to_end(key)
+        return mask
 
     def forward(self, x, H, W):
         """
@@ -412,52 +789,49 @@ class Adaptive_Spatial_Attention(nn.Module):
         B, L, C = x.shape
         assert L == H * W, "flatten img_tokens has wrong size"
 
-        qkv = self.qkv(x).reshape(B, -1, 3, C).permute(2, 0, 1, 3) # 3, B, HW, C
+        qkv = self.qkv(x) # B, HW, 3C
         # V without partition
-        v = qkv[2].transpose(-2,-1).contiguous().view(B, C, H, W)
+        v = qkv[:, :, 2*C:].transpose(-2,-1).contiguous().view(B, C, H, W)
 
         # image padding
         max_split_size = max(self.split_size[0], self.split_size[1])
-        pad_l = pad_t = 0
         pad_r = (max_split_size - W % max_split_size) % max_split_size
         pad_b = (max_split_size - H % max_split_size) % max_split_size
-
-        qkv = qkv.reshape(3*B, H, W, C).permute(0, 3, 1, 2) # 3B C H W
-        qkv = F.pad(qkv, (pad_l, pad_r, pad_t, pad_b)).reshape(3, B, C, -1).transpose(-2, -1) # l r t b
         _H = pad_b + H
         _W = pad_r + W
-        _L = _H * _W
-
-        # window-0 and window-1 on split channels [C/2, C/2]; for square windows (e.g., 8x8), window-0 and window-1 can be merged
-        # shift in block: (0, 4, 8, ...), (2, 6, 10, ...), (0, 4, 8, ...), (2, 6, 10, ...), ...
-        if (self.rg_idx % 2 == 0 and self.b_idx  > 0 and (self.b_idx  - 2) % 4 == 0) or (self.rg_idx % 2 != 0 and self.b_idx  % 4 == 0):
-            qkv = qkv.view(3, B, _H, _W, C)
-            qkv_0 = torch.roll(qkv[:,:,:,:,:C//2], shifts=(-self.shift_size[0], -self.shift_size[1]), dims=(2, 3))
-            qkv_0 = qkv_0.view(3, B, _L, C//2)
-            qkv_1 = torch.roll(qkv[:,:,:,:,C//2:], shifts=(-self.shift_size[1], -self.shift_size[0]), dims=(2, 3))
-            qkv_1 = qkv_1.view(3, B, _L, C//2)
-
-            if self.patches_resolution != _H or self.patches_resolution != _W:
-                mask_tmp = self.calculate_mask(_H, _W)
-                x1_shift = self.attns[0](qkv_0, _H, _W, mask=mask_tmp[0].to(x.device))
-                x2_shift = self.attns[1](qkv_1, _H, _W, mask=mask_tmp[1].to(x.device))
+        # in ONNX graphs the sizes are dynamic, so the index maps and masks are computed in the graph
+        dynamic = torch.onnx.is_in_onnx_export()
+        if dynamic or pad_r or pad_b:
+            # zero token of the padded positions
+            qkv = torch.cat([qkv, qkv.new_zeros(B, 1, 3 * C)], dim=1)
+        # 3, branch, head, C' for each token
+        qkv = qkv.view(B, -1, 3, 2, self.num_heads // 2, C // self.num_heads)
+
+        # window-0 and window-1 on split channels [C/2, C/2]
+        # the padding, the roll of the shifted windows and the partition are one gather per branch
+        if self.shift:
+            if dynamic:
+                mask = self.calculate_mask(_H, _W, x.device)
+            elif self.patches_resolution != _H or self.patches_resolution != _W:
+                mask = self.get_mask(_H, _W, x.device)
             else:
-                x1_shift = self.attns[0](qkv_0, _H, _W, mask=self.attn_mask_0)
-                x2_shift = self.attns[1](qkv_1, _H, _W, mask=self.attn_mask_1)
-
-            x1 = torch.roll(x1_shift, shifts=(self.shift_size[0], self.shift_size[1]), dims=(1, 2))
-            x2 = torch.roll(x2_shift, shifts=(self.shift_size[1], self.shift_size[0]), dims=(1, 2))
-            x1 = x1[:, :H, :W, :].reshape(B, L, C//2)
-            x2 = x2[:, :H, :W, :].reshape(B, L, C//2)
-            # attention output
-            attened_x = torch.cat([x1,x2], dim=2)
-
+                mask = (self.attn_mask_0, self.attn_mask_1)
+            shifts = [self.shift_size, self.shift_size[::-1]]
         else:
-            x1 = self.attns[0](qkv[:,:,:,:C//2], _H, _W)[:, :H, :W, :].reshape(B, L, C//2)
-            x2 = self.attns[1](qkv[:,:,:,C//2:], _H, _W)[:, :H, :W, :].reshape(B, L, C//2)
-            # attention output
-            attened_x = torch.cat([x1,x2], dim=2)
-        
+            mask = (None, None)
+            shifts = [(0, 0), (0, 0)]
+
+        indices = window_indices.__wrapped__ if dynamic else window_indices
+        attened_x = []
+        for i, attn in enumerate(self.attns):
+            index, inverse = indices(H, W, _H, _W, attn.H_sp, attn.W_sp, shifts[i][0], shifts[i][1], x.device)
+            q, k, v_ = qkv2windows(qkv[:, :, :, i], index, attn.H_sp * attn.W_sp,
+                                   head_major=attn.attn_backend == 'sdpa')
+            grid = None if dynamic else (_H // attn.H_sp, _W // attn.W_sp)
+            attened_x.append(windows2tokens(attn(q, k, v_, mask[i], grid), inverse))
+        # attention output
+        attened_x = torch.cat(attened_x, dim=2).view(B, L, C)
+
         # convolution output
         conv_x = self.dwconv(v)
 
@@ -538,11 +912,13 @@ class Adaptive_Channel_Attention(nn.Module):
 
         v_ = v.reshape(B, C, N).contiguous().view(B, C, H, W)
 
-        q = torch.nn.functional.normalize(q, dim=-1)
-        k = torch.nn.functional.normalize(k, dim=-1)
+        # normalize, temperature and softmax in fp32 (with AMP)
+        with fp32_autocast():
+            q = torch.nn.functional.normalize(q.float(), dim=-1)
+            k = torch.nn.functional.normalize(k.float(), dim=-1)
 
-        attn = (q @ k.transpose(-2, -1)) * self.temperature
-        attn = attn.softmax(dim=-1)
+            attn = (q @ k.transpose(-2, -1)) * self.temperature
+            attn = attn.softmax(dim=-1)
         attn = self.attn_drop(attn)
 
         # attention output
@@ -574,7 +950,7 @@ class Adaptive_Channel_Attention(nn.Module):
 
 class DATB(nn.Module):
     def __init__(self, dim, num_heads, reso=64, split_size=[2,4],shift_size=[1,2], expansion_factor=4., qkv_bias=False, qk_scale=None, drop=0.,
-                 attn_drop=0., drop_path=0., act_layer=nn.GELU, norm_layer=nn.LayerNorm, rg_idx=0, b_idx=0):
+                 attn_drop=0., drop_path=0., act_layer=nn.GELU, norm_layer=nn.LayerNorm, rg_idx=0, b_idx=0, attn_backend='math'):
         super().__init__()
 
         self.norm1 = norm_layer(dim)
@@ -583,7 +959,7 @@ class DATB(nn.Module):
             # DSTB
             self.attn = Adaptive_Spatial_Attention(
                 dim, num_heads=num_heads, reso=reso, split_size=split_size, shift_size=shift_size, qkv_bias=qkv_bias, qk_scale=qk_scale,
-                drop=drop, attn_drop=attn_drop, rg_idx=rg_idx, b_idx=b_idx
+                drop=drop, attn_drop=attn_drop, rg_idx=rg_idx, b_idx=b_idx, attn_backend=attn_backend
             )
         else:
             # DCTB
@@ -597,6 +973,13 @@ class DATB(nn.Module):
         self.ffn = SGFN(in_features=dim, hidden_features=ffn_hidden_dim, out_features=dim, act_layer=act_layer)
         self.norm2 = norm_layer(dim)
 
+    def fuse_for_inference(self):
+        """Fold the affine of norm1/norm2 into the first linear of attn/ffn."""
+        if isinstance(self.norm1, nn.LayerNorm) and self.norm1.elementwise_affine:
+            self.norm1, self.attn.qkv = fuse_norm_linear(self.norm1, self.attn.qkv)
+        if isinstance(self.norm2, nn.LayerNorm) and self.norm2.elementwise_affine:
+            self.norm2, self.ffn.fc1 = fuse_norm_linear(self.norm2, self.ffn.fc1)
+
     def forward(self, x, x_size):
         """
         Input: x: (B, H*W, C), x_size: (H, W)
@@ -627,6 +1010,12 @@ class ResidualGroup(nn.Module):
         depth (int): Number of dual aggregation Transformer blocks in residual group.
         use_chk (bool): Whether to use checkpointing to save memory.
         resi_connection: The convolutional block before residual connection. '1conv'/'3conv'
+        attn_backend (str): Attention backend of the spatial windows, 'math' or 'sdpa'. Default: 'math'
+        contourlet_grad (bool): Backpropagate through the contourlet decomposition of the features. Default: False
+        contourlet_dfilt (str): Directional filters of the contourlet decomposition. Default: 'dmaxflat7'
+        contourlet_prior (str): Features the contourlet prior decomposes. 'inline' decomposes the output of the
+            blocks. 'pipelined' decomposes the input of the group, concurrently with the blocks on CUDA, before
+            them on CPU (see launch_contourlet_prior). Default: 'inline'
     """
     def __init__(   self,
                     dim,
@@ -644,11 +1033,18 @@ class ResidualGroup(nn.Module):
                     depth=2,
                     use_chk=False,
                     resi_connection='1conv',
-                    rg_idx=0):
+                    rg_idx=0,
+                    attn_backend='math',
+                    contourlet_grad=False,
+                    contourlet_dfilt='dmaxflat7',
+                    contourlet_prior='inline'):
         super().__init__()
         self.use_chk = use_chk
+        self.contourlet_grad = contourlet_grad
+        self.contourlet_prior = contourlet_prior
         self.reso = reso
         self.conv_first_1 = nn.Conv2d(dim + 9, dim, 3, 1, 1)
+        self.contourlet_bank = ContourletFilterBank(pfilt="maxflat", dfilt=contourlet_dfilt, nlevs=[3])
 
         self.blocks = nn.ModuleList([
         DATB(
@@ -667,6 +1063,7 @@ class ResidualGroup(nn.Module):
             norm_layer=norm_layer,
             rg_idx = rg_idx,
             b_idx = i,
+            attn_backend = attn_backend,
             )for i in range(depth)])
 
         if resi_connection == '1conv':
@@ -712,8 +1109,13 @@ class ResidualGroup(nn.Module):
         # # Restack and convert back to PyTorch tensor
         # x = torch.from_numpy((np.expand_dims(np.stack(imgs, axis=0), axis=1)))
 
-        # Obtain coefficients
-        coefs = batch_multi_channel_pdfbdec(x=x.detach(), pfilt="maxflat", dfilt="dmaxflat7", nlevs=[c], device=0)
+        # Obtain coefficients (in fp32, with AMP)
+        with fp32_autocast():
+            # (the decomposition is linear, on large features its backward is the product with the
+            # conjugate filter spectra of the frequency-domain backend)
+            coefs = batch_multi_channel_pdfbdec(x=x.float() if self.contourlet_grad else x.detach().float(),
+                                                pfilt="maxflat", dfilt=self.contourlet_bank.dfilt, nlevs=[c],
+                                                filter_bank=self.contourlet_bank)
 
         # Stack channels with same image dimension
         coefs = stack_same_dim(coefs)
@@ -763,12 +1165,16 @@ class ResidualGroup(nn.Module):
         """
         return F.interpolate(x, size=target_size, mode='bilinear', align_corners=False)
 
-    def forward(self, x, x_size):
+    def forward(self, x, x_size, prior=None):
         """
         Input: x: (B, H*W, C), x_size: (H, W)
+               prior: callable returning the (B, 9, H, W) contourlet features to use (see
+                   launch_contourlet_prior), computed as set by contourlet_prior if None.
         Output: x: (B, H*W, C)
         """
         H, W = x_size
+        if prior is None and self.contourlet_prior == 'pipelined':
+            prior = launch_contourlet_prior(self.contourlet_features, rearrange(x, "b (h w) c -> b c h w", h=H, w=W))
         res = x
         for blk in self.blocks:
             if self.use_chk:
@@ -779,21 +1185,9 @@ class ResidualGroup(nn.Module):
 
         # TODO: Add CCNN here.
         # print('x before CCNN:',x.shape)
-        coefs, _ = self.__pdfbdec(x, 3, method="resize")
-        if len(coefs) == 1:
-            # 如果coefs只有一个元素，直接上采样并赋值
-            counterlet_features = self.upsample_input(coefs[0], (x.shape[2], x.shape[3]))
-        else:
-            # 如果coefs有多个元素，初始化一个空列表来收集所有上采样后的特征
-            upsampled_features = []
-            for i in range(len(coefs)):  # 注意这里的修改，使用range来遍历索引
-                # 对每个coefs[i]进行上采样
-                upsampled_feature = self.upsample_input(coefs[i], (x.shape[2], x.shape[3]))
-                upsampled_features.append(upsampled_feature)
-            # 使用torch.cat在通道维度上拼接所有上采样后的特征
-            counterlet_features = torch.cat(upsampled_features, dim=1)
-
-        x_ccnn = torch.cat((x, counterlet_features.cuda(0)), 1)
+        counterlet_features = self.contourlet_features(x) if prior is None else prior()
+
+        x_ccnn = torch.cat((x, counterlet_features), 1)
         x_ccnn = self.conv_first_1(x_ccnn)
         # print('x_ccnn after CCNN:',x_ccnn.shape)
 
@@ -806,6 +1200,34 @@ class ResidualGroup(nn.Module):
 
         return x
 
+    def contourlet_features(self, x):
+        """
+        Input: x: (B, C, H, W) features
+        Output: (B, 9, H, W) contourlet features of their mean over the channels
+        """
+        if torch.onnx.is_in_onnx_export():
+            # the grouping by shape of __pdfbdec would be frozen at the traced size
+            with fp32_autocast():
+                coefs = batch_multi_channel_pdfbdec(x=x.mean(dim=1, keepdim=True).detach().float(), pfilt="maxflat",
+                                                    dfilt=self.contourlet_bank.dfilt, nlevs=[3],
+                                                    filter_bank=self.contourlet_bank)
+            counterlet_features = export_contourlet_features(coefs, (x.shape[2], x.shape[3]))
+        else:
+            coefs, _ = self.__pdfbdec(x, 3, method="resize")
+            if len(coefs) == 1:
+                # 如果coefs只有一个元素，直接上采样并赋值
+                counterlet_features = self.upsample_input(coefs[0], (x.shape[2], x.shape[3]))
+            else:
+                # 如果coefs有多个元素，初始化一个空列表来收集所有上采样后的特征
+                upsampled_features = []
+                for i in range(len(coefs)):  # 注意这里的修改，使用range来遍历索引
+                    # 对每个coefs[i]进行上采样
+                    upsampled_feature = self.upsample_input(coefs[i], (x.shape[2], x.shape[3]))
+                    upsampled_features.append(upsampled_feature)
+                # 使用torch.cat在通道维度上拼接所有上采样后的特征
+                counterlet_features = torch.cat(upsampled_features, dim=1)
+        return counterlet_features
+
 
 class Upsample(nn.Sequential):
     """Upsample module.
@@ -850,18 +1272,6 @@ class UpsampleOneStep(nn.Sequential):
         flops = h * w * self.num_feat * 3 * 9
         return flops
 
-class AdaptationLayer(nn.Module):
-    def __init__(self, in_channels, out_channels, output_size):
-        super(AdaptationLayer, self).__init__()
-        self.conv = nn.Conv2d(in_channels, out_channels, kernel_size=1, stride=1, padding=0)
-        self.output_size = output_size
-
-    def forward(self, x):
-        x = self.conv(x)
-        x = F.interpolate(x, size=self.output_size, mode='bilinear', align_corners=False)
-        return x
-
-
 @ARCH_REGISTRY.register()
 class DAT(nn.Module):
     """ Dual Aggregation Transformer
@@ -884,6 +1294,25 @@ class DAT(nn.Module):
         upscale: Upscale factor. 2/3/4 for image SR
         img_range: Image range. 1. or 255.
         resi_connection: The convolutional block before residual connection. '1conv'/'3conv'
+        input_contourlet (str): Use of the contourlet features of the input image. 'off' skips the input
+            decomposition, 'concat' concatenates the features to the shallow features. Default: 'off'
+        contourlet_quantize (bool): Quantize the input to 8 bits before its contourlet decomposition, as the
+            former PIL grayscale conversion did. Only needed to reproduce old checkpoints bit-exactly. Default: False
+        attn_backend (str): Attention backend of the spatial windows. 'math' computes the attention matrices
+            explicitly, 'sdpa' uses F.scaled_dot_product_attention (torch>=2.1), which saves activation memory.
+            Both give the same outputs (up to float rounding) with the same weights. Default: 'math'
+        contourlet_grad (bool): Let the gradients flow through the contourlet decomposition of the features
+            of every residual group (they are detached otherwise). Default: False
+        contourlet_dfilt (str): Directional filters of the contourlet decompositions (input and residual
+            groups). The ladder filters ('pkva6', 'pkva8', 'pkva12', 'pkva') run the cheaper ladder structure
+            (see scripts/benchmark_dfb.py). Changing it changes the features the weights were trained with.
+            Default: 'dmaxflat7'
+        contourlet_prior (str): Features the contourlet prior of the residual groups decomposes. 'inline' (as
+            trained) decomposes the output of the blocks of every group. 'pipelined' decomposes the input of
+            every group, concurrently with its blocks on a side CUDA stream, so the prior leaves the critical
+            path. On CPU it is computed before the blocks, as costly as 'inline'. 'shared' decomposes the input
+            of the first group once (concurrently with its blocks on CUDA) and every group reuses it, which
+            also saves time on CPU. Both need fine-tuning of the weights. Default: 'inline'
     """
     def __init__(self,
                 img_size=64,
@@ -905,6 +1334,12 @@ class DAT(nn.Module):
                 img_range=1.,
                 resi_connection='1conv',
                 upsampler='pixelshuffle',
+                input_contourlet='off',
+                contourlet_quantize=False,
+                attn_backend='math',
+                contourlet_grad=False,
+                contourlet_dfilt='dmaxflat7',
+                contourlet_prior='inline',
                 **kwargs):
         super().__init__()
 
@@ -919,14 +1354,20 @@ class DAT(nn.Module):
             self.mean = torch.zeros(1, 1, 1, 1)
         self.upscale = upscale
         self.upsampler = upsampler
+        if input_contourlet not in ('off', 'concat'):
+            raise ValueError(f"input_contourlet must be 'off' or 'concat', but got {input_contourlet}.")
+        self.input_contourlet = input_contourlet
+        self.contourlet_quantize = contourlet_quantize
+        if contourlet_prior not in ('inline', 'pipelined', 'shared'):
+            raise ValueError(f"contourlet_prior must be 'inline', 'pipelined' or 'shared', but got {contourlet_prior}.")
+        self.contourlet_prior = contourlet_prior
 
         # ------------------------- 1, Shallow Feature Extraction ------------------------- #
         
         self.conv_first = nn.Conv2d(num_in_ch, embed_dim, 3, 1, 1)
-        self.conv_first_1 = nn.Conv2d(embed_dim+9, embed_dim, 3, 1, 1)
-        # 假设ContourletCNN输出通道数为256，我们需要调整为180维以匹配DAT输入
-        # 假设我们需要的输出尺寸为[64, 64]（这应该基于DAT模型的具体要求来确定）
-        self.adaptation_layer = AdaptationLayer(in_channels=256, out_channels=180, output_size=(64, 64))
+        if self.input_contourlet == 'concat':
+            self.conv_first_1 = nn.Conv2d(embed_dim+9, embed_dim, 3, 1, 1)
+            self.contourlet_bank = ContourletFilterBank(pfilt="maxflat", dfilt=contourlet_dfilt, nlevs=[3])
 
         # Initialize an instance of C-CNN model
         # use_cuda = torch.cuda.is_available()
@@ -967,7 +1408,11 @@ class DAT(nn.Module):
                 depth=depth[i],
                 use_chk=use_chk,
                 resi_connection=resi_connection,
-                rg_idx=i)
+                rg_idx=i,
+                attn_backend=attn_backend,
+                contourlet_grad=contourlet_grad,
+                contourlet_dfilt=contourlet_dfilt,
+                contourlet_prior='pipelined' if contourlet_prior == 'pipelined' else 'inline')
             self.layers.append(layer)
 
         self.norm = norm_layer(curr_dim)
@@ -1017,129 +1462,87 @@ class DAT(nn.Module):
         _, _, H, W = x.shape
         x_size = [H, W]
         x = self.before_RG(x)
+        prior = None
+        if self.contourlet_prior == 'shared':
+            prior = launch_contourlet_prior(self.layers[0].contourlet_features,
+                                            rearrange(x, "b (h w) c -> b c h w", h=H, w=W))
         for layer in self.layers:
-            x = layer(x, x_size)
+            x = layer(x, x_size, prior)
         x = self.norm(x)
         x = rearrange(x, "b (h w) c -> b c h w", h=H, w=W)
 
         return x
     
-    def __pdfbdec(self, x, method="resize"):
-        """Pyramidal directional filter bank decomposition for a batch of
-        images.
-
-        Returns a list of 4D numpy array.
-
-        Here's an example with an image with 3 channels, and batch_size=2:
-            >>> self.n_levs = [0, 3, 3, 3]
-            >>> coefs, sfs = self.__pdfbdec(x)
-        This will yield:
-            >>> coefs[0].shape
-            (2, 24, 112, 112)
-            >>> coefs[1].shape
-            (2, 24, 56, 56)
-            >>> coefs[2].shape
-            (2, 24, 28, 28)
-            >>> coefs[3].shape
-            (2, 12, 14, 14)
-            >>> sfs.shape
-            (2, 168)
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # Checkpoints from before `input_contourlet` hold the input prior layers (and the weights of a
+        # removed, never used adaptation layer) whatever the model consumes, drop the ones this model
+        # does not build. The released checkpoints (e.g. Final_2x.pth) are such checkpoints.
+        unused = ['adaptation_layer.']
+        if self.input_contourlet == 'off':
+            unused.append('conv_first_1.')
+        for k in [k for k in state_dict if any(k.startswith(prefix + name) for name in unused)]:
+            state_dict.pop(k)
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
+    def fuse_for_inference(self):
+        """Reparameterize the model for inference, with the same outputs:
+        - every BatchNorm2d (dwconv, channel_interaction and spatial_interaction
+          of the attentions) is folded into the conv before it;
+        - the LayerNorm affine before the qkv and fc1 linears of each block is
+          folded into them;
+        - the position biases are frozen (see freeze_position_bias).
+        The fused model can not be trained and does not load the former
+        state dicts anymore, so fuse after loading the weights.
         """
-        # Convert to from N-D channels to single channel by averaging
-        imgs = []
-        # Iterate each image in a batch
-        for i in range(x.shape[0]):
-            # Convert to PIL and image and to grayscale image
-            img = transforms.ToPILImage()(x[i])
-            img = to_grayscale(img)
-            imgs.append(img)
-        # Restack and convert back to PyTorch tensor
-        x = torch.from_numpy((np.expand_dims(np.stack(imgs, axis=0), axis=1)))
-
-        # Obtain coefficients
-        coefs = batch_multi_channel_pdfbdec(x=x, pfilt="maxflat", dfilt="dmaxflat7", nlevs=[3], device=0)
-        # coefs = batch_multi_channel_pdfbdec(x=x, pfilt="maxflat", dfilt="dmaxflat7", nlevs=[0, 2, 2, 2],
-        #                                     device=self.device)
-
-        # Stack channels with same image dimension
-        coefs = stack_same_dim(coefs)
-        
-        # Resize or splice
-        if method == "resize":
-            for k in coefs.keys():
-                # Resize if image is not square
-                if k[2] != k[3]:
-                    # Get maximum dimension (height or width)
-                    max_dim = int(np.max((k[2], k[3])))
-                    # Resize the channels
-                    trans = transforms.Compose([transforms.Resize((max_dim, max_dim))])
-                    coefs[k] = trans(coefs[k])
-        else:
-            for k in coefs.keys():
-                # Resize if image is not square
-                if k[2] != k[3]:
-                    # Get minimum dimension (height or width)
-                    min_dim = int(np.argmin((k[2], k[3]))) + 2
-                    # Splice alternate channels (always even number of channels exist)
-                    coefs[k] = torch.cat((coefs[k][:, ::2, :, :], coefs[k][:, 1::2, :, :]), dim=min_dim)
-        
-        # Stack channels with same image dimension
-        coefs = stack_same_dim(coefs)
-        
-        # Change coefs's key to number (n-1 to 0), instead of dimension
-        for i, k in enumerate(coefs.copy()):
-            idx = len(coefs.keys()) - i - 1
-            coefs[idx] = coefs.pop(k)
-
-        # Get statistical features (mean and std) for each image
-        sfs = []
-        for k in coefs.keys():
-            sfs.append(coefs[k].mean(dim=[2, 3]))
-            sfs.append(coefs[k].std(dim=[2, 3]))
-        sfs = torch.cat(sfs, dim=1)
+        self.eval()
+        for m in list(self.modules()):
+            if isinstance(m, nn.Sequential):
+                fuse_sequential_conv_bn(m)
+            elif isinstance(m, DATB):
+                m.fuse_for_inference()
+        self.freeze_position_bias()
+        return self
+
+    def freeze_position_bias(self):
+        """Bake the dynamic position biases of all the spatial attentions in as
+        buffers (see Spatial_Attention.freeze_position_bias), for inference
+        and export."""
+        for m in self.modules():
+            if isinstance(m, Spatial_Attention):
+                m.freeze_position_bias()
+        return self
+
+    def shallow_features(self, x, coefs=None):
+        """Shallow features of the normalized input, with its contourlet features in 'concat' mode."""
+        x = self.conv_first(x)
+        if self.input_contourlet == 'concat':
+            x = self.conv_first_1(torch.cat((x, coefs), 1))
+        return x
 
-        return coefs, sfs
-    
-    def forward(self, x):
+    def forward(self, x, coefs=None):
         """
         Input: x: (B, C, H, W)
+               coefs: (B, 9, H, W) contourlet features of x, see
+                   `input_contourlet_features`. Only used in 'concat' mode, computed from x if None.
         """
+        if self.input_contourlet == 'concat' and coefs is None:
+            coefs = input_contourlet_features(x, self.contourlet_bank, self.contourlet_quantize)
+
         self.mean = self.mean.type_as(x)
         x = (x - self.mean) * self.img_range
         # print('input shape:', x.shape)
 
-        coefs, _ = self.__pdfbdec(x, method="resize")
-
-        if len(coefs) == 1:
-        # 如果coefs只有一个元素，直接上采样并赋值
-            counterlet_features = self.upsample_input(coefs[0], (x.shape[2], x.shape[3]))
-        else:
-            # 如果coefs有多个元素，初始化一个空列表来收集所有上采样后的特征
-            upsampled_features = []
-            for i in range(len(coefs)):  # 注意这里的修改，使用range来遍历索引
-                # 对每个coefs[i]进行上采样
-                upsampled_feature = self.upsample_input(coefs[i], (x.shape[2], x.shape[3]))
-                upsampled_features.append(upsampled_feature)
-            # 使用torch.cat在通道维度上拼接所有上采样后的特征
-            counterlet_features = torch.cat(upsampled_features, dim=1)
-
-                
-        #print('coefs shape:', coefs[1].shape, 'coefs length:', len(coefs))
-        #print('counterlet_features shape:',counterlet_features.shape)
         if self.upsampler == 'pixelshuffle':
             # for image SR
             # x = self.upsample_input(x, (224, 224))
-            x = self.conv_first(x)
+            x = self.shallow_features(x, coefs)
             x = self.conv_after_body(self.forward_features(x)) + x
             x = self.conv_before_upsample(x)
             x = self.conv_last(self.upsample(x))
         elif self.upsampler == 'pixelshuffledirect':
             # for lightweight SR
             # x = self.upsample_input(x, (224, 224))
-            x = self.conv_first(x)
-            # TODO: Add CCNN here
-            # x = torch.cat((x, counterlet_features.cuda(0)), 1)
-            # x = self.conv_first_1(x)
+            x = self.shallow_features(x, coefs)
             # print('x after conv1:',x.shape)
             x = self.conv_after_body(self.forward_features(x)) + x
             x = self.upsample(x)
@@ -1149,6 +1552,7 @@ class DAT(nn.Module):
 
 
 if __name__ == '__main__':
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
     upscale = 1
     height = 64
     width = 64
@@ -1163,11 +1567,49 @@ if __name__ == '__main__':
         expansion_factor=2,
         resi_connection='1conv',
         split_size=[8,16],
-                ).cuda().eval()
+                ).to(device).eval()
 
     print(height, width)
 
-    x = torch.randn((1, 3, height, width)).cuda()
-    x = model(x)
-
-    print(x.shape)
+    x = torch.randn((1, 3, height, width)).to(device)
+    with torch.no_grad():
+        y = model(x)
+
+    print(y.shape)
+
+    # equivalence of the attention backends, on a size that needs shift masks of another resolution
+    if hasattr(F, 'scaled_dot_product_attention'):
+        model_sdpa = DAT(
+            upscale=2,
+            in_chans=3,
+            img_size=64,
+            img_range=1.,
+            depth=[6,6,6,6,6,6],
+            embed_dim=180,
+            num_heads=[6,6,6,6,6,6],
+            expansion_factor=2,
+            resi_connection='1conv',
+            split_size=[8,16],
+            attn_backend='sdpa',
+                    ).to(device).eval()
+        model_sdpa.load_state_dict(model.state_dict())
+        x = torch.rand((2, 3, 48, 80)).to(device)
+        with torch.no_grad():
+            print('sdpa max abs diff:', (model(x) - model_sdpa(x)).abs().max().item())
+
+    # latency of the contourlet prior modes (the same weights, 'pipelined' and 'shared' need fine-tuning)
+    import time
+    x = torch.rand((1, 3, 128, 128)).to(device)
+    for mode in ('inline', 'pipelined', 'shared'):
+        model.contourlet_prior = mode if mode == 'shared' else 'inline'
+        for layer in model.layers:
+            layer.contourlet_prior = 'pipelined' if mode == 'pipelined' else 'inline'
+        with torch.no_grad():
+            model(x)
+            if x.is_cuda:
+                torch.cuda.synchronize()
+            start = time.perf_counter()
+            model(x)
+            if x.is_cuda:
+                torch.cuda.synchronize()
+        print(f'contourlet_prior {mode}: {(time.perf_counter() - start) * 1000:.1f} ms')
@@ -0,0 +1,94 @@
+import hashlib
+import numpy as np
+import os
+import torch
+from collections import OrderedDict
+from os import path as osp
+
+
+class ContourletCache():
+    """Cache of input contourlet features.
+
+    Once the random crop and flip/rotation of a sample are fixed, its
+    contourlet features only depend on the image pixels. They are kept in a
+    bounded LRU in RAM and, optionally, in a store of memory-mapped `.npy`
+    files on disk, so that they survive across epochs and runs.
+
+    Note that every dataloader worker has its own RAM cache, while the disk
+    store is shared by all of them (files are written atomically).
+
+    Args:
+        max_items (int): Max number of feature maps kept in RAM. 0 disables
+            the RAM cache. Default: 1024.
+        disk_dir (str | None): Directory of the on-disk store. None to
+            disable it. Default: None.
+    """
+
+    def __init__(self, max_items=1024, disk_dir=None):
+        self.max_items = max_items
+        self.disk_dir = disk_dir
+        if disk_dir is not None:
+            os.makedirs(disk_dir, exist_ok=True)
+        self._items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(*args):
+        """Key of a sample, e.g. from its path and crop/augment parameters."""
+        return hashlib.sha1(repr(args).encode('utf-8')).hexdigest()
+
+    def _disk_path(self, key):
+        return osp.join(self.disk_dir, key[:2], f'{key}.npy')
+
+    def get(self, key):
+        """Get the cached features of `key`, or None."""
+        value = self._items.get(key)
+        if value is not None:
+            self._items.move_to_end(key)
+            return value
+        if self.disk_dir is not None:
+            path = self._disk_path(key)
+            if osp.exists(path):
+                value = torch.from_numpy(np.array(np.load(path, mmap_mode='r')))
+                self._put_ram(key, value)
+                return value
+        return None
+
+    def put(self, key, value):
+        """Cache the features (Tensor) of `key`."""
+        value = value.detach().cpu()
+        self._put_ram(key, value)
+        if self.disk_dir is not None:
+            path = self._disk_path(key)
+            if not osp.exists(path):
+                os.makedirs(osp.dirname(path), exist_ok=True)
+                tmp_path = f'{path}.{os.getpid()}.tmp'
+                mmap = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32, shape=tuple(value.shape))
+                mmap[...] = value.float().numpy()
+                mmap.flush()
+                del mmap
+                os.replace(tmp_path, path)
+
+    def _put_ram(self, key, value):
+        if self.max_items <= 0:
+            return
+        self._items[key] = value
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+
+    def get_or_compute(self, key, compute_fn):
+        """Get the cached features of `key`, computing them with
+        `compute_fn()` on a miss."""
+        value = self.get(key)
+        if value is None:
+            self.misses += 1
+            value = compute_fn()
+            self.put(key, value)
+        else:
+            self.hits += 1
+        return value
+
+    def __len__(self):
+        return len(self._items)
@@ -1,6 +1,7 @@
 from torch.utils import data as data
 from torchvision.transforms.functional import normalize
 
+from basicsr.data.contourlet_cache import ContourletCache
 from basicsr.data.data_util import paired_paths_from_folder, paired_paths_from_lmdb, paired_paths_from_meta_info_file
 from basicsr.data.transforms import augment, paired_random_crop
 from basicsr.utils import FileClient, imfrombytes, img2tensor
@@ -35,6 +36,16 @@ class PairedImageDataset(data.Dataset):
             use_hflip (bool): Use horizontal flips.
             use_rot (bool): Use rotation (use vertical flip and transposing h and w for implementation).
 
+            contourlet_cache (dict): Emit the contourlet features of lq (see
+                `input_contourlet_features`, used by DAT with input_contourlet
+                'concat') as `coefs`, cached by lq path and
+                crop/augment parameters. It contains max_items (int), the RAM
+                cache size, disk_dir (str), an optional on-disk store,
+                quantize (bool), which must match `contourlet_quantize` of DAT,
+                and dfilt (str), which must match `contourlet_dfilt` of DAT
+                (default: 'dmaxflat7').
+                Default: None.
+
             scale (bool): Scale, which will be added automatically.
             phase (str): 'train' or 'val'.
     """
@@ -64,6 +75,11 @@ class PairedImageDataset(data.Dataset):
         else:
             self.paths = paired_paths_from_folder([self.lq_folder, self.gt_folder], ['lq', 'gt'], self.filename_tmpl)
 
+        self.coefs_cache = None
+        if opt.get('contourlet_cache') is not None:
+            cache_opt = opt['contourlet_cache']
+            self.coefs_cache = ContourletCache(cache_opt.get('max_items', 1024), cache_opt.get('disk_dir'))
+
     def __getitem__(self, index):
         if self.file_client is None:
             self.file_client = FileClient(self.io_backend_opt.pop('type'), **self.io_backend_opt)
@@ -81,12 +97,17 @@ class PairedImageDataset(data.Dataset):
         img_lq = imfrombytes(img_bytes, float32=True)
 
         # augmentation for training
+        status = None
         if self.opt['phase'] == 'train':
             gt_size = self.opt['gt_size']
             # random crop
-            img_gt, img_lq = paired_random_crop(img_gt, img_lq, gt_size, scale, gt_path)
+            img_gt, img_lq, crop = paired_random_crop(img_gt, img_lq, gt_size, scale, gt_path, return_status=True)
             # flip, rotation
-            img_gt, img_lq = augment([img_gt, img_lq], self.opt['use_hflip'], self.opt['use_rot'])
+            (img_gt, img_lq), status = augment([img_gt, img_lq],
+                                               self.opt['use_hflip'],
+                                               self.opt['use_rot'],
+                                               return_status=True)
+            status = (gt_size, crop, status)
 
         # color space transform
         if 'color' in self.opt and self.opt['color'] == 'y':
@@ -107,7 +128,20 @@ class PairedImageDataset(data.Dataset):
 
         # print(img_lq.shape,img_gt.shape,img_lq.min(),img_gt.min(),img_lq.max(),img_gt.max(),lq_path,gt_path)
 
-        return {'lq': img_lq, 'gt': img_gt, 'lq_path': lq_path, 'gt_path': gt_path}
+        out = {'lq': img_lq, 'gt': img_gt, 'lq_path': lq_path, 'gt_path': gt_path}
+        if self.coefs_cache is not None:
+            # (imported here, the datasets do not depend on the archs otherwise)
+            from basicsr.archs.contourlet_transform.pycontourlet import get_filter_bank
+            from basicsr.archs.dat_arch import input_contourlet_features
+
+            quantize = self.opt['contourlet_cache'].get('quantize', False)
+            dfilt = self.opt['contourlet_cache'].get('dfilt', 'dmaxflat7')
+            key_args = (lq_path, scale, status, self.opt.get('color'), self.mean, self.std, quantize)
+            # dmaxflat7 keeps the keys of the caches written before dfilt
+            key = ContourletCache.make_key(*key_args, *(() if dfilt == 'dmaxflat7' else (dfilt, )))
+            out['coefs'] = self.coefs_cache.get_or_compute(
+                key, lambda: input_contourlet_features(img_lq[None], get_filter_bank('maxflat', dfilt, [3]), quantize)[0])
+        return out
 
     def __len__(self):
         return len(self.paths)
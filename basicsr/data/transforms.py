@@ -23,7 +23,7 @@ def mod_crop(img, scale):
     return img
 
 
-def paired_random_crop(img_gts, img_lqs, gt_patch_size, scale, gt_path=None):
+def paired_random_crop(img_gts, img_lqs, gt_patch_size, scale, gt_path=None, return_status=False):
     """Paired random crop. Support Numpy array and Tensor inputs.
 
     It crops lists of lq and gt images with corresponding locations.
@@ -38,6 +38,8 @@ def paired_random_crop(img_gts, img_lqs, gt_patch_size, scale, gt_path=None):
         gt_patch_size (int): GT patch size.
         scale (int): Scale factor.
         gt_path (str): Path to ground-truth. Default: None.
+        return_status (bool): Return the top and left coordinates of the lq
+            patch. Default: False.
 
     Returns:
         list[ndarray] | ndarray: GT images and LQ images. If returned results
@@ -88,6 +90,8 @@ def paired_random_crop(img_gts, img_lqs, gt_patch_size, scale, gt_path=None):
         img_gts = img_gts[0]
     if len(img_lqs) == 1:
         img_lqs = img_lqs[0]
+    if return_status:
+        return img_gts, img_lqs, (top, left)
     return img_gts, img_lqs
 
 
@@ -0,0 +1,174 @@
+import argparse
+import inspect
+import logging
+import numpy as np
+import os
+import time
+import torch
+import warnings
+import yaml
+from os import path as osp
+
+from basicsr.infer import TRACED_SHAPE_FILE, load_network
+from basicsr.utils import get_root_logger
+from basicsr.utils.options import ordered_yaml
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Export network_g as a TorchScript module for a fixed input size, or as an ONNX graph.')
+    parser.add_argument('-opt', type=str, required=True, help='Path to option YAML file (network_g and path).')
+    parser.add_argument('-o', '--output', type=str, required=True, help='Path of the exported module (.pt/.onnx).')
+    parser.add_argument('--format', type=str, default='torchscript', choices=['torchscript', 'onnx'],
+                        help='TorchScript module (static shapes) or ONNX graph (dynamic batch size, H and W).')
+    parser.add_argument('--model_path', type=str, default=None, help='Checkpoint, overrides path:pretrain_network_g.')
+    parser.add_argument('--param_key', type=str, default='params', help='Parameter key in the checkpoint.')
+    parser.add_argument('--tile', type=int, nargs=2, default=[64, 64],
+                        help='Input size (h w) of the module, or of the example input of the ONNX graph.')
+    parser.add_argument('--batch_size', type=int, default=1, help='Batch size of the module (example input).')
+    parser.add_argument('--fuse', action='store_true', help='Fuse the network for inference (fuse_for_inference).')
+    parser.add_argument('--device', type=str, default='cpu', help='Device the module runs on.')
+    parser.add_argument('--opset', type=int, default=13, help='ONNX opset version.')
+    parser.add_argument('--check_size', type=int, nargs=2, action='append', default=None,
+                        help='Input size (h w) the ONNX graph is checked on with onnxruntime, can be repeated. '
+                        'Default: the tile size and a larger one that needs padding.')
+    parser.add_argument('--repeat', type=int, default=10, help='Runs of the latency measures of the ONNX check.')
+    return parser.parse_args()
+
+
+def prepare_for_export(net, input_shape, fuse=False):
+    """Put `net` in its export mode for inputs of `input_shape` (B, C, h, w).
+
+    The model is put in eval mode and its position biases are frozen (or the
+    whole model is fused). The shape-dependent constants (window index maps,
+    shift masks, contourlet filter bank plans) are then built by a forward
+    on an example input, so that a trace only records the tensor ops, with
+    these constants and all the shapes baked in.
+
+    Returns:
+        Tensor: The example input.
+    """
+    net.eval()
+    if fuse:
+        net.fuse_for_inference()
+    elif hasattr(net, 'freeze_position_bias'):
+        net.freeze_position_bias()
+    param = next(net.parameters())
+    example = torch.rand(*input_shape, dtype=param.dtype, device=param.device)
+    with torch.no_grad():
+        net(example)
+    return example
+
+
+def trace_network(net, example):
+    """TorchScript module of `net` traced on `example` (see prepare_for_export).
+
+    The module only runs on inputs of the shape, dtype and device of
+    `example`; images go through `tile_inference` with that tile size and
+    batch size (static_shape). The shape is saved with the module (see
+    TRACED_SHAPE_FILE in basicsr/infer.py).
+    """
+    with torch.no_grad(), warnings.catch_warnings():
+        # the shapes are static on purpose
+        warnings.simplefilter('ignore', torch.jit.TracerWarning)
+        return torch.jit.trace(net, example, check_trace=False)
+
+
+def export_onnx(net, example, output, opset_version=13):
+    """Export `net` (see prepare_for_export) to an ONNX graph with dynamic
+    batch size, H and W.
+
+    While exporting, the window index maps, the shift masks and the
+    contourlet decomposition of DAT are computed in the graph from the input
+    size instead of being constants of the traced size (see
+    `torch.onnx.is_in_onnx_export` in dat_arch and pycontourlet).
+    """
+    kwargs = {}
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        # TorchScript based exporter, as in torch 1.x
+        kwargs['dynamo'] = False
+    with torch.no_grad(), warnings.catch_warnings():
+        warnings.simplefilter('ignore', torch.jit.TracerWarning)
+        torch.onnx.export(
+            net,
+            example,
+            output,
+            input_names=['lq'],
+            output_names=['output'],
+            opset_version=opset_version,
+            dynamic_axes={
+                'lq': {0: 'batch', 2: 'height', 3: 'width'},
+                'output': {0: 'batch', 2: 'out_height', 3: 'out_width'}
+            },
+            **kwargs)
+
+
+def check_onnx(net, path, input_shapes, repeat=10):
+    """Run the ONNX graph at `path` with onnxruntime on CPU for inputs of
+    `input_shapes`, and compare it with `net`.
+
+    Returns:
+        list[dict]: Per shape, the max abs difference of the outputs and the
+            mean latencies (s) of `net` and onnxruntime.
+    """
+    import onnxruntime
+
+    session = onnxruntime.InferenceSession(path, providers=['CPUExecutionProvider'])
+    param = next(net.parameters())
+    results = []
+    for shape in input_shapes:
+        x = torch.rand(*shape, dtype=param.dtype, device=param.device)
+        inputs = {'lq': x.cpu().numpy()}
+        with torch.no_grad():
+            output = net(x).cpu().numpy()
+            start = time.perf_counter()
+            for _ in range(repeat):
+                net(x)
+            if x.is_cuda:
+                torch.cuda.synchronize()
+            eager_time = (time.perf_counter() - start) / repeat
+        output_ort = session.run(None, inputs)[0]
+        start = time.perf_counter()
+        for _ in range(repeat):
+            session.run(None, inputs)
+        ort_time = (time.perf_counter() - start) / repeat
+        results.append(
+            dict(shape=tuple(shape), diff=float(np.abs(output_ort - output).max()), eager=eager_time, ort=ort_time))
+    return results
+
+
+def export_pipeline():
+    args = parse_args()
+    with open(args.opt, mode='r') as f:
+        opt = yaml.load(f, Loader=ordered_yaml()[0])
+    logger = get_root_logger(logger_name='basicsr', log_level=logging.INFO)
+
+    net = load_network(args, opt, torch.device(args.device))
+    in_chans = opt['network_g'].get('in_chans', 3)
+    example = prepare_for_export(net, (args.batch_size, in_chans, *args.tile), fuse=args.fuse)
+    if osp.dirname(args.output):
+        os.makedirs(osp.dirname(args.output), exist_ok=True)
+
+    if args.format == 'onnx':
+        export_onnx(net, example, args.output, opset_version=args.opset)
+        logger.info(f'Saved the ONNX graph (opset {args.opset}, dynamic batch size, H and W) to {args.output}')
+        sizes = args.check_size or [args.tile, [args.tile[0] + 8, args.tile[1] + 24]]
+        for result in check_onnx(net, args.output, [(args.batch_size, in_chans, *size) for size in sizes],
+                                 args.repeat):
+            logger.info(f"{'x'.join(map(str, result['shape']))}: max abs difference {result['diff']:.3e}, "
+                        f"latency eager ({args.device}) {result['eager'] * 1000:.2f} ms, "
+                        f"onnxruntime (CPU) {result['ort'] * 1000:.2f} ms")
+        return
+
+    traced = trace_network(net, example)
+
+    with torch.no_grad():
+        diff = (traced(example) - net(example)).abs().max().item()
+    logger.info(f'Max abs difference between the traced and eager outputs: {diff:.3e}')
+    traced.save(args.output, _extra_files={TRACED_SHAPE_FILE: ','.join(map(str, example.shape))})
+    logger.info(f'Saved the module for {args.batch_size}x{in_chans}x{args.tile[0]}x{args.tile[1]} inputs '
+                f'({args.device}) to {args.output}')
+
+
+if __name__ == '__main__':
+    export_pipeline()
@@ -0,0 +1,256 @@
+import argparse
+import cv2
+import glob
+import logging
+import os
+import queue
+import threading
+import time
+import torch
+import yaml
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from os import path as osp
+
+from basicsr.archs import build_network
+from basicsr.data.single_image_dataset import SingleImageDataset
+from basicsr.utils import get_root_logger, img2tensor, imwrite, tensor2img, tile_inference
+from basicsr.utils.options import ordered_yaml
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mkv', '.mov', '.webm', '.flv')
+# Extra file of the TorchScript modules of basicsr/export.py with their input shape (B,C,h,w)
+TRACED_SHAPE_FILE = 'input_shape'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Super-resolve folders, globs, video files or streams.')
+    parser.add_argument('-opt', type=str, required=True, help='Path to option YAML file (network_g and path).')
+    parser.add_argument('-i', '--input', type=str, required=True,
+                        help='Image folder, glob pattern, video file, stream URL or camera index.')
+    parser.add_argument('-o', '--output', type=str, default='results/infer', help='Output folder.')
+    parser.add_argument('--model_path', type=str, default=None, help='Checkpoint, overrides path:pretrain_network_g.')
+    parser.add_argument('--param_key', type=str, default='params', help='Parameter key in the checkpoint.')
+    parser.add_argument('--batch_size', type=int, default=4, help='Frames per forward (same-sized frames only).')
+    parser.add_argument('--num_workers', type=int, default=4, help='Image decode workers.')
+    parser.add_argument('--num_writers', type=int, default=4, help='Image encode/write threads.')
+    parser.add_argument('--tile', type=int, nargs='+', default=[0],
+                        help='Tile size (h [w]) on the input, 0 for whole frames.')
+    parser.add_argument('--tile_overlap', type=int, default=32, help='Overlap between tiles, smaller than --tile.')
+    parser.add_argument('--fuse', action='store_true', help='Fuse the network for inference (fuse_for_inference).')
+    parser.add_argument('--jit', action='store_true',
+                        help='model_path is a module from basicsr/export.py. --tile must be its input size, its '
+                        'batch size is the number of tiles per forward.')
+    parser.add_argument('--suffix', type=str, default='', help='Suffix of the output file names.')
+    parser.add_argument('--ext', type=str, default='png', help='Extension of the output images.')
+    parser.add_argument('--save_video', action='store_true', help='Write video inputs to a video file, not frames.')
+    parser.add_argument('--fps_interval', type=int, default=100, help='Log the throughput every N frames.')
+    return parser.parse_args()
+
+
+def load_network(args, opt, device):
+    """Build network_g from the options and load its weights."""
+    net = build_network(opt['network_g'])
+    model_path = args.model_path or opt.get('path', {}).get('pretrain_network_g')
+    if model_path is not None:
+        load_net = torch.load(model_path, map_location=lambda storage, loc: storage)
+        if args.param_key in load_net:
+            load_net = load_net[args.param_key]
+        elif 'params' in load_net:
+            load_net = load_net['params']
+        # remove unnecessary 'module.'
+        load_net = {k[7:] if k.startswith('module.') else k: v for k, v in load_net.items()}
+        net.load_state_dict(load_net, strict=opt.get('path', {}).get('strict_load_g', True))
+    return net.to(device).eval()
+
+
+def load_traced_network(path, device):
+    """Load a TorchScript module of basicsr/export.py.
+
+    Returns:
+        tuple: The module and the (B, C, h, w) input shape it was traced on.
+    """
+    extra_files = {TRACED_SHAPE_FILE: ''}
+    net = torch.jit.load(path, map_location=device, _extra_files=extra_files)
+    if not extra_files[TRACED_SHAPE_FILE]:
+        raise ValueError(f'{path} has no recorded input shape, export it again with basicsr/export.py.')
+    input_shape = tuple(int(v) for v in extra_files[TRACED_SHAPE_FILE].decode().split(','))
+    return net, input_shape
+
+
+def traced_tile_kwargs(tile, input_shape):
+    """tile_inference arguments of a module traced on `input_shape`, after
+    checking that the tile size `tile` (h, w) is its input size."""
+    batch_size, _, h, w = input_shape
+    if tuple(tile) != (h, w):
+        raise ValueError(f'The module was traced on {batch_size}x{h}x{w} inputs, it needs --tile {h} {w} '
+                         f'(got {tile[0]} {tile[1]}).')
+    return dict(batch_size=batch_size, static_shape=True)
+
+
+def is_video(source):
+    return source.isdigit() or '://' in source or source.lower().endswith(VIDEO_EXTENSIONS)
+
+
+def image_batches(source, batch_size, num_workers):
+    """Yield (lq, names) batches of a folder or glob, decoded by
+    SingleImageDataset in dataloader workers. Consecutive images of the
+    same size are batched together."""
+    folder = source if osp.isdir(source) else (osp.dirname(source) or '.')
+    dataset = SingleImageDataset({'dataroot_lq': folder, 'io_backend': {'type': 'disk'}})
+    if not osp.isdir(source):
+        # glob pattern
+        dataset.paths = sorted(glob.glob(source))
+    loader = torch.utils.data.DataLoader(
+        dataset, batch_size=None, shuffle=False, num_workers=num_workers, pin_memory=torch.cuda.is_available())
+
+    imgs, names = [], []
+    for data in loader:
+        if imgs and (data['lq'].shape != imgs[0].shape or len(imgs) == batch_size):
+            yield torch.stack(imgs), names
+            imgs, names = [], []
+        imgs.append(data['lq'])
+        names.append(osp.splitext(osp.basename(data['lq_path']))[0])
+    if imgs:
+        yield torch.stack(imgs), names
+
+
+def video_batches(source, batch_size, info):
+    """Yield (lq, names) batches of a video file or stream, decoded by a
+    background thread. The frame rate of the source goes to `info`."""
+    cap = cv2.VideoCapture(int(source) if source.isdigit() else source)
+    if not cap.isOpened():
+        raise IOError(f'Cannot open video source {source}.')
+    info['fps'] = cap.get(cv2.CAP_PROP_FPS) or 25
+    stem = 'camera' + source if source.isdigit() else osp.splitext(osp.basename(source.rstrip('/')))[0]
+    frames = queue.Queue(maxsize=4 * batch_size)
+
+    def decode():
+        idx = 0
+        while True:
+            ret, img = cap.read()
+            if not ret:
+                break
+            frames.put((img2tensor(img.astype('float32') / 255., bgr2rgb=True, float32=True), f'{stem}_{idx:06d}'))
+            idx += 1
+        frames.put(None)
+        cap.release()
+
+    threading.Thread(target=decode, daemon=True).start()
+    imgs, names = [], []
+    while True:
+        item = frames.get()
+        if item is None:
+            break
+        imgs.append(item[0])
+        names.append(item[1])
+        if len(imgs) == batch_size:
+            yield torch.stack(imgs), names
+            imgs, names = [], []
+    if imgs:
+        yield torch.stack(imgs), names
+
+
+class VideoSink():
+    """Write frames, in order, to a video file."""
+
+    def __init__(self, path, fps):
+        self.path = path
+        self.fps = fps
+        self.writer = None
+
+    def write(self, img):
+        if self.writer is None:
+            h, w = img.shape[:2]
+            os.makedirs(osp.dirname(self.path), exist_ok=True)
+            self.writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*'mp4v'), self.fps, (w, h))
+        self.writer.write(img)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.release()
+
+
+def inference_pipeline():
+    """Decode workers -> batched forward -> asynchronous writers."""
+    args = parse_args()
+    with open(args.opt, mode='r') as f:
+        opt = yaml.load(f, Loader=ordered_yaml()[0])
+    logger = get_root_logger(logger_name='basicsr', log_level=logging.INFO)
+
+    device = torch.device('cuda' if torch.cuda.is_available() and opt.get('num_gpu', 1) != 0 else 'cpu')
+    torch.backends.cudnn.benchmark = True
+    tile = (args.tile * 2)[:2]
+    if args.jit:
+        # static shapes: full tiles, padded if needed, in batches of the traced batch size
+        net, input_shape = load_traced_network(args.model_path, device)
+        tile_kwargs = traced_tile_kwargs(tile, input_shape)
+    else:
+        net = load_network(args, opt, device)
+        tile_kwargs = {}
+        if args.fuse:
+            net.fuse_for_inference()
+    scale = opt.get('scale', opt['network_g'].get('upscale', 1))
+
+    info = {}
+    if is_video(args.input):
+        batches = video_batches(args.input, args.batch_size, info)
+    else:
+        batches = image_batches(args.input, args.batch_size, args.num_workers)
+
+    sink = None
+    if is_video(args.input) and args.save_video:
+        # frames must be written in order by a single thread
+        stem = osp.splitext(osp.basename(args.input.rstrip('/')))[0] or 'video'
+        sink = VideoSink(osp.join(args.output, f'{stem}{args.suffix}.mp4'), None)
+        num_writers = 1
+    else:
+        num_writers = args.num_writers
+    writers = ThreadPoolExecutor(max_workers=num_writers)
+
+    def write(output, names):
+        for out, name in zip(output, names):
+            img = tensor2img(out)
+            if sink is not None:
+                sink.write(img)
+            else:
+                imwrite(img, osp.join(args.output, f'{name}{args.suffix}.{args.ext}'))
+
+    pending = deque()
+    # the first (warm-up) batch is not timed
+    num_frames, num_timed, start, last_log = 0, 0, None, 0
+    with torch.no_grad():
+        for lq, names in batches:
+            if sink is not None and sink.fps is None:
+                sink.fps = info['fps']
+            lq = lq.to(device, non_blocking=True)
+            if tile[0] > 0:
+                output = tile_inference(
+                    net, lq, scale, tile_size=tile, tile_overlap=args.tile_overlap, **tile_kwargs)
+            else:
+                output = net(lq)
+            pending.append(writers.submit(write, output.float().cpu(), names))
+            # bound the number of frames waiting to be written
+            while len(pending) > 2 * num_writers:
+                pending.popleft().result()
+
+            num_frames += len(names)
+            if start is None:
+                start = time.time()
+            else:
+                num_timed += len(names)
+            if num_frames - last_log >= args.fps_interval and num_timed > 0:
+                last_log = num_frames
+                logger.info(f'{num_frames} frames, {num_timed / (time.time() - start):.2f} fps')
+    for future in pending:
+        future.result()
+    writers.shutdown()
+    if sink is not None:
+        sink.close()
+
+    if num_timed > 0:
+        logger.info(f'Done: {num_frames} frames, {num_timed / (time.time() - start):.2f} fps.')
+    logger.info(f'Results are in {args.output}')
+
+
+if __name__ == '__main__':
+    inference_pipeline()
@@ -3,7 +3,7 @@ from copy import deepcopy
 from basicsr.utils import get_root_logger
 from basicsr.utils.registry import LOSS_REGISTRY
 from .losses import (CharbonnierLoss, GANLoss, L1Loss, MSELoss, WeightedTVLoss, g_path_regularize,
-                     gradient_penalty_loss, r1_penalty, L_clip)
+                     gradient_penalty_loss, r1_penalty, L_clip, L_clip_MSE)
 
 __all__ = [
     'L_clip', 'L_clip_MSE', 'L1Loss', 'MSELoss', 'CharbonnierLoss', 'WeightedTVLoss', 'GANLoss', 'gradient_penalty_loss',
@@ -9,14 +9,6 @@ from basicsr.utils.registry import LOSS_REGISTRY
 from .loss_util import weighted_loss
 
 import torchvision.transforms as transforms
-import clip
-
-device = "cuda" if torch.cuda.is_available() else "cpu"
-#load clip
-model, preprocess = clip.load("ViT-B/32", device=torch.device("cpu"), download_root="./clip_model/")#"ViT-B/32"
-model.to(device)
-for para in model.parameters():
-	para.requires_grad = False
 
 _reduction_modes = ['none', 'mean', 'sum']
 
@@ -35,74 +27,145 @@ def mse_loss(pred, target):
 def charbonnier_loss(pred, target, eps=1e-12):
     return torch.sqrt((pred - target)**2 + eps)
 
-def get_clip_score(tensor,words):
-	score=0
-	for i in range(tensor.shape[0]):
-		#image preprocess
-		clip_normalizer = transforms.Normalize((0.48145466, 0.4578275, 0.40821073), (0.26862954, 0.26130258, 0.27577711))
-		img_resize = transforms.Resize((224,224))
-		image2=img_resize(tensor[i])
-		image=clip_normalizer(image2).unsqueeze(0)
-		#get probabilitis
-		text = clip.tokenize(words).to(device)
-		logits_per_image, logits_per_text = model(image, text)
-		probs = logits_per_image.softmax(dim=-1)
-		#2-word-compared probability
-		prob = probs[0][0]/probs[0][1]#you may need to change this line for more words comparison
-		#prob = probs[0][0]
-		score =score + prob
-
-	return score/tensor.shape[0]
+clip_normalizer = transforms.Normalize((0.48145466, 0.4578275, 0.40821073), (0.26862954, 0.26130258, 0.27577711))
+clip_resize = transforms.Resize((224, 224))
+
+# CLIP models shared by all the losses of the process, see load_clip_model
+_clip_models = {}
+_text_features = {}
+
+
+def load_clip_model(name, device, fp16=False, download_root='./clip_model/'):
+    """Load a frozen CLIP model, once per process, device and precision.
+
+    `clip` is imported here, so that it is only required (and loaded) when a
+    CLIP loss is used. It is OpenAI CLIP
+    (pip install git+https://github.com/openai/CLIP.git), not the `clip`
+    package of PyPI.
+
+    Args:
+        name (str): CLIP model name, e.g. 'ViT-B/32' or 'RN101'.
+        device (torch.device | str): Device of the model.
+        fp16 (bool): Use fp16 weights (CUDA only). Default: False.
+        download_root (str): Folder of the CLIP checkpoints. Default: './clip_model/'.
+    """
+    import clip
+    from clip.model import convert_weights
+
+    device = torch.device(device)
+    fp16 = fp16 and device.type == 'cuda'
+    key = (name, str(device), fp16)
+    if key not in _clip_models:
+        clip_model, _ = clip.load(name, device='cpu', download_root=download_root)
+        clip_model = clip_model.to(device).eval()
+        if fp16:
+            convert_weights(clip_model)
+        for param in clip_model.parameters():
+            param.requires_grad = False
+        _clip_models[key] = clip_model
+    return _clip_models[key]
+
+
+def clip_preprocess(tensor):
+    """Resize and normalize a batch of images (B, 3, H, W) for CLIP."""
+    return clip_normalizer(clip_resize(tensor))
+
+
+def get_text_features(clip_model, words):
+    """Normalized text embeddings of `words`, encoded once and cached."""
+    import clip
+
+    key = (id(clip_model), tuple(words))
+    if key not in _text_features:
+        with torch.no_grad():
+            text = clip.tokenize(words).to(next(clip_model.parameters()).device)
+            text_features = clip_model.encode_text(text).float()
+        _text_features[key] = text_features / text_features.norm(dim=1, keepdim=True)
+    return _text_features[key]
+
+
+def get_clip_score(clip_model, tensor, words):
+    image_features = clip_model.encode_image(clip_preprocess(tensor)).float()
+    image_features = image_features / image_features.norm(dim=1, keepdim=True)
+    text_features = get_text_features(clip_model, words)
+    # get probabilities
+    logits_per_image = clip_model.logit_scale.exp().float() * image_features @ text_features.t()
+    probs = logits_per_image.softmax(dim=-1)
+    # 2-word-compared probability
+    prob = probs[:, 0] / probs[:, 1]  # you may need to change this line for more words comparison
+    return prob.mean()
+
 
 @LOSS_REGISTRY.register()
 class L_clip(nn.Module):
-    def __init__(self):
-        super(L_clip,self).__init__()
-        for param in self.parameters(): 
-            param.requires_grad = False
-  
-    def forward(self, x):
-        #k1 = get_clip_score(x,["A low resolution photo","A high resolution photo"])
-        k2 = get_clip_score(x,["A blurry and dim photo","A clear and sharp photo"])
-        #k3 = get_clip_score(x,["A low-contrast, detail-missing, and blurry photo","A high-contrast, clear, and textured-rich photo"])
+    """CLIP prompt loss: ratio of the probabilities of a negative and a
+    positive prompt, averaged over the batch.
+
+    The CLIP model is loaded at the first forward, on the device of the
+    input, and shared with the other CLIP losses of the process.
+
+    `target` and `weight` are not used. They are accepted so that it can be
+    called like L_clip_MSE.
+
+    Args:
+        clip_model (str): CLIP model name. Default: 'ViT-B/32'.
+        fp16 (bool): Use fp16 CLIP weights on CUDA. Default: False.
+        download_root (str): Folder of the CLIP checkpoints. Default: './clip_model/'.
+    """
+
+    def __init__(self, clip_model='ViT-B/32', fp16=False, download_root='./clip_model/'):
+        super(L_clip, self).__init__()
+        self.clip_model = clip_model
+        self.fp16 = fp16
+        self.download_root = download_root
+
+    def forward(self, pred, target=None, weight=None):
+        clip_model = load_clip_model(self.clip_model, pred.device, self.fp16, self.download_root)
+        # k1 = get_clip_score(clip_model, pred, ["A low resolution photo", "A high resolution photo"])
+        k2 = get_clip_score(clip_model, pred, ["A blurry and dim photo", "A clear and sharp photo"])
+        # k3 = get_clip_score(clip_model, pred, ["A low-contrast, detail-missing, and blurry photo",
+        #                                        "A high-contrast, clear, and textured-rich photo"])
         k = k2
-        return 0.2*k
-
-#for clip reconstruction loss
-res_model, res_preprocess = clip.load("RN101", device=device, download_root="./clip_model/")
-for para in res_model.parameters():
-    para.requires_grad = False
-
-def get_clip_score_MSE(pred,inp,weight):
-    score=0
-    for i in range(pred.shape[0]):
-        clip_normalizer = transforms.Normalize((0.48145466, 0.4578275, 0.40821073), (0.26862954, 0.26130258, 0.27577711))
-        img_resize = transforms.Resize((224,224))
-        pred_img=img_resize(pred[i])
-        pred_img=clip_normalizer(pred_img.reshape(1,3,224,224))
-        pred_image_features = res_model.encode_image(pred_img)
-        
-        inp_img=img_resize(inp[i])
-        inp_img=clip_normalizer(inp_img.reshape(1,3,224,224))
-        inp_image_features = res_model.encode_image(inp_img)
-
-        MSE_loss_per_img=0
-        for feature_index in range(len(weight)):
-            MSE_loss_per_img=MSE_loss_per_img+weight[feature_index]*F.mse_loss(pred_image_features[0][feature_index].squeeze(0),inp_image_features[0][feature_index].squeeze(0))
-            score = score + MSE_loss_per_img
-    return score
+        return 0.2 * k
+
+
+def get_clip_score_MSE(clip_model, pred, inp, weight):
+    # pred and inp go through the image encoder together
+    features = clip_model.encode_image(clip_preprocess(torch.cat([pred, inp], dim=0))).float()
+    pred_image_features, inp_image_features = features[:pred.shape[0]], features[pred.shape[0]:]
+
+    num = len(weight)
+    weight = torch.as_tensor(weight, dtype=features.dtype, device=features.device)
+    # terms of the first len(weight) features of every image; the term of
+    # feature k is accumulated for every k' >= k, hence (num - k) times
+    loss = weight * (pred_image_features[:, :num] - inp_image_features[:, :num]).pow(2)
+    return (loss * torch.arange(num, 0, -1, dtype=loss.dtype, device=loss.device)).sum()
+
 
 @LOSS_REGISTRY.register()
 class L_clip_MSE(nn.Module):
-    def __init__(self):
-        super(L_clip_MSE,self).__init__()
-        for param in self.parameters():
-            param.requires_grad = False
-		
-    def forward(self, pred, inp,weight=[1.0,1.0,1.0,1.0,0.5]):
-        res = get_clip_score_MSE(pred,inp,weight)
+    """CLIP reconstruction loss on the image features of pred and inp.
+
+    The CLIP model is loaded at the first forward, like in L_clip.
+
+    Args:
+        clip_model (str): CLIP model name. Default: 'RN101'.
+        fp16 (bool): Use fp16 CLIP weights on CUDA. Default: True.
+        download_root (str): Folder of the CLIP checkpoints. Default: './clip_model/'.
+    """
+
+    def __init__(self, clip_model='RN101', fp16=True, download_root='./clip_model/'):
+        super(L_clip_MSE, self).__init__()
+        self.clip_model = clip_model
+        self.fp16 = fp16
+        self.download_root = download_root
+
+    def forward(self, pred, inp, weight=[1.0, 1.0, 1.0, 1.0, 0.5]):
+        clip_model = load_clip_model(self.clip_model, pred.device, self.fp16, self.download_root)
+        res = get_clip_score_MSE(clip_model, pred, inp, weight)
         return res
 
+
 @LOSS_REGISTRY.register()
 class L1Loss(nn.Module):
     """L1 (mean absolute error, MAE) loss.
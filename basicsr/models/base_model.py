@@ -80,6 +80,8 @@ class BaseModel():
 
         for k in net_g_ema_params.keys():
             net_g_ema_params[k].data.mul_(decay).add_(net_g_params[k].data, alpha=1 - decay)
+        # the weights changed, reset the eval-time caches of net_g_ema
+        self.net_g_ema.eval()
 
     def get_current_log(self):
         return self.log_dict
@@ -317,6 +319,8 @@ class BaseModel():
                 state['optimizers'].append(o.state_dict())
             for s in self.schedulers:
                 state['schedulers'].append(s.state_dict())
+            if getattr(self, 'scaler', None) is not None and self.scaler.is_enabled():
+                state['scaler'] = self.scaler.state_dict()
             save_filename = f'{current_iter}.state'
             save_path = os.path.join(self.opt['path']['training_states'], save_filename)
 
@@ -338,7 +342,7 @@ class BaseModel():
                 # raise IOError(f'Cannot save {save_path}.')
 
     def resume_training(self, resume_state):
-        """Reload the optimizers and schedulers for resumed training.
+        """Reload the optimizers, schedulers and grad scaler for resumed training.
 
         Args:
             resume_state (dict): Resume state.
@@ -351,6 +355,8 @@ class BaseModel():
             self.optimizers[i].load_state_dict(o)
         for i, s in enumerate(resume_schedulers):
             self.schedulers[i].load_state_dict(s)
+        if resume_state.get('scaler') and getattr(self, 'scaler', None) is not None:
+            self.scaler.load_state_dict(resume_state['scaler'])
 
     def reduce_loss_dict(self, loss_dict):
         """reduce loss dict.
@@ -52,6 +52,10 @@ class SRModel(BaseModel):
                 self.model_ema(0)  # copy net_g weight
             self.net_g_ema.eval()
 
+        # mixed precision (CUDA only)
+        self.use_amp = train_opt.get('amp', False) and self.device.type == 'cuda'
+        self.scaler = torch.cuda.amp.GradScaler(enabled=self.use_amp)
+
         # define losses
         if train_opt.get('pixel_opt'):
             self.cri_pix = build_loss(train_opt['pixel_opt']).to(self.device)
@@ -93,10 +97,25 @@ class SRModel(BaseModel):
         self.lq = data['lq'].to(self.device)
         if 'gt' in data:
             self.gt = data['gt'].to(self.device)
+        # precomputed contourlet features of lq (see PairedImageDataset)
+        self.coefs = data['coefs'].to(self.device) if 'coefs' in data else None
+
+    def net_forward(self, net, lq):
+        """Run `net` on `lq`, passing the precomputed contourlet features of
+        the batch when the dataset provides them."""
+        if getattr(self, 'coefs', None) is None:
+            return net(lq)
+        return net(lq, coefs=self.coefs)
+
+    def autocast(self, enabled):
+        """Autocast context for mixed precision, enabled on CUDA only."""
+        return torch.cuda.amp.autocast(enabled=enabled and self.device.type == 'cuda')
 
     def optimize_parameters(self, current_iter):
         self.optimizer_g.zero_grad()
-        self.output = self.net_g(self.lq)
+        with self.autocast(self.use_amp):
+            self.output = self.net_forward(self.net_g, self.lq)
+        self.output = self.output.float()
 
         l_total = 0
         loss_dict = OrderedDict()
@@ -120,8 +139,9 @@ class SRModel(BaseModel):
             l_total += l_prompt
             loss_dict['l_prompt'] = l_prompt
 
-        l_total.backward()
-        self.optimizer_g.step()
+        self.scaler.scale(l_total).backward()
+        self.scaler.step(self.optimizer_g)
+        self.scaler.update()
 
         self.log_dict = self.reduce_loss_dict(loss_dict)
 
@@ -129,14 +149,15 @@ class SRModel(BaseModel):
             self.model_ema(decay=self.ema_decay)
 
     def test(self):
+        use_amp = self.opt.get('val', {}).get('amp', False)
         if hasattr(self, 'net_g_ema'):
             self.net_g_ema.eval()
-            with torch.no_grad():
-                self.output = self.net_g_ema(self.lq)
+            with torch.no_grad(), self.autocast(use_amp):
+                self.output = self.net_forward(self.net_g_ema, self.lq).float()
         else:
             self.net_g.eval()
-            with torch.no_grad():
-                self.output = self.net_g(self.lq)
+            with torch.no_grad(), self.autocast(use_amp):
+                self.output = self.net_forward(self.net_g, self.lq).float()
             self.net_g.train()
 
     def dist_validation(self, dataloader, current_iter, tb_logger, save_img):
@@ -2,6 +2,7 @@ from .file_client import FileClient
 from .img_util import crop_border, imfrombytes, img2tensor, imwrite, tensor2img
 from .logger import AvgTimer, MessageLogger, get_env_info, get_root_logger, init_tb_logger, init_wandb_logger
 from .misc import check_resume, get_time_str, make_exp_dirs, mkdir_and_rename, scandir, set_random_seed, sizeof_fmt
+from .tile_util import tile_inference
 
 __all__ = [
     # file_client.py
@@ -27,4 +28,6 @@ __all__ = [
     'scandir',
     'check_resume',
     'sizeof_fmt',
+    # tile_util.py
+    'tile_inference',
 ]
@@ -174,8 +174,9 @@ def get_root_logger(logger_name='basicsr', log_level=logging.INFO, log_file=None
     rank, _ = get_dist_info()
     if rank != 0:
         logger.setLevel('ERROR')
-    elif log_file is not None:
+    else:
         logger.setLevel(log_level)
+    if rank == 0 and log_file is not None:
         # add file handler
         file_handler = logging.FileHandler(log_file, 'w')
         file_handler.setFormatter(logging.Formatter(format_str))
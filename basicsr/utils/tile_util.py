@@ -0,0 +1,143 @@
+import math
+import torch
+import weakref
+from torch.nn import functional as F
+
+# Probed tile batch sizes of every network, keyed by tile shape, dtype, device, memory budget and autocast
+_probed_batch_sizes = weakref.WeakKeyDictionary()
+
+
+def _tile_starts(length, tile, overlap):
+    """Start offsets of tiles of size `tile` covering [0, length) with at
+    least `overlap` pixels shared by neighbours. The last tile is aligned to
+    the end, so every tile has the same size."""
+    if length <= tile:
+        return [0]
+    stride = tile - overlap
+    num = math.ceil((length - tile) / stride) + 1
+    starts = [i * stride for i in range(num - 1)]
+    starts.append(length - tile)
+    return starts
+
+
+def _blend_window(length, overlap, window, device):
+    """1D blending weights of an output tile of `length` pixels.
+
+    'hann' ramps the weights up and down over `overlap` pixels with a raised
+    cosine (half of a Hann window) and keeps them at 1 in the middle. The
+    weights never reach 0, so pixels covered by a single tile (image
+    borders) are kept as they are. 'none' gives uniform weights, which
+    averages the overlaps.
+    """
+    if window == 'none' or overlap == 0:
+        return torch.ones(length, device=device)
+    elif window == 'hann':
+        t = torch.arange(length, device=device, dtype=torch.float32)
+        ramp = torch.clamp(torch.minimum(t + 0.5, length - t - 0.5) / overlap, max=1)
+        return 0.5 - 0.5 * torch.cos(math.pi * ramp)
+    else:
+        raise ValueError(f'Unsupported blending window: {window}.')
+
+
+def _probe_batch_size(net, tile, max_memory):
+    """Number of tiles per batch that fit in `max_memory` bytes of CUDA
+    memory, measured on one tile. The measure is done once per network,
+    tile shape, dtype and device (and memory budget)."""
+    key = (tuple(tile.shape[1:]), tile.dtype, tile.device, max_memory, torch.is_autocast_enabled())
+    batch_sizes = _probed_batch_sizes.setdefault(net, {})
+    if key not in batch_sizes:
+        batch_sizes[key] = _measure_batch_size(net, tile, max_memory)
+    return batch_sizes[key]
+
+
+def _measure_batch_size(net, tile, max_memory):
+    torch.cuda.synchronize(tile.device)
+    torch.cuda.reset_peak_memory_stats(tile.device)
+    base = torch.cuda.memory_allocated(tile.device)
+    net(tile)
+    per_tile = max(torch.cuda.max_memory_allocated(tile.device) - base, 1)
+    return max(1, int(max_memory // per_tile))
+
+
+@torch.no_grad()
+def tile_inference(net,
+                   img,
+                   scale,
+                   tile_size=256,
+                   tile_overlap=32,
+                   batch_size=None,
+                   max_memory=None,
+                   window='hann',
+                   static_shape=False):
+    """Run `net` on overlapping tiles of `img` and blend the outputs.
+
+    All tiles have the same size, so they are stacked into mini-batches. The
+    outputs are accumulated with blending weights on the device of `img`,
+    which bounds the peak memory by the tile batch instead of the image size.
+
+    Args:
+        net (nn.Module): Network mapping (N, C, h, w) to (N, C', h * scale, w * scale).
+        img (Tensor): Input images with shape (B, C, H, W).
+        scale (int): Upsampling factor of `net`.
+        tile_size (int | tuple[int]): Tile size (h, w) on the input. Default: 256.
+        tile_overlap (int): Overlap between neighbouring tiles on the input, smaller than the tile
+            size. Default: 32.
+        batch_size (int | None): Number of tiles per forward. If None, it is
+            derived from `max_memory`, or 1. Default: None.
+        max_memory (int | None): CUDA memory budget (bytes) of one forward,
+            used to derive `batch_size`. Default: None.
+        window (str): Blending window, 'hann' (feathered seams) or 'none'
+            (plain average). Default: 'hann'.
+        static_shape (bool): Only feed `net` with full batches of
+            `batch_size` tiles of `tile_size`, for networks traced on one
+            input shape (TorchScript modules of basicsr/export.py). Images
+            smaller than the tile are padded (replicated borders) instead of
+            shrinking the tile, and the last batch is padded with copies of
+            its last tile. Default: False.
+
+    Returns:
+        Tensor: Output images with shape (B, C', H * scale, W * scale).
+    """
+    b, _, h, w = img.shape
+    tile_h, tile_w = (tile_size, tile_size) if isinstance(tile_size, int) else tile_size
+    if tile_overlap >= min(tile_h, tile_w):
+        # (no stride left between the tiles)
+        raise ValueError(f'tile_overlap ({tile_overlap}) must be smaller than the tile size ({tile_h}, {tile_w}).')
+    if static_shape:
+        if batch_size is None:
+            raise ValueError('tile_inference with static_shape needs the batch_size of the network.')
+        if h < tile_h or w < tile_w:
+            img = F.pad(img, (0, max(tile_w - w, 0), 0, max(tile_h - h, 0)), mode='replicate')
+            output = tile_inference(net, img, scale, (tile_h, tile_w), tile_overlap, batch_size, window=window,
+                                    static_shape=True)
+            return output[..., :h * scale, :w * scale]
+    tile_h, tile_w = min(tile_h, h), min(tile_w, w)
+    overlap_h, overlap_w = min(tile_overlap, tile_h - 1), min(tile_overlap, tile_w - 1)
+
+    boxes = [(top, left) for top in _tile_starts(h, tile_h, overlap_h) for left in _tile_starts(w, tile_w, overlap_w)]
+    # (batch index, top, left) of every tile
+    tiles = [(i, top, left) for i in range(b) for top, left in boxes]
+
+    if batch_size is None:
+        if max_memory is not None and img.is_cuda:
+            batch_size = _probe_batch_size(net, img[:1, :, :tile_h, :tile_w], max_memory)
+        else:
+            batch_size = 1
+
+    weight = (_blend_window(tile_h * scale, overlap_h * scale, window, img.device)[:, None] *
+              _blend_window(tile_w * scale, overlap_w * scale, window, img.device)[None, :])
+    output, weights = None, torch.zeros(1, 1, h * scale, w * scale, device=img.device)
+    for start in range(0, len(tiles), batch_size):
+        chunk = tiles[start:start + batch_size]
+        inputs = [img[i, :, top:top + tile_h, left:left + tile_w] for i, top, left in chunk]
+        if static_shape:
+            inputs += inputs[-1:] * (batch_size - len(chunk))
+        out = net(torch.stack(inputs))
+        if output is None:
+            output = img.new_zeros(b, out.shape[1], h * scale, w * scale, dtype=torch.float32)
+        for (i, top, left), out_tile in zip(chunk, out):
+            top, left = top * scale, left * scale
+            output[i, :, top:top + tile_h * scale, left:left + tile_w * scale] += out_tile * weight
+            if i == 0:
+                weights[..., top:top + tile_h * scale, left:left + tile_w * scale] += weight
+    return (output / weights).to(img.dtype)
@@ -0,0 +1,122 @@
+"""Speed and quality of the directional filter banks of the contourlet prior.
+
+For every dfilt (the McClellan 'dmaxflat7' and the ladder 'pkva*' ones):
+  - the latency of the decomposition of DAT (batch_multi_channel_pdfbdec,
+    maxflat, nlevs=[3]) on a (batch, 1, h, w) input, with the given backend
+    (the ladder DFB always runs convolutions),
+  - the directional selectivity of the DFB: the mean share of the energy of
+    oriented cosines that falls in their strongest subband (1 / 2^n for a
+    DFB without any selectivity, 1 for an ideal one), with the filters DAT
+    uses (legacy_filters for dmaxflat7),
+  - with -opt, the PSNR / SSIM (Y channel) of the network of the option file
+    on its first test set, with its weights and the given dfilt.
+
+    python scripts/benchmark_dfb.py --size 256 256 --batch 4
+    python scripts/benchmark_dfb.py -opt options/Test/my_test_CoRPLE_light_x2.yml --max_images 20
+"""
+import argparse
+import copy
+import math
+import numpy as np
+import time
+import torch
+import yaml
+
+from basicsr.archs.contourlet_transform.pycontourlet import (ContourletFilterBank, batch_multi_channel_pdfbdec,
+                                                            dfbdec, dfbdec_l)
+from basicsr.data import build_dataset
+from basicsr.infer import load_network
+from basicsr.metrics import calculate_psnr, calculate_ssim
+from basicsr.utils import tensor2img
+from basicsr.utils.options import ordered_yaml
+
+DFILTS = ('dmaxflat7', 'pkva6', 'pkva8', 'pkva12')
+
+
+def latency(dfilt, x, repeat, backend):
+    bank = ContourletFilterBank(pfilt='maxflat', dfilt=dfilt, nlevs=[3]).to(x.device)
+    with torch.no_grad():
+        batch_multi_channel_pdfbdec(x, 'maxflat', dfilt, [3], filter_bank=bank, backend=backend)
+        if x.is_cuda:
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        for _ in range(repeat):
+            batch_multi_channel_pdfbdec(x, 'maxflat', dfilt, [3], filter_bank=bank, backend=backend)
+        if x.is_cuda:
+            torch.cuda.synchronize()
+    return (time.perf_counter() - start) / repeat
+
+
+def selectivity(dfilt, n=3, size=128, num_angles=24):
+    """Mean share of the energy of oriented cosines in their strongest
+    subband of an n-level DFB."""
+    bank = ContourletFilterBank(pfilt=None, dfilt=dfilt, nlevs=[n]).double()
+    yy, xx = torch.meshgrid(torch.arange(size).double(), torch.arange(size).double())
+    shares = []
+    for theta in np.linspace(0, np.pi, num_angles, endpoint=False):
+        for omega in (0.35 * np.pi, 0.6 * np.pi):
+            img = torch.cos(omega * (xx * math.cos(theta) + yy * math.sin(theta)))[None, None]
+            if dfilt.startswith('pkva'):
+                y = dfbdec_l(img, dfilt, n, filter_bank=bank)
+            else:
+                y = dfbdec(img, dfilt, n, filter_bank=bank)
+            energy = torch.stack([(t**2).sum() for t in y])
+            shares.append((energy.max() / energy.sum()).item())
+    return float(np.mean(shares))
+
+
+def sr_quality(opt, args, dfilt, device):
+    """PSNR / SSIM (Y channel) of network_g with `dfilt` on the first test
+    set of `opt`."""
+    opt = copy.deepcopy(opt)
+    opt['network_g']['contourlet_dfilt'] = dfilt
+    net = load_network(args, opt, device)
+    scale = opt['scale']
+    dataset_opt = next(iter(opt['datasets'].values()))
+    dataset_opt.update(phase='val', scale=scale)
+    dataset = build_dataset(dataset_opt)
+
+    psnr, ssim = [], []
+    with torch.no_grad():
+        for idx in range(min(len(dataset), args.max_images or len(dataset))):
+            data = dataset[idx]
+            sr = tensor2img(net(data['lq'][None].to(device)).float().cpu())
+            gt = tensor2img(data['gt'])
+            psnr.append(calculate_psnr(sr, gt, crop_border=scale, test_y_channel=True))
+            ssim.append(calculate_ssim(sr, gt, crop_border=scale, test_y_channel=True))
+    return float(np.mean(psnr)), float(np.mean(ssim))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-opt', type=str, default=None, help='Test option YAML file, for the SR quality.')
+    parser.add_argument('--model_path', type=str, default=None, help='Checkpoint, overrides path:pretrain_network_g.')
+    parser.add_argument('--param_key', type=str, default='params', help='Parameter key in the checkpoint.')
+    parser.add_argument('--max_images', type=int, default=None, help='Number of test images, all if None.')
+    parser.add_argument('--dfilt', type=str, nargs='+', default=list(DFILTS))
+    parser.add_argument('--size', type=int, nargs=2, default=[256, 256], help='H W of the decomposed input.')
+    parser.add_argument('--batch', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--backend', type=str, default='auto', choices=['auto', 'conv', 'fft'],
+                        help='Filtering of the decomposition, see batch_multi_channel_pdfbdec.')
+    parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    opt = None
+    if args.opt is not None:
+        with open(args.opt, mode='r') as f:
+            opt = yaml.load(f, Loader=ordered_yaml()[0])
+
+    x = torch.randn(args.batch, 1, *args.size, device=device)
+    for dfilt in args.dfilt:
+        line = (f'{dfilt:>9}: {latency(dfilt, x, args.repeat, args.backend) * 1000:8.2f} ms, '
+                f'directional selectivity: {selectivity(dfilt):.3f}')
+        if opt is not None:
+            psnr, ssim = sr_quality(opt, args, dfilt, device)
+            line += f', PSNR: {psnr:.4f} dB, SSIM: {ssim:.4f}'
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Latency of DAT in eager mode and in its export mode on CPU.
+
+Compares the eager model with the TorchScript module of basicsr/export.py
+and, with torch>=2.0, torch.compile of the same model, for one input size,
+and checks that they give the same outputs.
+
+    python scripts/benchmark_export.py -opt options/Test/my_test_CoRPLE_light_x2.yml --tile 64 64
+"""
+import argparse
+import copy
+import time
+import torch
+import yaml
+
+from basicsr.archs import build_network
+from basicsr.export import prepare_for_export, trace_network
+from basicsr.utils.options import ordered_yaml
+
+# light x2 model, when no option file is given
+DEFAULT_NETWORK = dict(
+    type='DAT', upscale=2, in_chans=3, img_size=64, img_range=1., depth=[18], embed_dim=60, num_heads=[6],
+    expansion_factor=2, resi_connection='3conv', split_size=[8, 32], upsampler='pixelshuffledirect')
+
+
+def latency(fn, x, repeat):
+    with torch.no_grad():
+        fn(x)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            fn(x)
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-opt', type=str, default=None, help='Option YAML file with network_g.')
+    parser.add_argument('--tile', type=int, nargs=2, default=[64, 64], help='Input size (h w).')
+    parser.add_argument('--batch_size', type=int, default=1)
+    parser.add_argument('--fuse', action='store_true', help='Fuse the network for inference (fuse_for_inference).')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--threads', type=int, default=None, help='Number of CPU threads.')
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    if args.opt is not None:
+        with open(args.opt, mode='r') as f:
+            network_opt = yaml.load(f, Loader=ordered_yaml()[0])['network_g']
+    else:
+        network_opt = DEFAULT_NETWORK
+    net = build_network(copy.deepcopy(network_opt)).eval()
+    x = prepare_for_export(net, (args.batch_size, network_opt.get('in_chans', 3), *args.tile), fuse=args.fuse)
+
+    modes = [('eager', net), ('torchscript', trace_network(net, x))]
+    if hasattr(torch, 'compile'):
+        modes.append(('compile', torch.compile(net, dynamic=False)))
+
+    with torch.no_grad():
+        ref = net(x)
+        for name, fn in modes:
+            start = time.perf_counter()
+            diff = (fn(x) - ref).abs().max().item()
+            first = time.perf_counter() - start
+            print(f'{name:>11}: {latency(fn, x, args.repeat) * 1000:9.2f} ms '
+                  f'(first call {first:.1f} s), max abs diff: {diff:.2e}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""Microbenchmark of the window partition of the spatial attention of DAT.
+
+Compares the partition/merge of q, k and v of one shifted DSTB block as it
+was (pad, roll, three im2win, windows2img, roll, crop) with the fused
+qkv2windows/windows2tokens gathers, and checks that both give the same
+windows. The attention itself is left out (v goes through unchanged).
+
+    python scripts/benchmark_window_partition.py --size 256 256 --batch 4
+"""
+import argparse
+import time
+import torch
+from torch.nn import functional as F
+
+from basicsr.archs.dat_arch import img2windows, qkv2windows, window_indices, windows2img, windows2tokens
+
+DATA_OPS = ('aten::copy_', 'aten::index_select', 'aten::cat', 'aten::roll', 'aten::constant_pad_nd')
+
+
+def reference(qkv, H, W, split_size, shift_size, heads):
+    """Former partition and merge, returns the merged v: (B, L, C)."""
+    B, L, C3 = qkv.shape
+    C = C3 // 3
+    qkv = qkv.reshape(B, -1, 3, C).permute(2, 0, 1, 3)  # 3, B, HW, C
+
+    max_split_size = max(split_size)
+    pad_r = (max_split_size - W % max_split_size) % max_split_size
+    pad_b = (max_split_size - H % max_split_size) % max_split_size
+    qkv = qkv.reshape(3 * B, H, W, C).permute(0, 3, 1, 2)
+    qkv = F.pad(qkv, (0, pad_r, 0, pad_b)).reshape(3, B, C, -1).transpose(-2, -1)
+    _H, _W = pad_b + H, pad_r + W
+
+    qkv = qkv.view(3, B, _H, _W, C)
+    halves = [
+        torch.roll(qkv[..., :C // 2], shifts=(-shift_size[0], -shift_size[1]), dims=(2, 3)).view(3, B, -1, C // 2),
+        torch.roll(qkv[..., C // 2:], shifts=(-shift_size[1], -shift_size[0]), dims=(2, 3)).view(3, B, -1, C // 2)
+    ]
+    out = []
+    for i, (H_sp, W_sp) in enumerate([split_size, split_size[::-1]]):
+
+        def im2win(x):
+            x = x.transpose(-2, -1).contiguous().view(B, C // 2, _H, _W)
+            x = img2windows(x, H_sp, W_sp)
+            return x.reshape(-1, H_sp * W_sp, heads, C // 2 // heads).permute(0, 2, 1, 3).contiguous()
+
+        q, k, v = im2win(halves[i][0]), im2win(halves[i][1]), im2win(halves[i][2])
+        x = v.transpose(1, 2).reshape(-1, H_sp * W_sp, C // 2)
+        x = windows2img(x, H_sp, W_sp, _H, _W)
+        shift = shift_size if i == 0 else shift_size[::-1]
+        x = torch.roll(x, shifts=(shift[0], shift[1]), dims=(1, 2))
+        out.append(x[:, :H, :W, :].reshape(B, H * W, C // 2))
+    return torch.cat(out, dim=2)
+
+
+def fused(qkv, H, W, split_size, shift_size, heads):
+    """qkv2windows/windows2tokens, returns the merged v: (B, L, C)."""
+    B, L, C3 = qkv.shape
+    C = C3 // 3
+    max_split_size = max(split_size)
+    pad_r = (max_split_size - W % max_split_size) % max_split_size
+    pad_b = (max_split_size - H % max_split_size) % max_split_size
+    _H, _W = pad_b + H, pad_r + W
+    if pad_r or pad_b:
+        qkv = torch.cat([qkv, qkv.new_zeros(B, 1, C3)], dim=1)
+    qkv = qkv.view(B, -1, 3, 2, heads, C // 2 // heads)
+
+    out = []
+    for i, (H_sp, W_sp) in enumerate([split_size, split_size[::-1]]):
+        shift = shift_size if i == 0 else shift_size[::-1]
+        index, inverse = window_indices(H, W, _H, _W, H_sp, W_sp, shift[0], shift[1], qkv.device)
+        q, k, v = qkv2windows(qkv[:, :, :, i], index, H_sp * W_sp)
+        out.append(windows2tokens(v, inverse))
+    return torch.cat(out, dim=2).view(B, L, C)
+
+
+def profile(fn, args, repeat):
+    fn(*args)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(*args)
+    if args[0].is_cuda:
+        torch.cuda.synchronize()
+    elapsed = (time.perf_counter() - start) / repeat
+
+    with torch.autograd.profiler.profile() as prof:
+        fn(*args)
+    counts = {e.key: e.count for e in prof.key_averages() if e.key in DATA_OPS}
+    return elapsed, counts
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, nargs=2, default=[256, 256], help='H W of the feature map.')
+    parser.add_argument('--batch', type=int, default=4)
+    parser.add_argument('--dim', type=int, default=60)
+    parser.add_argument('--heads', type=int, default=6)
+    parser.add_argument('--split_size', type=int, nargs=2, default=[8, 32])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+    args = parser.parse_args()
+
+    H, W = args.size
+    split_size = tuple(args.split_size)
+    shift_size = (split_size[0] // 2, split_size[1] // 2)
+    qkv = torch.randn(args.batch, H * W, 3 * args.dim, device=args.device)
+    inputs = (qkv, H, W, split_size, shift_size, args.heads // 2)
+
+    with torch.no_grad():
+        diff = (reference(*inputs) - fused(*inputs)).abs().max().item()
+        print(f'max abs diff: {diff}')
+        for name, fn in (('reference', reference), ('fused', fused)):
+            elapsed, counts = profile(fn, inputs, args.repeat)
+            print(f'{name:>9}: {elapsed * 1000:8.2f} ms, data movement ops: {sum(counts.values())} {counts}')
+
+
+if __name__ == '__main__':
+    main()
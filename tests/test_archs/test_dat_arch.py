@@ -0,0 +1,73 @@
+import threading
+
+import pytest
+import torch
+from torch.nn import functional as F
+
+from basicsr.archs.dat_arch import DAT, launch_contourlet_prior
+
+pytestmark = pytest.mark.skipif(not hasattr(F, 'scaled_dot_product_attention'),
+                                reason='the sdpa backend needs torch>=2.1')
+
+
+def build_dat(**kwargs):
+    return DAT(upscale=2, in_chans=3, img_size=64, img_range=1., depth=[2, 2], embed_dim=60, num_heads=[6, 6],
+               expansion_factor=2, resi_connection='1conv', split_size=[8, 16], drop_path_rate=0., **kwargs)
+
+
+@pytest.fixture(scope='module')
+def models():
+    torch.manual_seed(0)
+    model = build_dat(attn_backend='math')
+    model_sdpa = build_dat(attn_backend='sdpa')
+    model_sdpa.load_state_dict(model.state_dict())
+    return model, model_sdpa
+
+
+# padded (40 and 72 are no multiples of 16) and shifted windows, a non-square one, and a single row of 16x8
+# windows (all on the rolled border)
+@pytest.mark.parametrize('batch, size', [(2, (64, 96)), (2, (40, 72)), (1, (64, 96)), (1, (16, 48))])
+def test_sdpa_backend_eval(models, batch, size):
+    model, model_sdpa = models
+    model.eval()
+    model_sdpa.eval()
+    x = torch.rand(batch, 3, *size)
+    with torch.no_grad():
+        out, out_sdpa = model(x), model_sdpa(x)
+    assert out.shape == (batch, 3, size[0] * 2, size[1] * 2)
+    assert torch.allclose(out, out_sdpa, atol=1e-5, rtol=1e-4)
+
+
+@pytest.mark.parametrize('size', [(64, 96), (40, 72)])
+def test_sdpa_backend_train(models, size):
+    model, model_sdpa = models
+    model.train()
+    model_sdpa.train()
+    x = torch.rand(2, 3, *size)
+    outs, grads = [], []
+    for net in (model, model_sdpa):
+        net.zero_grad()
+        out = net(x)
+        out.square().mean().backward()
+        outs.append(out.detach())
+        grads.append({k: p.grad.clone() for k, p in net.named_parameters() if p.grad is not None})
+    assert torch.allclose(outs[0], outs[1], atol=1e-5, rtol=1e-4)
+    assert grads[0].keys() == grads[1].keys()
+    for k in grads[0]:
+        assert torch.allclose(grads[0][k], grads[1][k], atol=1e-5, rtol=1e-3), k
+
+
+def test_contourlet_prior_cpu_inline():
+    """On CPU, the prior is computed right away in the calling thread (no
+    worker thread round trip), with the grad mode of the caller."""
+    calls = []
+
+    def fn(t):
+        calls.append((threading.current_thread(), torch.is_grad_enabled()))
+        return t * 2
+
+    x = torch.rand(1, 3, 8, 8)
+    with torch.no_grad():
+        wait = launch_contourlet_prior(fn, x)
+    assert calls == [(threading.current_thread(), False)]
+    assert torch.equal(wait(), x * 2)
@@ -0,0 +1,103 @@
+import pytest
+import torch
+
+from basicsr.archs.contourlet_transform.pycontourlet import (ContourletFilterBank, batch_multi_channel_pdfbdec,
+                                                            batch_multi_channel_pdfbrec, dfbdec, dfbrec, fbdec_l, fbrec,
+                                                            fbrec_l, pdown, pup, qup)
+
+
+def flatten(coefs):
+    return [coefs[0]] + [t for level in coefs[1:] for t in level]
+
+
+@pytest.mark.parametrize('backend', ['conv', 'fft'])
+@pytest.mark.parametrize('dfilt, nlevs', [('dmaxflat7', [2, 3]), ('dmaxflat7', [0, 2]), ('pkva6', [2])])
+def test_pdfbdec_gradcheck(backend, dfilt, nlevs):
+    """The gradients of the decomposition (contourlet_grad of DAT) with both
+    backends are the ones of its finite differences."""
+    bank = ContourletFilterBank(dfilt=dfilt, nlevs=nlevs).double()
+    x = torch.rand(1, 1, 16, 16, dtype=torch.float64, requires_grad=True)
+
+    def decompose(t):
+        return tuple(flatten(batch_multi_channel_pdfbdec(t, dfilt=dfilt, nlevs=nlevs, filter_bank=bank,
+                                                         backend=backend)))
+
+    assert torch.autograd.gradcheck(decompose, (x, ))
+
+
+@pytest.mark.parametrize('legacy_filters', [True, False])
+@pytest.mark.parametrize('size, nlevs', [((64, 96), [3]), ((64, 96), [0, 2, 3]), ((36, 50), [2, 3]),
+                                         ((64, 64), [4])])
+def test_pdfbdec_fft_backend(size, nlevs, legacy_filters):
+    """The frequency-domain backend gives the subbands and the gradients of
+    the convolutions (the pyramidal levels of odd sizes, as the 9x13 level
+    of 36x50, fall back to convolutions)."""
+    bank = ContourletFilterBank(nlevs=nlevs, legacy_filters=legacy_filters).double()
+    x = torch.rand(1, 2, *size, dtype=torch.float64, requires_grad=True)
+    y, grads = {}, {}
+    for backend in ('conv', 'fft'):
+        y[backend] = flatten(batch_multi_channel_pdfbdec(x, nlevs=nlevs, filter_bank=bank, backend=backend))
+        grads[backend], = torch.autograd.grad(sum((t * t.detach().sin()).sum() for t in y[backend]), x)
+    for conv, fft in zip(y['conv'], y['fft']):
+        assert conv.shape == fft.shape
+        assert torch.allclose(conv, fft, rtol=0, atol=1e-12)
+    assert torch.allclose(grads['conv'], grads['fft'], rtol=0, atol=1e-12)
+
+
+@pytest.mark.parametrize('batched_dfb', [False, True])
+@pytest.mark.parametrize('nlevs', [[1], [3], [5], [0, 2, 3]])
+def test_pdfb_perfect_reconstruction(nlevs, batched_dfb):
+    bank = ContourletFilterBank(nlevs=nlevs, legacy_filters=False).double()
+    x = torch.rand(2, 3, 64, 96, dtype=torch.float64)
+    y = batch_multi_channel_pdfbdec(x, nlevs=nlevs, filter_bank=bank)
+    rec = batch_multi_channel_pdfbrec(y, filter_bank=bank, batched_dfb=batched_dfb)
+    # (up to the float32 filter coefficients)
+    assert (rec - x).abs().max().item() < 1e-6
+
+
+@pytest.mark.parametrize('dfilt', ['pkva6', 'pkva8', 'pkva12', 'pkva'])
+@pytest.mark.parametrize('nlevs', [[1], [3], [5], [0, 2, 3]])
+def test_pdfb_ladder_perfect_reconstruction(nlevs, dfilt):
+    """The ladder DFB is inverted by dfbrec_l, with the default filter bank."""
+    x = torch.rand(2, 3, 64, 96, dtype=torch.float64)
+    y = batch_multi_channel_pdfbdec(x, dfilt=dfilt, nlevs=nlevs)
+    rec = batch_multi_channel_pdfbrec(y, dfilt=dfilt)
+    # (up to the float32 filter coefficients)
+    assert (rec - x).abs().max().item() < 1e-6
+
+@pytest.mark.parametrize('backend', ['conv', 'fft'])
+def test_pdfb_reconstruction_default_filter_bank(backend):
+    """With the default arguments, the reconstruction uses the filter bank
+    of the decomposition: the wavelet levels are inverted, the legacy DFB
+    is rejected instead of giving other images."""
+    x = torch.rand(2, 1, 64, 64)
+    rec = batch_multi_channel_pdfbrec(batch_multi_channel_pdfbdec(x, nlevs=[0], backend=backend))
+    assert (rec - x).abs().max().item() < 1e-5
+    with pytest.raises(ValueError):
+        batch_multi_channel_pdfbrec(batch_multi_channel_pdfbdec(x, backend=backend))
+    with pytest.raises(ValueError):
+        dfbrec(dfbdec(x, 'dmaxflat7', 3), 'dmaxflat7')
+
+    # levels of the subbands that are not the ones of the filter bank
+    bank = ContourletFilterBank(nlevs=[2, 3], legacy_filters=False)
+    y = batch_multi_channel_pdfbdec(x, nlevs=[2, 3], filter_bank=bank, backend=backend)
+    assert (batch_multi_channel_pdfbrec(y, filter_bank=bank) - x).abs().max().item() < 1e-5
+    with pytest.raises(ValueError):
+        batch_multi_channel_pdfbrec(y[:1] + y[2:], filter_bank=bank)
+
+
+def test_invalid_types():
+    x = torch.rand(1, 1, 8, 8)
+    f = torch.rand(3)
+    with pytest.raises(ValueError):
+        qup(x, '3r', 0)
+    with pytest.raises(ValueError):
+        pdown(x, 'x', 0)
+    with pytest.raises(ValueError):
+        pup(x, 4, 0)
+    with pytest.raises(ValueError):
+        fbrec(x, x, f, f, 'x', '1r', 'per')
+    with pytest.raises(ValueError):
+        fbdec_l(x, f, 'x', '1r', 'per')
+    with pytest.raises(ValueError):
+        fbrec_l(x, x, f, 'x', '1r', 'per')
@@ -0,0 +1,61 @@
+import pytest
+import torch
+from torch import nn
+
+from basicsr.infer import TRACED_SHAPE_FILE, load_traced_network, traced_tile_kwargs
+from basicsr.utils import tile_inference
+
+
+class StaticNet(nn.Module):
+    """x2 nearest upsampling that only accepts inputs of one shape."""
+
+    def __init__(self, input_shape):
+        super().__init__()
+        self.input_shape = input_shape
+
+    def forward(self, x):
+        assert tuple(x.shape) == self.input_shape, x.shape
+        return x.repeat_interleave(2, 2).repeat_interleave(2, 3)
+
+
+@pytest.mark.parametrize('size', [(3, 40, 56), (2, 20, 24), (1, 20, 56)])
+def test_tile_inference_static_shape(size):
+    """Frames smaller than the tile are padded and the last batch of tiles
+    is filled, so the network only sees its traced shape."""
+    net = StaticNet((4, 3, 24, 32))
+    img = torch.rand(size[0], 3, *size[1:])
+    output = tile_inference(net, img, 2, tile_size=(24, 32), tile_overlap=8, batch_size=4, static_shape=True)
+    assert torch.allclose(output, img.repeat_interleave(2, 2).repeat_interleave(2, 3), atol=1e-6)
+
+
+@pytest.mark.parametrize('tile_size, tile_overlap', [(32, 32), ((24, 48), 24), (16, 40)])
+def test_tile_inference_overlap_not_smaller_than_tile(tile_size, tile_overlap):
+    """An overlap of the tile size or more (a stride of 1 pixel) is rejected
+    before running the network."""
+    calls = []
+
+    def net(x):
+        calls.append(x.shape)
+        return x
+
+    with pytest.raises(ValueError):
+        tile_inference(net, torch.rand(1, 3, 48, 80), 1, tile_size=tile_size, tile_overlap=tile_overlap)
+    assert not calls
+
+def test_traced_input_shape(tmp_path):
+    path = str(tmp_path / 'net.pt')
+    with torch.no_grad():
+        traced = torch.jit.trace(nn.Conv2d(3, 3, 3, padding=1), torch.rand(2, 3, 24, 32))
+    traced.save(path, _extra_files={TRACED_SHAPE_FILE: '2,3,24,32'})
+
+    _, input_shape = load_traced_network(path, torch.device('cpu'))
+    assert input_shape == (2, 3, 24, 32)
+    assert traced_tile_kwargs((24, 32), input_shape) == dict(batch_size=2, static_shape=True)
+    # whole frames (--tile 0) or another tile size
+    for tile in [(0, 0), (32, 32)]:
+        with pytest.raises(ValueError):
+            traced_tile_kwargs(tile, input_shape)
+
+    traced.save(path)
+    with pytest.raises(ValueError):
+        load_traced_network(path, torch.device('cpu'))